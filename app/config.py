@@ -18,6 +18,11 @@ class Settings:
     DB_PASSWORD = os.getenv("DB_PASSWORD", "")
     DB_DATABASE = os.getenv("DB_DATABASE", "banner_ai")
     DB_SSL = os.getenv("DB_SSL", "")
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5")) # Số connection MySQL giữ sẵn trong pool
+    DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true" # Kiểm tra connection trước khi cho mượn
+    DB_POOL_PING_INTERVAL = float(os.getenv("DB_POOL_PING_INTERVAL", "30")) # Chỉ ping connection đã rảnh quá số giây này (0 = luôn ping)
+    CONFIG_CACHE_CHECK_INTERVAL = float(os.getenv("CONFIG_CACHE_CHECK_INTERVAL", "5")) # Chu kỳ (giây) kiểm tra version system_configs để nạp lại cache
+    DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "8")) # Số thread chạy truy vấn DB cho các route async
     
  
     # AUTH & SECURITY
@@ -64,8 +69,70 @@ class Settings:
     LLM_NAME_GOOGLE = GOOGLE_LLM
     LLM_NAME_OPENAI = os.getenv("LLM_NAME_OPENAI", OPENAI_LLM)
 
+    # TASK QUEUE (Worker pool xử lý banner)
+    TASK_WORKERS = int(os.getenv("TASK_WORKERS", "4")) # Số worker chạy song song
+    TASK_MAX_CONCURRENCY = int(os.getenv("TASK_MAX_CONCURRENCY", str(TASK_WORKERS))) # Giới hạn tổng số task chạy cùng lúc
+    TASK_MAX_PER_USER = int(os.getenv("TASK_MAX_PER_USER", "1")) # Giới hạn số task chạy cùng lúc của một user
+    TASK_QUEUE_BACKEND = os.getenv("TASK_QUEUE_BACKEND", "ram") # "ram" (asyncio.Queue) hoặc "db" (bảng tasks, chạy được nhiều process)
+    TASK_LEASE_SECONDS = int(os.getenv("TASK_LEASE_SECONDS", "120")) # Thời hạn lease của một task đã claim
+    TASK_HEARTBEAT_SECONDS = int(os.getenv("TASK_HEARTBEAT_SECONDS", "30")) # Chu kỳ gia hạn lease khi task đang chạy
+    TASK_POLL_INTERVAL = float(os.getenv("TASK_POLL_INTERVAL", "2")) # Chu kỳ worker hỏi DB khi hàng đợi trống
+    TASK_MAX_ATTEMPTS = int(os.getenv("TASK_MAX_ATTEMPTS", "3")) # Số lần claim tối đa trước khi đánh dấu failed
+    TASK_STREAM_HEARTBEAT_SECONDS = float(os.getenv("TASK_STREAM_HEARTBEAT_SECONDS", "15")) # Chu kỳ ping SSE (giữ kết nối)
+    TASK_STREAM_DB_POLL_SECONDS = float(os.getenv("TASK_STREAM_DB_POLL_SECONDS", "2")) # Chu kỳ đọc trạng thái task từ DB khi task không chạy trong process này
+    TASK_STREAM_MAX_SECONDS = int(os.getenv("TASK_STREAM_MAX_SECONDS", "600")) # Thời gian tối đa của một kết nối stream tiến trình
+    TASK_STREAM_TOKEN_TTL = int(os.getenv("TASK_STREAM_TOKEN_TTL", "120")) # Số giây hiệu lực của token trên URL stream (chỉ cần lúc mở kết nối)
+    BANNER_IMAGE_CONCURRENCY = int(os.getenv("BANNER_IMAGE_CONCURRENCY", "4")) # Số ảnh của một task được sinh song song
+    BANNER_OUTPUT_FORMAT = os.getenv("BANNER_OUTPUT_FORMAT", "auto") # "auto" (giữ bytes gốc khi đúng kích thước, còn lại PNG), "png", "webp", "jpeg", "avif" (cần Pillow >= 11.2, nếu không dùng WEBP)
+    BANNER_OUTPUT_QUALITY = int(os.getenv("BANNER_OUTPUT_QUALITY", "90")) # Chất lượng mã hóa WebP/JPEG/AVIF
+
+    # UPLOAD PIPELINE (Cloudinary chạy nền)
+    UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "2")) # Số upload chạy song song
+    UPLOAD_MAX_ATTEMPTS = int(os.getenv("UPLOAD_MAX_ATTEMPTS", "5")) # Số lần thử upload một ảnh
+    UPLOAD_BACKOFF_BASE = float(os.getenv("UPLOAD_BACKOFF_BASE", "2")) # Giây chờ trước lần thử lại đầu tiên (nhân đôi mỗi lần)
+    UPLOAD_BACKOFF_MAX = float(os.getenv("UPLOAD_BACKOFF_MAX", "60")) # Thời gian chờ tối đa giữa hai lần thử
+    UPLOAD_RESUME_LEASE_SECONDS = int(os.getenv("UPLOAD_RESUME_LEASE_SECONDS", "300")) # Trong khoảng này chỉ một process quét lại upload dở lúc startup
+
+    # IMAGE VARIANTS (thumbnail/srcset)
+    IMAGE_VARIANT_WIDTHS = os.getenv("IMAGE_VARIANT_WIDTHS", "320,768,1280") # Các bề rộng biến thể, cách nhau bởi dấu phẩy
+    IMAGE_VARIANT_QUALITY = int(os.getenv("IMAGE_VARIANT_QUALITY", "80")) # Chất lượng WebP của biến thể
+    IMAGE_VARIANTS_EAGER = os.getenv("IMAGE_VARIANTS_EAGER", "true").lower() == "true" # Tạo biến thể ngay khi sinh banner (false = tạo khi có request)
+
+    # HTTP CACHE (ảnh tên UUID không bao giờ thay đổi)
+    IMAGE_CACHE_MAX_AGE = int(os.getenv("IMAGE_CACHE_MAX_AGE", "31536000")) # max-age (giây) của Cache-Control cho ảnh
+
+    # PUBLIC GALLERY (snapshot trong RAM của /generate/public-banners)
+    GALLERY_CACHE_TTL = float(os.getenv("GALLERY_CACHE_TTL", "300")) # Số giây trước khi dựng lại snapshot dù không có thay đổi (vd. đổi tên/avatar user)
+    GALLERY_VERSION_CHECK_INTERVAL = float(os.getenv("GALLERY_VERSION_CHECK_INTERVAL", "5")) # Chu kỳ (giây) kiểm tra version gallery để thấy thay đổi từ process khác
+    GALLERY_CACHE_MAX_AGE = int(os.getenv("GALLERY_CACHE_MAX_AGE", "30")) # max-age (giây) của Cache-Control cho JSON gallery
+
+    # PROMPT CACHE (kết quả phân tích/sinh prompt theo fingerprint request)
+    PROMPT_CACHE_ENABLED = os.getenv("PROMPT_CACHE_ENABLED", "true").lower() == "true" # Bật/tắt cache kết quả LLM
+    PROMPT_CACHE_SIZE = int(os.getenv("PROMPT_CACHE_SIZE", "1024")) # Số kết quả tối đa giữ trong RAM (LRU)
+    PROMPT_CACHE_TTL = float(os.getenv("PROMPT_CACHE_TTL", "3600")) # Số giây giữ kết quả trong RAM
+    PROMPT_CACHE_DB_TTL = int(os.getenv("PROMPT_CACHE_DB_TTL", "604800")) # Số giây giữ kết quả trong bảng prompt_cache (7 ngày)
+    SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true" # Dùng lại kết quả của request cùng nội dung, khác cách viết
+    SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "5000")) # Số request tối đa được ghi nhớ
+    SEMANTIC_CACHE_TRACK_SIMILARITY = os.getenv("SEMANTIC_CACHE_TRACK_SIMILARITY", "false").lower() == "true" # Thống kê độ tương đồng embedding (chạy nền, tốn 1 lần gọi embedding/request mới)
+    SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95")) # Ngưỡng cosine để đếm near_duplicates trong thống kê
+    SEMANTIC_CACHE_EMBEDDING_MODEL = os.getenv("SEMANTIC_CACHE_EMBEDDING_MODEL", "openai") # Tên model trong ServiceManager.get_embedding_model
+
+    # PAGINATION (keyset theo created_at, id)
+    PAGE_DEFAULT_LIMIT = int(os.getenv("PAGE_DEFAULT_LIMIT", "50")) # Số row mặc định mỗi trang của các API danh sách
+    PAGE_MAX_LIMIT = int(os.getenv("PAGE_MAX_LIMIT", "200")) # Số row tối đa mỗi trang
+
+    # ADMIN STATS (rollup daily_stats)
+    ADMIN_STATS_CACHE_TTL = float(os.getenv("ADMIN_STATS_CACHE_TTL", "15")) # Số giây cache response /admin/stats
+    STATS_RECONCILE_HOUR = int(os.getenv("STATS_RECONCILE_HOUR", "3")) # Giờ (0-23, giờ server) chạy job đối soát counter hằng đêm (-1 = tắt)
+
+    # FONT
+    FONT_CACHE_SIZE = int(os.getenv("FONT_CACHE_SIZE", "256")) # Số FreeTypeFont (path, size) giữ trong cache LRU
+
     # OTHER SETTINGS
     ADMIN_EMAILS = os.getenv("ADMIN_EMAILS", "") # Danh sách email Admin, cách nhau bởi dấu phẩy
+    ADMIN_EMAIL_SET = frozenset(e.strip().lower() for e in ADMIN_EMAILS.split(",") if e.strip()) # ADMIN_EMAILS đã parse sẵn
+    USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "30")) # Số giây cache thông tin user đã xác thực (0 = tắt cache)
+    USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "2048")) # Số user tối đa giữ trong cache
     API_URL = os.getenv("API_URL", "http://localhost:55002")
     URL_API = os.getenv("URL_API", API_URL)
     NUM_DOC = int(os.getenv("NUM_DOC", "3"))
@@ -3,6 +3,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
 from fastapi.staticfiles import StaticFiles
 import os
+import asyncio
 from app.routers import file_upload, banner, auth, payment, admin
 
 # Tạo instance của FastAPI với đường dẫn Docs tùy chỉnh
@@ -43,7 +44,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["*"]
+    expose_headers=["*", "X-Next-Cursor"]
 )
 
 # Cấu hình thư mục tĩnh để phục vụ file banner
@@ -87,6 +88,7 @@ app.include_router(api_router)
 
 from app.utils.task_manager import ram_task_manager
 from app.utils.database import check_and_migrate_db
+from app.config import settings
 
 @app.on_event("startup")
 async def startup_event():
@@ -95,6 +97,50 @@ async def startup_event():
     except Exception as e:
         print(f"[ERROR] Fatal error during startup database check: {e}")
     
+    # Dựng font index (kiểm tra checksum) và nạp sẵn font để render chữ không phải parse TTF
+    # ở task đầu tiên. Font còn thiếu được tải nền, task dùng font mặc định trong lúc chờ.
+    try:
+        from app.utils.font_manager import build_font_index, preload_fonts, download_fonts
+        missing_fonts = await asyncio.to_thread(build_font_index)
+        await asyncio.to_thread(preload_fonts)
+        if missing_fonts:
+            asyncio.create_task(asyncio.to_thread(download_fonts, missing_fonts))
+    except Exception as e:
+        print(f"[WARN] Font preload warning: {e}")
+
+    # Index tên file banner để /generate/view tra cứu không cần liệt kê thư mục
+    try:
+        from app.utils.banner_files import banner_file_index
+        await asyncio.to_thread(banner_file_index.build, BANNERS_DIR)
+    except Exception as e:
+        print(f"[WARN] Banner file index warning: {e}")
+
+    # Job đối soát hằng đêm cho các bảng counter (user_stats, daily_stats)
+    if settings.STATS_RECONCILE_HOUR >= 0:
+        from app.utils.stats_reconciler import run_nightly_reconciliation
+        asyncio.create_task(run_nightly_reconciliation())
+
+    # Dựng nền snapshot gallery trang chủ để request đầu tiên không phải chờ DB
+    try:
+        from app.utils.gallery_cache import public_gallery_cache
+        public_gallery_cache.invalidate()
+    except Exception as e:
+        print(f"[WARN] Public gallery warm-up warning: {e}")
+
+    # Pipeline upload Cloudinary chạy nền; đưa lại các banner còn URL local từ lần chạy trước
+    try:
+        from app.utils.upload_pipeline import upload_pipeline
+        await upload_pipeline.start()
+        await upload_pipeline.resume_pending(BANNERS_DIR, ram_task_manager.instance_id)
+    except Exception as e:
+        print(f"[WARN] Upload pipeline startup warning: {e}")
+
+    # Với backend "db", task pending/processing được worker claim lại (lease hết hạn) nên không reset
+    if ram_task_manager.backend == "db":
+        print("[OK] Startup: DB task queue will resume pending tasks")
+        await ram_task_manager.start_worker()
+        return
+
     # Reset các task bị kẹt từ lần chạy trước (pending/processing trong DB nhưng không có trong RAM)
     # Nếu không reset, frontend sẽ poll vô tận sau khi server restart
     try:
@@ -125,13 +171,11 @@ async def root():
 async def get_homepage_config():
     import json
     from app.models.banner_db import ConfigManager
-    manager = ConfigManager()
+    from app.utils.async_db import AsyncManager
     try:
-        data = manager.get_value("homepage_config", None)
+        data = await AsyncManager(ConfigManager).get_value("homepage_config", None)
         if data:
             return json.loads(data)
         return {}
     except Exception as e:
         return {}
-    finally:
-        manager.close()
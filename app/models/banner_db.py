@@ -1,8 +1,23 @@
 import sqlite3
 import os
-from datetime import datetime
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from app.config import settings
-from app.utils.database import get_db_connection
+from app.utils.database import get_db_connection, rebuild_daily_stats, reconcile_user_stats, STAT_DATE_SQL
+from app.utils.user_cache import invalidate_user, invalidate_user_email
+from app.utils.gallery_cache import public_gallery_cache
+from app.utils.pagination import keyset_condition, keyset_params
+
+
+# Row version của gallery trang chủ trong system_configs (cùng cơ chế với ConfigManager.VERSION_KEY)
+GALLERY_VERSION_KEY = "__gallery_version__"
+
+
+class LeaseLostError(Exception):
+    """Worker không còn giữ lease của task (đã hết hạn và bị worker khác claim): không được ghi kết quả."""
 
 class DBConnection:
     def __init__(self):
@@ -27,52 +42,202 @@ class DBConnection:
         if self.conn:
             self.conn.close()
 
+    @contextmanager
+    def transaction(self):
+        """Gom nhiều lệnh ghi thành một transaction (connection MySQL chạy autocommit nên phải mở rõ ràng)."""
+        if self.db_type == "mysql":
+            self.conn.start_transaction()
+        try:
+            yield
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    def _upsert(self, key, value):
+        """Ghi một key của system_configs (không commit)."""
+        if self.db_type == "mysql":
+            sql = f"INSERT INTO system_configs (`key`, `value`) VALUES (%s, %s) ON DUPLICATE KEY UPDATE `value` = VALUES(`value`)"
+        else:
+            sql = f"INSERT INTO system_configs (`key`, `value`) VALUES (?, ?) ON CONFLICT(`key`) DO UPDATE SET `value` = excluded.value"
+        self.cursor.execute(sql, (key, value))
+        return self.cursor.rowcount
+
+    def _invalidate_gallery(self):
+        """
+        Gallery trang chủ đã đổi: ghi version mới vào DB để các process khác dựng lại snapshot
+        trước khi phục vụ (xem PublicGalleryCache), rồi dựng lại snapshot của process này.
+        """
+        self._upsert(GALLERY_VERSION_KEY, f"{time.time_ns()}-{uuid.uuid4().hex[:8]}")
+        self.commit()
+        public_gallery_cache.invalidate()
+
+    def _bump_daily_stats(self, stat_date=None, banners=0, revenue_vnd=0, tokens_sold=0, new_users=0):
+        """
+        Cộng delta vào rollup daily_stats (stat_date None = ngày hiện tại của DB).
+        Không commit: chạy cùng lệnh ghi dữ liệu gốc rồi commit chung.
+        """
+        date_sql = "DATE(CURRENT_TIMESTAMP)" if stat_date is None else self.p
+        if self.db_type == "mysql":
+            upsert = ("ON DUPLICATE KEY UPDATE banners = banners + VALUES(banners), revenue_vnd = revenue_vnd + VALUES(revenue_vnd), "
+                      "tokens_sold = tokens_sold + VALUES(tokens_sold), new_users = new_users + VALUES(new_users)")
+        else:
+            upsert = ("ON CONFLICT(stat_date) DO UPDATE SET banners = banners + excluded.banners, revenue_vnd = revenue_vnd + excluded.revenue_vnd, "
+                      "tokens_sold = tokens_sold + excluded.tokens_sold, new_users = new_users + excluded.new_users")
+        sql = f"""INSERT INTO daily_stats (stat_date, banners, revenue_vnd, tokens_sold, new_users)
+                  VALUES ({date_sql}, {self.p}, {self.p}, {self.p}, {self.p}) {upsert}"""
+        params = (banners, revenue_vnd or 0, tokens_sold or 0, new_users)
+        self.cursor.execute(sql, params if stat_date is None else (stat_date, *params))
+
+    def _search_condition(self, columns, term):
+        """Điều kiện tìm kiếm chuỗi con, không phân biệt hoa thường, trên một hoặc nhiều cột (nối bằng OR)."""
+        pattern = "%" + term.lower().replace("!", "!!").replace("%", "!%").replace("_", "!_") + "%"
+        sql = " OR ".join(f"LOWER({column}) LIKE {self.p} ESCAPE '!'" for column in columns)
+        return f"({sql})", [pattern] * len(columns)
+
+    def _count_by_stat_date(self, table, where, params, extra_columns=""):
+        """Đếm các row sắp xóa theo ngày thống kê, để trừ khỏi daily_stats."""
+        sql = f"""SELECT {STAT_DATE_SQL} as stat_date, COUNT(*) as cnt{extra_columns}
+                  FROM {table} WHERE {where} GROUP BY {STAT_DATE_SQL}"""
+        self.cursor.execute(sql, params)
+        return [dict(row) for row in self.cursor.fetchall()]
+
 class ConfigManager(DBConnection):
+    # Cache system_configs dùng chung cho mọi instance trong process: nạp toàn bộ key bằng
+    # một truy vấn; mỗi CONFIG_CACHE_CHECK_INTERVAL giây chỉ đọc lại row version để biết
+    # process khác đã set_value hay chưa.
+    VERSION_KEY = "__config_version__"
+    _cache = None
+    _cache_version = None
+    _checked_at = 0.0
+    _cache_lock = threading.Lock()
+
     def __init__(self):
         super().__init__()
         # Table creation is now handled in init_db utility, but keep for safety if needed
         pass
 
     def get_value(self, key, default=None):
-        self.cursor.execute(f"SELECT value FROM system_configs WHERE `key` = {self.p}", (key,))
-        row = self.cursor.fetchone()
-        return row['value'] if row else default
+        values = self._get_cached_values()
+        return values[key] if key in values else default
+
+    def get_all_values(self):
+        # Bỏ các key nội bộ ("__...__": version, lease)
+        return {key: value for key, value in self._get_cached_values().items() if not key.startswith("__")}
 
     def set_value(self, key, value):
-        if self.db_type == "mysql":
-            sql = f"INSERT INTO system_configs (`key`, `value`) VALUES (%s, %s) ON DUPLICATE KEY UPDATE `value` = VALUES(`value`)"
-        else:
-            sql = f"INSERT INTO system_configs (`key`, `value`) VALUES (?, ?) ON CONFLICT(`key`) DO UPDATE SET `value` = excluded.value"
-        self.cursor.execute(sql, (key, str(value)))
+        rowcount = self._upsert(key, str(value))
+        # Đổi version để các process khác nạp lại cache ở lần kiểm tra kế tiếp
+        self._upsert(self.VERSION_KEY, f"{time.time_ns()}-{uuid.uuid4().hex[:8]}")
         self.commit()
-        return self.cursor.rowcount
+        ConfigManager.invalidate_cache()
+        return rowcount
+
+    @classmethod
+    def invalidate_cache(cls):
+        with cls._cache_lock:
+            cls._cache = None
+            cls._cache_version = None
+
+    def try_acquire_lease(self, name, owner, lease_seconds):
+        """
+        Lease liên process lưu trong system_configs (value = "<epoch hết hạn, 12 chữ số>|owner").
+        Trả về True nếu `owner` giành được lease: key chưa có, hoặc lease cũ đã hết hạn.
+        """
+        now = int(time.time())
+        value = f"{now + lease_seconds:012d}|{owner}"
+        ignore = "INSERT IGNORE" if self.db_type == "mysql" else "INSERT OR IGNORE"
+        self.cursor.execute(f"{ignore} INTO system_configs (`key`, `value`) VALUES ({self.p}, {self.p})", (name, value))
+        if self.cursor.rowcount != 1:
+            # So sánh chuỗi đúng thứ tự thời gian vì epoch được đệm đủ 12 chữ số
+            self.cursor.execute(
+                f"UPDATE system_configs SET `value` = {self.p} WHERE `key` = {self.p} AND `value` < {self.p}",
+                (value, name, f"{now:012d}|")
+            )
+        acquired = self.cursor.rowcount == 1
+        self.commit()
+        return acquired
+
+    def _get_cached_values(self):
+        cls = ConfigManager
+        now = time.monotonic()
+        with cls._cache_lock:
+            values, version, checked_at = cls._cache, cls._cache_version, cls._checked_at
+        if values is not None:
+            if now - checked_at < settings.CONFIG_CACHE_CHECK_INTERVAL:
+                return values
+            # Hết chu kỳ: đọc version (1 row theo khóa chính), chỉ nạp lại khi đã đổi
+            self.cursor.execute(f"SELECT value FROM system_configs WHERE `key` = {self.p}", (self.VERSION_KEY,))
+            row = self.cursor.fetchone()
+            if (row['value'] if row else None) == version:
+                with cls._cache_lock:
+                    if cls._cache is values:
+                        cls._checked_at = now
+                return values
+
+        self.cursor.execute("SELECT `key`, `value` FROM system_configs")
+        values = {row['key']: row['value'] for row in self.cursor.fetchall()}
+        with cls._cache_lock:
+            cls._cache = values
+            cls._cache_version = values.get(self.VERSION_KEY)
+            cls._checked_at = now
+        return values
 
 class BannerHistoryManager(DBConnection):
-    def get_all(self, user_id=None):
+    # Cột cho các API danh sách (không gồm prompt_used, là cột text dài)
+    LIST_COLUMNS = ("id", "user_id", "request_description", "aspect_ratio", "resolution", "image_url",
+                    "token_cost", "reference_images", "is_public", "is_hidden", "created_at")
+
+    def list_page(self, user_id=None, limit=50, after=None, include_prompt=False, search=None):
+        """
+        Một trang banner theo keyset (created_at DESC, id DESC).
+        after: (created_at, id) của row cuối trang trước; lấy limit + 1 row để biết còn trang sau.
+        search: lọc theo mô tả yêu cầu.
+        """
+        columns = self.LIST_COLUMNS + (("prompt_used",) if include_prompt else ())
+        conditions, params = [], []
         if user_id:
-            sql = f"SELECT * FROM banner_history WHERE user_id = {self.p} ORDER BY created_at DESC"
-            self.cursor.execute(sql, (user_id,))
-        else:
-            sql = "SELECT * FROM banner_history ORDER BY created_at DESC"
-            self.cursor.execute(sql)
+            conditions.append(f"user_id = {self.p}")
+            params.append(user_id)
+        if search:
+            condition, search_params = self._search_condition(("request_description",), search)
+            conditions.append(condition)
+            params.extend(search_params)
+        if after:
+            conditions.append(keyset_condition(self.p))
+            params.extend(keyset_params(after))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        sql = f"SELECT {', '.join(columns)} FROM banner_history {where} ORDER BY created_at DESC, id DESC LIMIT {self.p}"
+        self.cursor.execute(sql, (*params, limit + 1))
         return [dict(row) for row in self.cursor.fetchall()]
 
     def get_recent_by_user(self, user_id, limit=4):
-        sql = f"SELECT * FROM banner_history WHERE user_id = {self.p} ORDER BY created_at DESC LIMIT {self.p}"
+        sql = f"SELECT {', '.join(self.LIST_COLUMNS)} FROM banner_history WHERE user_id = {self.p} ORDER BY created_at DESC, id DESC LIMIT {self.p}"
         self.cursor.execute(sql, (user_id, limit))
         return [dict(row) for row in self.cursor.fetchall()]
 
-    def count_by_user(self, user_id):
-        sql = f"SELECT COUNT(*) as count FROM banner_history WHERE user_id = {self.p}"
+    def get_user_stats(self, user_id):
+        """Số banner và tổng token đã dùng của user, đọc từ bảng counter user_stats (một row)."""
+        sql = f"SELECT banner_count, total_spent FROM user_stats WHERE user_id = {self.p}"
         self.cursor.execute(sql, (user_id,))
         row = self.cursor.fetchone()
-        return row['count'] if row else 0
+        if not row:
+            return {"banner_count": 0, "total_spent": 0}
+        return dict(row)
 
-    def get_total_spent_by_user(self, user_id):
-        sql = f"SELECT SUM(token_cost) as total FROM banner_history WHERE user_id = {self.p}"
-        self.cursor.execute(sql, (user_id,))
+    def _bump_user_stats(self, user_id, banners, spent):
+        """Cộng delta vào counter user_stats của user (không commit, chạy trong transaction của lệnh ghi)."""
+        if self.db_type == "mysql":
+            upsert = "ON DUPLICATE KEY UPDATE banner_count = banner_count + VALUES(banner_count), total_spent = total_spent + VALUES(total_spent)"
+        else:
+            upsert = "ON CONFLICT(user_id) DO UPDATE SET banner_count = banner_count + excluded.banner_count, total_spent = total_spent + excluded.total_spent"
+        sql = f"INSERT INTO user_stats (user_id, banner_count, total_spent) VALUES ({self.p}, {self.p}, {self.p}) {upsert}"
+        self.cursor.execute(sql, (user_id, banners, spent or 0))
+
+    def get_gallery_version(self):
+        self.cursor.execute(f"SELECT `value` FROM system_configs WHERE `key` = {self.p}", (GALLERY_VERSION_KEY,))
         row = self.cursor.fetchone()
-        return row['total'] if row and row['total'] else 0
+        return row['value'] if row else None
 
     def get_public_banners(self, limit=20):
         """Lấy banner cho gallery trang chủ — chỉ hiển thị banner is_public=1 và is_hidden=0."""
@@ -82,7 +247,7 @@ class BannerHistoryManager(DBConnection):
                   LEFT JOIN users u ON bh.user_id = u.id
                   WHERE bh.image_url IS NOT NULL AND bh.image_url != ''
                     AND bh.is_public = 1
-                    AND (bh.is_hidden IS NULL OR bh.is_hidden = 0)
+                    AND bh.is_hidden = 0
                   ORDER BY bh.created_at DESC
                   LIMIT {self.p}"""
         self.cursor.execute(sql, (limit,))
@@ -93,21 +258,61 @@ class BannerHistoryManager(DBConnection):
         sql = f"UPDATE banner_history SET is_public = {self.p} WHERE id = {self.p} AND user_id = {self.p}"
         self.cursor.execute(sql, (1 if is_public else 0, banner_id, user_id))
         self.commit()
-        return self.cursor.rowcount
+        rowcount = self.cursor.rowcount
+        if rowcount:
+            self._invalidate_gallery()
+        return rowcount
 
     def admin_set_hidden(self, banner_id, is_hidden: bool):
         """Admin ẩn/hiện banner trên trang chủ (không xóa)."""
         sql = f"UPDATE banner_history SET is_hidden = {self.p} WHERE id = {self.p}"
         self.cursor.execute(sql, (1 if is_hidden else 0, banner_id))
         self.commit()
-        return self.cursor.rowcount
+        rowcount = self.cursor.rowcount
+        if rowcount:
+            self._invalidate_gallery()
+        return rowcount
 
     def admin_delete(self, banner_id):
         """Admin xóa bất kỳ banner nào."""
-        sql = f"DELETE FROM banner_history WHERE id = {self.p}"
-        self.cursor.execute(sql, (banner_id,))
+        return self._delete_where(f"id = {self.p}", (banner_id,))
+
+    def _delete_where(self, where, params):
+        """Xóa banner theo điều kiện, trừ các counter daily_stats/user_stats trong cùng transaction."""
+        with self.transaction():
+            per_day = self._count_by_stat_date("banner_history", where, params)
+            self.cursor.execute(
+                f"SELECT user_id, COUNT(*) as cnt, COALESCE(SUM(token_cost), 0) as spent FROM banner_history WHERE {where} GROUP BY user_id",
+                params
+            )
+            per_user = [dict(row) for row in self.cursor.fetchall()]
+            self.cursor.execute(f"DELETE FROM banner_history WHERE {where}", params)
+            rowcount = self.cursor.rowcount
+            for row in per_day:
+                self._bump_daily_stats(row['stat_date'], banners=-row['cnt'])
+            for row in per_user:
+                self._bump_user_stats(row['user_id'], -row['cnt'], -row['spent'])
+        if rowcount:
+            self._invalidate_gallery()
+        return rowcount
+
+    def update_image_url(self, banner_id, old_url, new_url):
+        """Đổi image_url (vd. URL local -> URL CDN) chỉ khi row vẫn giữ URL cũ."""
+        sql = f"UPDATE banner_history SET image_url = {self.p} WHERE id = {self.p} AND image_url = {self.p}"
+        self.cursor.execute(sql, (new_url, banner_id, old_url))
         self.commit()
-        return self.cursor.rowcount
+        rowcount = self.cursor.rowcount
+        if rowcount:
+            self._invalidate_gallery()
+        return rowcount
+
+    def get_pending_uploads(self, limit=500):
+        """Các banner còn trỏ tới URL local (/generate/view/...) do chưa upload lên CDN."""
+        sql = f"""SELECT id, image_url FROM banner_history
+                  WHERE image_url LIKE {self.p}
+                  ORDER BY created_at DESC LIMIT {self.p}"""
+        self.cursor.execute(sql, ("%/generate/view/%", limit))
+        return [dict(row) for row in self.cursor.fetchall()]
 
     def get_by_id(self, banner_id):
         """Lấy thông tin một banner theo id."""
@@ -117,6 +322,40 @@ class BannerHistoryManager(DBConnection):
         return dict(row) if row else None
 
     def create(self, user_id, description, aspect_ratio, resolution, prompt, image_url, token_cost=1, reference_images=None, is_public=True):
+        with self.transaction():
+            banner_id, val_is_public = self._insert(user_id, description, aspect_ratio, resolution, prompt, image_url, token_cost, reference_images, is_public)
+        if val_is_public:
+            self._invalidate_gallery()
+        return banner_id
+
+    def create_for_task(self, task_id, task_result, user_id, description, aspect_ratio, resolution, prompt, image_url, token_cost=1, reference_images=None, is_public=True, lease_owner=None):
+        """
+        Lưu một banner của task: ghi lịch sử, trừ token và lưu tiến độ (tasks.result) trong cùng transaction,
+        để task được claim lại (restart/lease hết hạn) không bao giờ coi là xong một ảnh chưa trừ token.
+        lease_owner (backend "db"): chỉ ghi khi worker vẫn giữ lease, nếu không rollback cả lịch sử lẫn token
+        và raise LeaseLostError.
+        """
+        with self.transaction():
+            banner_id, val_is_public = self._insert(user_id, description, aspect_ratio, resolution, prompt, image_url, token_cost, reference_images, is_public)
+            self.cursor.execute(
+                f"UPDATE users SET tokens = tokens - {self.p}, updated_at = CURRENT_TIMESTAMP WHERE id = {self.p}",
+                (token_cost, user_id)
+            )
+            sql = f"UPDATE tasks SET result = {self.p}, updated_at = CURRENT_TIMESTAMP WHERE id = {self.p}"
+            params = (task_result, task_id)
+            if lease_owner is not None:
+                sql += f" AND lease_owner = {self.p}"
+                params += (lease_owner,)
+            self.cursor.execute(sql, params)
+            if lease_owner is not None and self.cursor.rowcount == 0:
+                raise LeaseLostError(f"Task {task_id} is no longer leased by {lease_owner}")
+        invalidate_user(user_id)
+        if val_is_public:
+            self._invalidate_gallery()
+        return banner_id
+
+    def _insert(self, user_id, description, aspect_ratio, resolution, prompt, image_url, token_cost, reference_images, is_public):
+        """INSERT banner_history + cộng counter (không commit, chạy trong transaction của caller)."""
         sql = f"""
             INSERT INTO banner_history
             (user_id, request_description, aspect_ratio, resolution, prompt_used, image_url, reference_images, token_cost, is_public)
@@ -126,22 +365,18 @@ class BannerHistoryManager(DBConnection):
         val_is_public = 1
         if is_public is False or str(is_public).lower() == 'false' or is_public == 0 or str(is_public) == '0':
             val_is_public = 0
-            
+
         self.cursor.execute(sql, (user_id, description, aspect_ratio, resolution, prompt, image_url, reference_images, token_cost, val_is_public))
-        self.commit()
-        return self.cursor.lastrowid
+        banner_id = self.cursor.lastrowid
+        self._bump_daily_stats(banners=1)
+        self._bump_user_stats(user_id, 1, token_cost)
+        return banner_id, val_is_public
 
     def delete(self, banner_id, user_id):
-        sql = f"DELETE FROM banner_history WHERE id = {self.p} AND user_id = {self.p}"
-        self.cursor.execute(sql, (banner_id, user_id))
-        self.commit()
-        return self.cursor.rowcount
+        return self._delete_where(f"id = {self.p} AND user_id = {self.p}", (banner_id, user_id))
 
     def delete_all(self, user_id):
-        sql = f"DELETE FROM banner_history WHERE user_id = {self.p}"
-        self.cursor.execute(sql, (user_id,))
-        self.commit()
-        return self.cursor.rowcount
+        return self._delete_where(f"user_id = {self.p}", (user_id,))
 
 class TasksManager(DBConnection):
     def create_task(self, task_id, user_id, request_data):
@@ -157,13 +392,105 @@ class TasksManager(DBConnection):
         row = self.cursor.fetchone()
         return dict(row) if row else None
 
-    def update_task(self, task_id, status, result=None, error_message=None):
+    def update_task(self, task_id, status, result=None, error_message=None, lease_owner=None):
+        """lease_owner (backend "db"): chỉ cập nhật khi worker vẫn giữ lease, nếu không raise LeaseLostError."""
         sql = f"""
             UPDATE tasks 
             SET status = {self.p}, result = {self.p}, error_message = {self.p}, updated_at = CURRENT_TIMESTAMP
             WHERE id = {self.p}
         """
-        self.cursor.execute(sql, (status, result, error_message, task_id))
+        params = (status, result, error_message, task_id)
+        if lease_owner is not None:
+            sql += f" AND lease_owner = {self.p}"
+            params += (lease_owner,)
+        self.cursor.execute(sql, params)
+        self.commit()
+        if lease_owner is not None and self.cursor.rowcount == 0:
+            raise LeaseLostError(f"Task {task_id} is no longer leased by {lease_owner}")
+        return self.cursor.rowcount
+
+    # --- Hàng đợi bền vững: claim có lease, heartbeat và claim lại lease hết hạn ---
+    LEASE_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+    def _lease_times(self, lease_seconds):
+        now = datetime.utcnow()
+        expires = now + timedelta(seconds=lease_seconds)
+        return now.strftime(self.LEASE_TIME_FORMAT), expires.strftime(self.LEASE_TIME_FORMAT)
+
+    def claim_next_task(self, worker_id, lease_seconds, max_per_user=None, exclude_user_ids=(), max_attempts=None):
+        """
+        Claim nguyên tử task 'pending' cũ nhất (hoặc task 'processing' có lease đã hết hạn).
+        Dùng UPDATE có điều kiện nên an toàn khi nhiều process cùng claim trên một DB:
+        cả điều kiện claimable lẫn giới hạn max_per_user đều được kiểm tra lại trong UPDATE,
+        rowcount 0 nghĩa là process khác vừa claim (task hoặc slot của user) -> thử ứng viên kế tiếp.
+        """
+        now, expires = self._lease_times(lease_seconds)
+        claimable = f"(status = 'pending' OR (status = 'processing' AND (lease_expires_at IS NULL OR lease_expires_at < {self.p})))"
+
+        busy_filter, busy_params = "", ()
+        if max_per_user:
+            # Giới hạn theo user trên toàn bộ các process dùng chung DB
+            # (bọc trong bảng dẫn xuất để MySQL cho phép đọc chính bảng tasks trong UPDATE)
+            busy_filter = f"""
+                AND user_id NOT IN (
+                    SELECT busy.user_id FROM (
+                        SELECT user_id FROM tasks
+                        WHERE status = 'processing' AND lease_expires_at >= {self.p}
+                        GROUP BY user_id HAVING COUNT(*) >= {self.p}
+                    ) busy
+                )"""
+            busy_params = (now, max_per_user)
+
+        filters = busy_filter
+        params = [now, *busy_params]
+        if exclude_user_ids:
+            filters += f" AND user_id NOT IN ({', '.join([self.p] * len(exclude_user_ids))})"
+            params.extend(exclude_user_ids)
+
+        self.cursor.execute(f"""
+            SELECT id, attempts FROM tasks
+            WHERE {claimable}{filters}
+            ORDER BY created_at ASC
+            LIMIT 5
+        """, tuple(params))
+        candidates = [dict(row) for row in self.cursor.fetchall()]
+
+        for candidate in candidates:
+            if max_attempts and (candidate['attempts'] or 0) >= max_attempts:
+                self.cursor.execute(f"""
+                    UPDATE tasks
+                    SET status = 'failed', error_message = {self.p}, lease_owner = NULL, lease_expires_at = NULL, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = {self.p} AND {claimable}
+                """, ("Task exceeded maximum attempts. Please try again.", candidate['id'], now))
+                self.commit()
+                continue
+
+            self.cursor.execute(f"""
+                UPDATE tasks
+                SET status = 'processing', lease_owner = {self.p}, lease_expires_at = {self.p},
+                    attempts = COALESCE(attempts, 0) + 1, updated_at = CURRENT_TIMESTAMP
+                WHERE id = {self.p} AND {claimable}{busy_filter}
+            """, (worker_id, expires, candidate['id'], now, *busy_params))
+            self.commit()
+            if self.cursor.rowcount == 1:
+                return self.get_task(candidate['id'])
+        return None
+
+    def renew_lease(self, task_id, worker_id, lease_seconds):
+        """Heartbeat: gia hạn lease nếu worker vẫn đang giữ task."""
+        _, expires = self._lease_times(lease_seconds)
+        self.cursor.execute(f"""
+            UPDATE tasks SET lease_expires_at = {self.p}
+            WHERE id = {self.p} AND lease_owner = {self.p} AND status = 'processing'
+        """, (expires, task_id, worker_id))
+        self.commit()
+        return self.cursor.rowcount
+
+    def release_lease(self, task_id, worker_id):
+        self.cursor.execute(f"""
+            UPDATE tasks SET lease_owner = NULL, lease_expires_at = NULL
+            WHERE id = {self.p} AND lease_owner = {self.p}
+        """, (task_id, worker_id))
         self.commit()
         return self.cursor.rowcount
 
@@ -211,6 +538,39 @@ class PackageManager(DBConnection):
             raise Exception("Cannot delete package because it has related payments. Deactivate it instead.")
 
 class PaymentManager(DBConnection):
+    LIST_COLUMNS = (
+        "p.id", "p.user_id", "p.package_id", "p.amount_vnd", "p.tokens_received", "p.payment_code",
+        "p.sepay_transaction_id", "p.status", "p.created_at", "p.completed_at", "pk.name as package_name"
+    )
+
+    def list_page(self, user_id=None, limit=50, after=None, search=None):
+        """
+        Một trang hóa đơn theo keyset (created_at DESC, id DESC), của một user hoặc tất cả (admin).
+        search: lọc theo tên gói, mã nạp hoặc mã giao dịch.
+        """
+        conditions, params = [], []
+        if user_id:
+            conditions.append(f"p.user_id = {self.p}")
+            params.append(user_id)
+        if search:
+            condition, search_params = self._search_condition(("pk.name", "p.payment_code", "p.sepay_transaction_id"), search)
+            conditions.append(condition)
+            params.extend(search_params)
+        if after:
+            conditions.append(keyset_condition(self.p, 'p.'))
+            params.extend(keyset_params(after))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        sql = f"""
+            SELECT {', '.join(self.LIST_COLUMNS)}
+            FROM payments p
+            LEFT JOIN packages pk ON p.package_id = pk.id
+            {where}
+            ORDER BY p.created_at DESC, p.id DESC
+            LIMIT {self.p}
+        """
+        self.cursor.execute(sql, (*params, limit + 1))
+        return [dict(row) for row in self.cursor.fetchall()]
+
     def get_packages(self):
         self.cursor.execute(f"SELECT * FROM packages WHERE is_active = {self.p}", (1,))
         return [dict(row) for row in self.cursor.fetchall()]
@@ -225,18 +585,68 @@ class PaymentManager(DBConnection):
         return self.cursor.lastrowid
 
     def update_payment(self, payment_id, status, transaction_id=None):
-        sql = f"UPDATE payments SET status = {self.p}, sepay_transaction_id = {self.p}, completed_at = {self.p} WHERE id = {self.p}"
+        """
+        Chuyển hóa đơn sang `status`. Trả về 1 nếu request này đổi trạng thái, 0 nếu hóa đơn
+        đã ở trạng thái đó (vd. check-status/webhook chạy đồng thời): chỉ bên được 1 mới cộng token.
+        """
         completed_at = datetime.now() if status == 'completed' else None
-        self.cursor.execute(sql, (status, transaction_id, completed_at, payment_id))
+        with self.transaction():
+            self.cursor.execute(
+                f"SELECT status, amount_vnd, tokens_received, {STAT_DATE_SQL} as stat_date FROM payments WHERE id = {self.p}",
+                (payment_id,)
+            )
+            previous = self.cursor.fetchone()
+            previous = dict(previous) if previous else None
+
+            # WHERE có điều kiện trạng thái: hai request cùng đọc 'pending' thì chỉ một UPDATE khớp
+            sql = f"""UPDATE payments SET status = {self.p}, sepay_transaction_id = {self.p}, completed_at = {self.p}
+                      WHERE id = {self.p} AND status <> {self.p}"""
+            self.cursor.execute(sql, (status, transaction_id, completed_at, payment_id, status))
+            rowcount = self.cursor.rowcount
+
+            # Doanh thu chỉ tính khi hóa đơn chuyển vào/ra trạng thái completed (theo ngày tạo hóa đơn)
+            if rowcount == 1 and previous and (previous['status'] == 'completed') != (status == 'completed'):
+                sign = 1 if status == 'completed' else -1
+                self._bump_daily_stats(
+                    previous['stat_date'],
+                    revenue_vnd=sign * (previous['amount_vnd'] or 0),
+                    tokens_sold=sign * (previous['tokens_received'] or 0)
+                )
+        return rowcount
+
+    def get_by_id(self, payment_id):
+        self.cursor.execute(f"SELECT * FROM payments WHERE id = {self.p}", (payment_id,))
+        row = self.cursor.fetchone()
+        return dict(row) if row else None
+
+    def set_payment_code(self, payment_id, payment_code):
+        sql = f"UPDATE payments SET payment_code = {self.p} WHERE id = {self.p}"
+        self.cursor.execute(sql, (payment_code, payment_id))
         self.commit()
         return self.cursor.rowcount
 
-    def get_user_payments(self, user_id):
-        sql = f"SELECT p.*, pk.name as package_name FROM payments p LEFT JOIN packages pk ON p.package_id = pk.id WHERE p.user_id = {self.p} ORDER BY p.created_at DESC"
-        self.cursor.execute(sql, (user_id,))
+class UserManager(DBConnection):
+    def list_page(self, limit=50, after=None, search=None):
+        """Một trang user (admin) theo keyset (created_at DESC, id DESC). search: lọc theo email hoặc họ tên."""
+        conditions, params = [], []
+        if search:
+            condition, search_params = self._search_condition(("email", "full_name"), search)
+            conditions.append(condition)
+            params.extend(search_params)
+        if after:
+            conditions.append(keyset_condition(self.p))
+            params.extend(keyset_params(after))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        sql = f"""
+            SELECT id, email, full_name, avatar_url, tokens, is_admin, created_at, updated_at
+            FROM users
+            {where}
+            ORDER BY created_at DESC, id DESC
+            LIMIT {self.p}
+        """
+        self.cursor.execute(sql, (*params, limit + 1))
         return [dict(row) for row in self.cursor.fetchall()]
 
-class UserManager(DBConnection):
     def get_by_id(self, user_id):
         self.cursor.execute(f"SELECT * FROM users WHERE id = {self.p}", (user_id,))
         row = self.cursor.fetchone()
@@ -260,43 +670,150 @@ class UserManager(DBConnection):
     def create(self, email, full_name, google_id=None, avatar_url=None):
         sql = f"INSERT INTO users (email, full_name, google_id, avatar_url, tokens) VALUES ({self.p}, {self.p}, {self.p}, {self.p}, 5)"
         self.cursor.execute(sql, (email, full_name, google_id, avatar_url))
+        user_id = self.cursor.lastrowid
+        self._bump_daily_stats(new_users=1)
         self.commit()
-        return self.cursor.lastrowid
+        return user_id
 
     def create_with_password(self, username, email, full_name, password_hash):
         sql = f"INSERT INTO users (username, email, full_name, password_hash, tokens) VALUES ({self.p}, {self.p}, {self.p}, {self.p}, 5)"
         self.cursor.execute(sql, (username, email, full_name, password_hash))
+        user_id = self.cursor.lastrowid
+        self._bump_daily_stats(new_users=1)
         self.commit()
-        return self.cursor.lastrowid
+        return user_id
+
+    def delete_with_data(self, user_id):
+        """Xóa user cùng banner và hóa đơn của họ, trừ các số liệu tương ứng khỏi daily_stats."""
+        banners = self._count_by_stat_date("banner_history", f"user_id = {self.p}", (user_id,))
+        payments = self._count_by_stat_date(
+            "payments", f"user_id = {self.p} AND status = 'completed'", (user_id,),
+            extra_columns=", COALESCE(SUM(amount_vnd), 0) as revenue, COALESCE(SUM(tokens_received), 0) as tokens"
+        )
+        users = self._count_by_stat_date("users", f"id = {self.p}", (user_id,))
+
+        with self.transaction():
+            self.cursor.execute(f"DELETE FROM banner_history WHERE user_id = {self.p}", (user_id,))
+            self.cursor.execute(f"DELETE FROM payments WHERE user_id = {self.p}", (user_id,))
+            self.cursor.execute(f"DELETE FROM user_stats WHERE user_id = {self.p}", (user_id,))
+            self.cursor.execute(f"DELETE FROM users WHERE id = {self.p}", (user_id,))
+            rowcount = self.cursor.rowcount
+
+            for row in banners:
+                self._bump_daily_stats(row['stat_date'], banners=-row['cnt'])
+            for row in payments:
+                self._bump_daily_stats(row['stat_date'], revenue_vnd=-row['revenue'], tokens_sold=-row['tokens'])
+            for row in users:
+                self._bump_daily_stats(row['stat_date'], new_users=-row['cnt'])
+        invalidate_user(user_id)
+        self._invalidate_gallery()
+        return rowcount
 
     def update_forgot_password_stats(self, user_id, count, last_at):
         sql = f"UPDATE users SET forgot_password_count = {self.p}, last_forgot_password_at = {self.p} WHERE id = {self.p}"
         self.cursor.execute(sql, (count, last_at, user_id))
         self.commit()
+        invalidate_user(user_id)
         return self.cursor.rowcount
 
     def reset_password(self, user_id, new_password_hash):
         sql = f"UPDATE users SET password_hash = {self.p}, forgot_password_count = 0 WHERE id = {self.p}"
         self.cursor.execute(sql, (new_password_hash, user_id))
         self.commit()
+        invalidate_user(user_id)
         return self.cursor.rowcount
 
     def update_token(self, user_id, tokens_to_add):
         sql = f"UPDATE users SET tokens = tokens + {self.p}, updated_at = CURRENT_TIMESTAMP WHERE id = {self.p}"
         self.cursor.execute(sql, (tokens_to_add, user_id))
         self.commit()
+        invalidate_user(user_id)
         return self.cursor.rowcount
     
+    def set_admin_by_id(self, user_id, is_admin):
+        sql = f"UPDATE users SET is_admin = {self.p}, updated_at = CURRENT_TIMESTAMP WHERE id = {self.p}"
+        self.cursor.execute(sql, (1 if is_admin else 0, user_id))
+        self.commit()
+        invalidate_user(user_id)
+        return self.cursor.rowcount
+
     def set_admin(self, email):
         sql = f"UPDATE users SET is_admin = 1, updated_at = CURRENT_TIMESTAMP WHERE email = {self.p}"
         self.cursor.execute(sql, (email,))
         self.commit()
+        invalidate_user_email(email)
         return self.cursor.rowcount
     
     def remove_admin(self, email):
         sql = f"UPDATE users SET is_admin = 0, updated_at = CURRENT_TIMESTAMP WHERE email = {self.p}"
         self.cursor.execute(sql, (email,))
         self.commit()
+        invalidate_user_email(email)
+        return self.cursor.rowcount
+
+class StatsManager(DBConnection):
+    """Đọc số liệu dashboard admin từ rollup daily_stats (không quét banner_history/payments)."""
+
+    def get_totals(self):
+        self.cursor.execute("""
+            SELECT COALESCE(SUM(banners), 0) as total_banners,
+                   COALESCE(SUM(revenue_vnd), 0) as total_revenue,
+                   COALESCE(SUM(tokens_sold), 0) as total_tokens_sold,
+                   COALESCE(SUM(new_users), 0) as total_users
+            FROM daily_stats
+        """)
+        row = self.cursor.fetchone()
+        return dict(row) if row else {}
+
+    def get_daily(self, days=7):
+        """Số banner và doanh thu theo ngày trong `days` ngày gần nhất (bỏ các ngày không có số liệu)."""
+        if self.db_type == "mysql":
+            since = f"DATE_SUB(CURRENT_DATE, INTERVAL {self.p} DAY)"
+        else:
+            since = f"date('now', '-' || {self.p} || ' days')"
+        sql = f"""SELECT stat_date as date, banners, revenue_vnd as revenue
+                  FROM daily_stats
+                  WHERE stat_date >= {since} AND (banners <> 0 OR revenue_vnd <> 0)
+                  ORDER BY stat_date ASC"""
+        self.cursor.execute(sql, (int(days),))
+        return [dict(row) for row in self.cursor.fetchall()]
+
+    def count_admins(self):
+        self.cursor.execute("SELECT COUNT(*) as count FROM users WHERE is_admin = 1")
+        row = self.cursor.fetchone()
+        return row['count'] if row else 0
+
+    def rebuild(self):
+        """Tính lại daily_stats từ dữ liệu gốc. Trả về số ngày đã ghi."""
+        return rebuild_daily_stats(self.conn, self.cursor, self.db_type)
+
+    def reconcile_user_stats(self):
+        """Sửa các counter user_stats bị lệch so với banner_history. Trả về số user đã sửa."""
+        return reconcile_user_stats(self.conn, self.cursor, self.db_type)
+
+class PromptCacheManager(DBConnection):
+    """Tầng DB của prompt cache (giữ qua restart, dùng chung giữa các process)."""
+
+    def get(self, cache_key):
+        sql = f"SELECT `value` FROM prompt_cache WHERE cache_key = {self.p} AND expires_at > {self.p}"
+        self.cursor.execute(sql, (cache_key, datetime.now()))
+        row = self.cursor.fetchone()
+        return row['value'] if row else None
+
+    def set(self, cache_key, kind, value, ttl_seconds):
+        expires_at = datetime.now() + timedelta(seconds=ttl_seconds)
+        if self.db_type == "mysql":
+            upsert = "ON DUPLICATE KEY UPDATE `value` = VALUES(`value`), expires_at = VALUES(expires_at)"
+        else:
+            upsert = "ON CONFLICT(cache_key) DO UPDATE SET `value` = excluded.value, expires_at = excluded.expires_at"
+        sql = f"INSERT INTO prompt_cache (cache_key, kind, `value`, expires_at) VALUES ({self.p}, {self.p}, {self.p}, {self.p}) {upsert}"
+        self.cursor.execute(sql, (cache_key, kind, value, expires_at))
+        self.commit()
+        return self.cursor.rowcount
+
+    def purge_expired(self):
+        self.cursor.execute(f"DELETE FROM prompt_cache WHERE expires_at <= {self.p}", (datetime.now(),))
+        self.commit()
         return self.cursor.rowcount
 
 class BannerDetails(DBConnection):
@@ -1,41 +1,32 @@
-from fastapi import APIRouter, Depends, HTTPException, Body, Request
-from app.models.banner_db import UserManager, PaymentManager, BannerHistoryManager, PackageManager, ConfigManager
+from fastapi import APIRouter, Depends, HTTPException, Body, Request, Response, Query
+from app.models.banner_db import UserManager, PaymentManager, BannerHistoryManager, PackageManager, ConfigManager, StatsManager
+from app.config import settings
 from app.security.jwt import get_current_user
 from app.utils.url import fix_banner_url
-from typing import Dict, Any, List
+from app.utils.image_variants import add_image_variants
+from app.utils.pagination import clamp_limit, decode_cursor, paginate
+from app.utils.async_db import run_db, AsyncManager
+from app.utils.ai_clients import reset_ai_clients
+from app.utils.stats_reconciler import reconcile_stats
+from typing import Dict, Any, List, Optional
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
 def get_user_manager():
-    manager = UserManager()
-    try:
-        yield manager
-    finally:
-        manager.close()
+    return AsyncManager(UserManager)
 
 def get_payment_manager():
-    manager = PaymentManager()
-    try:
-        yield manager
-    finally:
-        manager.close()
+    return AsyncManager(PaymentManager)
 
 def get_banner_manager():
-    manager = BannerHistoryManager()
-    try:
-        yield manager
-    finally:
-        manager.close()
+    return AsyncManager(BannerHistoryManager)
 
 def get_package_manager():
-    manager = PackageManager()
-    try:
-        yield manager
-    finally:
-        manager.close()
+    return AsyncManager(PackageManager)
 
 def verify_admin(user: dict = Depends(get_current_user)):
     """Verify that the current user is an admin"""
@@ -44,22 +35,18 @@ def verify_admin(user: dict = Depends(get_current_user)):
     return user
 
 def get_config_manager():
-    manager = ConfigManager()
-    try:
-        yield manager
-    finally:
-        manager.close()
+    return AsyncManager(ConfigManager)
 
 @router.post("/config/homepage")
 async def update_homepage_config(
     data: dict = Body(...),
     admin: dict = Depends(verify_admin),
-    config_manager: ConfigManager = Depends(get_config_manager)
+    config_manager: AsyncManager = Depends(get_config_manager)
 ):
     import json
     try:
         # Save as JSON string
-        config_manager.set_value("homepage_config", json.dumps(data, ensure_ascii=False))
+        await config_manager.set_value("homepage_config", json.dumps(data, ensure_ascii=False))
         return {"success": True, "message": "Updated homepage config"}
     except Exception as e:
         logger.error(f"Error updating homepage config: {str(e)}")
@@ -67,43 +54,36 @@ async def update_homepage_config(
 
 @router.get("/users")
 async def get_all_users(
+    response: Response,
+    limit: Optional[int] = Query(None, gt=0),
+    cursor: Optional[str] = None,
+    q: Optional[str] = Query(None, max_length=100),
     admin: dict = Depends(verify_admin),
-    user_manager: UserManager = Depends(get_user_manager)
+    user_manager: AsyncManager = Depends(get_user_manager)
 ):
-    """Get all users (admin only)"""
+    """Get users page by page, newest first (admin only). q searches email/full name. Next page cursor in X-Next-Cursor header."""
+    limit = clamp_limit(limit)
+    after = decode_cursor(cursor)
     try:
-        # Get all users from database
-        conn = user_manager.conn
-        # Use the pre-configured dictionary cursor from manager
-        cursor = user_manager.cursor
-        cursor.execute("""
-            SELECT id, email, full_name, tokens, is_admin, created_at, updated_at
-            FROM users
-            ORDER BY created_at DESC
-        """)
-        users = cursor.fetchall()
-        return users
+        return paginate(await user_manager.list_page(limit=limit, after=after, search=(q or "").strip()), limit, response)
     except Exception as e:
         logger.error(f"Admin Error fetching users: {str(e)}")
         raise HTTPException(status_code=500, detail="Lỗi khi tải danh sách người dùng")
 
 @router.get("/payments")
 async def get_all_payments(
+    response: Response,
+    limit: Optional[int] = Query(None, gt=0),
+    cursor: Optional[str] = None,
+    q: Optional[str] = Query(None, max_length=100),
     admin: dict = Depends(verify_admin),
-    payment_manager: PaymentManager = Depends(get_payment_manager)
+    payment_manager: AsyncManager = Depends(get_payment_manager)
 ):
-    """Get all payments (admin only)"""
+    """Get payments page by page, newest first (admin only). q searches package name/payment code. Next page cursor in X-Next-Cursor header."""
+    limit = clamp_limit(limit)
+    after = decode_cursor(cursor)
     try:
-        conn = payment_manager.conn
-        cursor = payment_manager.cursor
-        cursor.execute("""
-            SELECT p.*, pk.name as package_name
-            FROM payments p
-            LEFT JOIN packages pk ON p.package_id = pk.id
-            ORDER BY p.created_at DESC
-        """)
-        payments = cursor.fetchall()
-        return payments
+        return paginate(await payment_manager.list_page(limit=limit, after=after, search=(q or "").strip()), limit, response)
     except Exception as e:
         logger.error(f"Admin Error fetching payments: {str(e)}")
         raise HTTPException(status_code=500, detail="Lỗi khi tải lịch sử thanh toán")
@@ -111,75 +91,37 @@ async def get_all_payments(
 @router.get("/banners")
 async def get_all_banners(
     request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, gt=0),
+    cursor: Optional[str] = None,
+    q: Optional[str] = Query(None, max_length=100),
+    include_prompt: bool = False,
     admin: dict = Depends(verify_admin),
-    banner_manager: BannerHistoryManager = Depends(get_banner_manager)
+    banner_manager: AsyncManager = Depends(get_banner_manager)
 ):
-    """Get all banners (admin only)"""
+    """Get banners page by page, newest first (admin only). q searches the request description. Next page cursor in X-Next-Cursor header."""
+    limit = clamp_limit(limit)
+    after = decode_cursor(cursor)
     try:
-        banners = banner_manager.get_all()
+        banners = paginate(await banner_manager.list_page(limit=limit, after=after, include_prompt=include_prompt, search=(q or "").strip()), limit, response)
         for b in banners:
             b['image_url'] = fix_banner_url(b['image_url'], request)
+            add_image_variants(b)
         return banners
     except Exception as e:
         logger.error(f"Admin Error fetching banners: {str(e)}")
         raise HTTPException(status_code=500, detail="Lỗi khi tải danh sách banner")
 
-@router.get("/stats")
-async def get_stats(
-    request: Request,
-    admin: dict = Depends(verify_admin),
-    user_manager: UserManager = Depends(get_user_manager)
-):
-    """Get system statistics (admin only)"""
+# Cache ngắn hạn cho response /stats (dữ liệu thô, chưa gắn URL theo request)
+_stats_cache: Dict[str, Any] = {"data": None, "expires_at": 0.0}
+
+def _query_stats() -> dict:
+    """Đọc số liệu thống kê từ rollup daily_stats (đồng bộ, gọi qua executor DB)."""
+    stats_manager = StatsManager()
     try:
-        conn = user_manager.conn
-        cursor = user_manager.cursor
-        
-        # Total users
-        cursor.execute("SELECT COUNT(*) as count FROM users")
-        row_users = cursor.fetchone()
-        total_users = row_users['count'] if row_users else 0
-        
-        # Total admins
-        cursor.execute("SELECT COUNT(*) as count FROM users WHERE is_admin = 1")
-        row_admins = cursor.fetchone()
-        total_admins = row_admins['count'] if row_admins else 0
-        
-        # Total revenue (completed payments only)
-        cursor.execute("SELECT COALESCE(SUM(amount_vnd), 0) as total FROM payments WHERE status = 'completed'")
-        row_revenue = cursor.fetchone()
-        total_revenue = row_revenue['total'] if row_revenue else 0
-        
-        # Total banners
-        cursor.execute("SELECT COUNT(*) as count FROM banner_history")
-        row_banners = cursor.fetchone()
-        total_banners = row_banners['count'] if row_banners else 0
-        
-        # Total tokens sold
-        cursor.execute("SELECT COALESCE(SUM(tokens_received), 0) as total FROM payments WHERE status = 'completed'")
-        row_tokens = cursor.fetchone()
-        total_tokens_sold = row_tokens['total'] if row_tokens else 0
-        
-        # Daily banners (last 7 days)
-        cursor.execute(f"""
-            SELECT date(created_at) as date, COUNT(*) as count
-            FROM banner_history
-            WHERE created_at >= DATE_SUB(CURRENT_DATE, INTERVAL 7 DAY)
-            GROUP BY date(created_at)
-            ORDER BY date ASC
-        """)
-        daily_banners = cursor.fetchall()
-        
-        # Daily revenue (last 7 days)
-        cursor.execute(f"""
-            SELECT date(created_at) as date, SUM(amount_vnd) as revenue
-            FROM payments 
-            WHERE status = 'completed' AND created_at >= DATE_SUB(CURRENT_DATE, INTERVAL 7 DAY)
-            GROUP BY date(created_at)
-            ORDER BY date ASC
-        """)
-        daily_revenue = cursor.fetchall()
-        
+        totals = stats_manager.get_totals()
+        cursor = stats_manager.cursor
+
         # Recent 5 payments
         cursor.execute("""
             SELECT p.id, p.amount_vnd, pk.name as package_name, p.status, p.created_at, u.email as user_email
@@ -198,50 +140,108 @@ async def get_stats(
             LEFT JOIN users u ON b.user_id = u.id
             ORDER BY b.created_at DESC LIMIT 5
         """)
+        recent_banners = [dict(row) for row in cursor.fetchall()]
+
+        return {
+            "total_users": totals.get("total_users", 0),
+            "total_admins": stats_manager.count_admins(),
+            "total_revenue": totals.get("total_revenue", 0),
+            "total_banners": totals.get("total_banners", 0),
+            "total_tokens_sold": totals.get("total_tokens_sold", 0),
+            "daily": stats_manager.get_daily(7),
+            "recent_payments": recent_payments,
+            "recent_banners": recent_banners
+        }
+    finally:
+        stats_manager.close()
+
+async def _get_cached_stats() -> dict:
+    now = time.monotonic()
+    if _stats_cache["data"] is None or now >= _stats_cache["expires_at"]:
+        _stats_cache["data"] = await run_db(_query_stats)
+        _stats_cache["expires_at"] = now + settings.ADMIN_STATS_CACHE_TTL
+    return _stats_cache["data"]
+
+@router.get("/stats")
+async def get_stats(
+    request: Request,
+    admin: dict = Depends(verify_admin)
+):
+    """Get system statistics (admin only)"""
+    try:
+        stats = await _get_cached_stats()
+
+        # Copy từng row để không sửa dữ liệu đang nằm trong cache
         recent_banners = []
-        for row in cursor.fetchall():
+        for row in stats["recent_banners"]:
             d = dict(row)
             d['image_url'] = fix_banner_url(d['image_url'], request)
             recent_banners.append(d)
-
-
         
-        # Combine chart data
-        chart_data_map = {}
-        for row in daily_banners:
-            chart_data_map[row['date']] = {'date': row['date'], 'banners': row['count'], 'revenue': 0}
-        for row in daily_revenue:
-            if row['date'] not in chart_data_map:
-                chart_data_map[row['date']] = {'date': row['date'], 'banners': 0, 'revenue': row['revenue']}
-            else:
-                chart_data_map[row['date']]['revenue'] = row['revenue']
-        
-        chart_data = sorted(list(chart_data_map.values()), key=lambda x: x['date'])
+        chart_data = [
+            {'date': row['date'], 'banners': row['banners'], 'revenue': row['revenue']}
+            for row in stats["daily"]
+        ]
 
         return {
-            "total_users": total_users,
-            "total_admins": total_admins,
-            "total_revenue": total_revenue,
-            "total_banners": total_banners,
-            "total_tokens_sold": total_tokens_sold,
+            "total_users": stats["total_users"],
+            "total_admins": stats["total_admins"],
+            "total_revenue": stats["total_revenue"],
+            "total_banners": stats["total_banners"],
+            "total_tokens_sold": stats["total_tokens_sold"],
 
             "chart_data": chart_data,
-            "recent_payments": recent_payments,
+            "recent_payments": stats["recent_payments"],
             "recent_banners": recent_banners
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching stats: {str(e)}")
 
+@router.post("/stats/rebuild")
+async def rebuild_stats(admin: dict = Depends(verify_admin)):
+    """Reconcile the daily_stats and user_stats counters with the source tables (admin only)"""
+    try:
+        result = await run_db(reconcile_stats)
+        _stats_cache["data"] = None
+        return {"success": True, **result}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error rebuilding stats: {str(e)}")
+
+@router.get("/prompt-cache/stats")
+async def get_prompt_cache_stats(admin: dict = Depends(verify_admin)):
+    """Hit rate of the prompt analysis/generation result cache and its semantic (near-duplicate) layer (admin only)"""
+    from app.utils.prompt_cache import prompt_result_cache
+    from app.utils.semantic_cache import semantic_prompt_cache
+    return {**prompt_result_cache.get_stats(), "semantic": semantic_prompt_cache.get_stats()}
+
+@router.get("/tasks/stats")
+async def get_task_queue_stats(admin: dict = Depends(verify_admin)):
+    """Queue depth and worker utilization of the banner task pool (admin only)"""
+    from app.utils.task_manager import ram_task_manager
+    return ram_task_manager.get_stats()
+
+@router.get("/uploads/stats")
+async def get_upload_pipeline_stats(admin: dict = Depends(verify_admin)):
+    """Background Cloudinary upload pipeline statistics (admin only)"""
+    from app.utils.upload_pipeline import upload_pipeline
+    return upload_pipeline.get_stats()
+
+@router.get("/db/pool-stats")
+async def get_db_pool_stats(admin: dict = Depends(verify_admin)):
+    """Database connection pool statistics of this process (admin only)"""
+    from app.utils.database import get_pool_stats
+    return get_pool_stats()
+
 @router.post("/users/{user_id}/toggle-admin")
 async def toggle_admin(
     user_id: int,
     admin: dict = Depends(verify_admin),
-    user_manager: UserManager = Depends(get_user_manager)
+    user_manager: AsyncManager = Depends(get_user_manager)
 ):
     """Toggle admin status for a user (admin only)"""
     try:
         # Get current user
-        target_user = user_manager.get_by_id(user_id)
+        target_user = await user_manager.get_by_id(user_id)
         if not target_user:
             raise HTTPException(status_code=404, detail="User not found")
         
@@ -251,13 +251,7 @@ async def toggle_admin(
         
         # Toggle admin status
         new_status = 0 if target_user['is_admin'] == 1 else 1
-        conn = user_manager.conn
-        cursor = conn.cursor()
-        cursor.execute(
-            f"UPDATE users SET is_admin = {user_manager.p}, updated_at = CURRENT_TIMESTAMP WHERE id = {user_manager.p}",
-            (new_status, user_id)
-        )
-        conn.commit()
+        await user_manager.set_admin_by_id(user_id, new_status == 1)
         
         return {
             "success": True,
@@ -273,11 +267,11 @@ async def toggle_admin(
 @router.get("/packages")
 async def get_all_packages(
     admin: dict = Depends(verify_admin),
-    package_manager: PackageManager = Depends(get_package_manager)
+    package_manager: AsyncManager = Depends(get_package_manager)
 ):
     """Get all packages (admin only)"""
     try:
-        return package_manager.get_all(include_inactive=True)
+        return await package_manager.get_all(include_inactive=True)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching packages: {str(e)}")
 
@@ -301,11 +295,11 @@ class PackageUpdate(BaseModel):
 async def create_package(
     package: PackageCreate,
     admin: dict = Depends(verify_admin),
-    package_manager: PackageManager = Depends(get_package_manager)
+    package_manager: AsyncManager = Depends(get_package_manager)
 ):
     """Create a new package"""
     try:
-        package_id = package_manager.create(
+        package_id = await package_manager.create(
             name=package.name,
             description=package.description,
             amount_vnd=package.amount_vnd,
@@ -321,11 +315,11 @@ async def update_package(
     package_id: int,
     package: PackageUpdate,
     admin: dict = Depends(verify_admin),
-    package_manager: PackageManager = Depends(get_package_manager)
+    package_manager: AsyncManager = Depends(get_package_manager)
 ):
     """Update a package"""
     try:
-        existing = package_manager.get_by_id(package_id)
+        existing = await package_manager.get_by_id(package_id)
         if not existing:
             raise HTTPException(status_code=404, detail="Package not found")
         
@@ -336,7 +330,7 @@ async def update_package(
         tokens = package.tokens if package.tokens is not None else existing['tokens']
         is_active = (1 if package.is_active else 0) if package.is_active is not None else existing['is_active']
 
-        package_manager.update(
+        await package_manager.update(
             package_id=package_id,
             name=name,
             description=description,
@@ -354,11 +348,11 @@ async def update_package(
 async def delete_package(
     package_id: int,
     admin: dict = Depends(verify_admin),
-    package_manager: PackageManager = Depends(get_package_manager)
+    package_manager: AsyncManager = Depends(get_package_manager)
 ):
     """Delete a package"""
     try:
-        package_manager.delete(package_id)
+        await package_manager.delete(package_id)
         return {"message": "Package deleted successfully"}
     except Exception as e:
         if "Deactivate it instead" in str(e):
@@ -371,21 +365,15 @@ async def add_tokens_to_user(
     user_id: int,
     tokens: int = Body(..., embed=True, gt=0),
     admin: dict = Depends(verify_admin),
-    user_manager: UserManager = Depends(get_user_manager)
+    user_manager: AsyncManager = Depends(get_user_manager)
 ):
     """Manually add tokens to a user account"""
     try:
-        user = user_manager.get_by_id(user_id)
+        user = await user_manager.get_by_id(user_id)
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         
-        conn = user_manager.conn
-        cursor = conn.cursor()
-        cursor.execute(
-            f"UPDATE users SET tokens = tokens + {user_manager.p}, updated_at = CURRENT_TIMESTAMP WHERE id = {user_manager.p}",
-            (tokens, user_id)
-        )
-        conn.commit()
+        await user_manager.update_token(user_id, tokens)
         
         return {"success": True, "message": f"Added {tokens} tokens to {user['email']}"}
     except Exception as e:
@@ -395,24 +383,19 @@ async def add_tokens_to_user(
 async def delete_user(
     user_id: int,
     admin: dict = Depends(verify_admin),
-    user_manager: UserManager = Depends(get_user_manager)
+    user_manager: AsyncManager = Depends(get_user_manager)
 ):
     """Delete a user account (admin only)"""
     try:
-        user = user_manager.get_by_id(user_id)
+        user = await user_manager.get_by_id(user_id)
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         
         if user['id'] == admin['id']:
             raise HTTPException(status_code=400, detail="Cannot delete your own admin account")
             
-        conn = user_manager.conn
-        cursor = conn.cursor()
-        # Delete user related data
-        cursor.execute(f"DELETE FROM banner_history WHERE user_id = {user_manager.p}", (user_id,))
-        cursor.execute(f"DELETE FROM payments WHERE user_id = {user_manager.p}", (user_id,))
-        cursor.execute(f"DELETE FROM users WHERE id = {user_manager.p}", (user_id,))
-        conn.commit()
+        # Delete user related data (kèm cập nhật rollup daily_stats)
+        await user_manager.delete_with_data(user_id)
         
         return {"success": True, "message": f"User {user['email']} and their data have been deleted"}
     except Exception as e:
@@ -422,28 +405,50 @@ async def delete_user(
 async def get_user_banners(
     user_id: int,
     request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, gt=0),
+    cursor: Optional[str] = None,
+    include_prompt: bool = False,
     admin: dict = Depends(verify_admin),
-    banner_manager: BannerHistoryManager = Depends(get_banner_manager)
+    banner_manager: AsyncManager = Depends(get_banner_manager)
 ):
-    """Get banner history for a specific user"""
+    """Get banner history for a specific user, page by page (next page cursor in X-Next-Cursor header)"""
+    limit = clamp_limit(limit)
+    after = decode_cursor(cursor)
     try:
-        banners = banner_manager.get_all(user_id)
+        banners = paginate(await banner_manager.list_page(user_id=user_id, limit=limit, after=after, include_prompt=include_prompt), limit, response)
         for b in banners:
             b['image_url'] = fix_banner_url(b['image_url'], request)
+            add_image_variants(b)
         return banners
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching user banners: {str(e)}")
 
+@router.get("/banners/{banner_id}")
+async def get_banner_detail(
+    banner_id: int,
+    request: Request,
+    admin: dict = Depends(verify_admin),
+    banner_manager: AsyncManager = Depends(get_banner_manager)
+):
+    """Full detail (including prompt_used) of one banner (admin only)"""
+    banner = await banner_manager.get_by_id(banner_id)
+    if not banner:
+        raise HTTPException(status_code=404, detail="Banner not found")
+    banner['image_url'] = fix_banner_url(banner['image_url'], request)
+    add_image_variants(banner)
+    return banner
+
 @router.patch("/banners/{banner_id}/visibility")
 async def admin_toggle_banner_visibility(
     banner_id: int,
     is_hidden: bool = Body(..., embed=True),
     admin: dict = Depends(verify_admin),
-    banner_manager: BannerHistoryManager = Depends(get_banner_manager)
+    banner_manager: AsyncManager = Depends(get_banner_manager)
 ):
     """Admin ẩn/hiện banner trên trang chủ (không xóa)"""
     try:
-        count = banner_manager.admin_set_hidden(banner_id, is_hidden)
+        count = await banner_manager.admin_set_hidden(banner_id, is_hidden)
         if count == 0:
             raise HTTPException(status_code=404, detail="Banner không tìm thấy")
         action = "Ẩn" if is_hidden else "Hiện"
@@ -457,14 +462,14 @@ async def admin_toggle_banner_visibility(
 async def admin_delete_banner(
     banner_id: int,
     admin: dict = Depends(verify_admin),
-    banner_manager: BannerHistoryManager = Depends(get_banner_manager)
+    banner_manager: AsyncManager = Depends(get_banner_manager)
 ):
     """Admin xóa bất kỳ banner nào"""
     try:
-        banner = banner_manager.get_by_id(banner_id)
+        banner = await banner_manager.get_by_id(banner_id)
         if not banner:
             raise HTTPException(status_code=404, detail="Banner không tìm thấy")
-        banner_manager.admin_delete(banner_id)
+        await banner_manager.admin_delete(banner_id)
         return {"message": "Xóa banner thành công"}
     except HTTPException:
         raise
@@ -472,22 +477,15 @@ async def admin_delete_banner(
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 # Config Management
-def get_config_manager():
-    manager = ConfigManager()
-    try:
-        yield manager
-    finally:
-        manager.close()
-
 @router.post("/config/cost")
 async def update_banner_cost(
     cost: int = Body(..., embed=True, gt=0),
     current_user: dict = Depends(verify_admin),
-    config_manager: ConfigManager = Depends(get_config_manager)
+    config_manager: AsyncManager = Depends(get_config_manager)
 ):
     """Update global banner generation cost"""
     try:
-        config_manager.set_value("banner_cost", cost)
+        await config_manager.set_value("banner_cost", cost)
         return {"message": "Updated banner cost", "cost": cost}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -496,11 +494,11 @@ async def update_banner_cost(
 async def update_reference_image_cost(
     cost: float = Body(..., embed=True, gt=0),
     current_user: dict = Depends(verify_admin),
-    config_manager: ConfigManager = Depends(get_config_manager)
+    config_manager: AsyncManager = Depends(get_config_manager)
 ):
     """Update cost per reference image (default 0.5 tokens)"""
     try:
-        config_manager.set_value("reference_image_cost", str(cost))
+        await config_manager.set_value("reference_image_cost", str(cost))
         return {"message": "Updated reference image cost", "cost": cost}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -509,11 +507,11 @@ async def update_reference_image_cost(
 async def update_gemini_safe_mode(
     mode: str = Body(..., embed=True),
     current_user: dict = Depends(verify_admin),
-    config_manager: ConfigManager = Depends(get_config_manager)
+    config_manager: AsyncManager = Depends(get_config_manager)
 ):
     """Update Google Gemini Safey Settings (OFF, BLOCK_LOW_AND_ABOVE, etc)"""
     try:
-        config_manager.set_value("gemini_safe_mode", mode)
+        await config_manager.set_value("gemini_safe_mode", mode)
         return {"message": "Updated safe mode", "mode": mode}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -522,11 +520,12 @@ async def update_gemini_safe_mode(
 async def update_ai_model(
     model: str = Body(..., embed=True),
     current_user: dict = Depends(verify_admin),
-    config_manager: ConfigManager = Depends(get_config_manager)
+    config_manager: AsyncManager = Depends(get_config_manager)
 ):
     """Update AI Model for Text/Brain processing"""
     try:
-        config_manager.set_value("ai_model", model)
+        await config_manager.set_value("ai_model", model)
+        reset_ai_clients()
         return {"message": "Updated AI model", "model": model}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -535,11 +534,12 @@ async def update_ai_model(
 async def update_image_model(
     model: str = Body(..., embed=True),
     current_user: dict = Depends(verify_admin),
-    config_manager: ConfigManager = Depends(get_config_manager)
+    config_manager: AsyncManager = Depends(get_config_manager)
 ):
     """Update Image Generation Model"""
     try:
-        config_manager.set_value("image_model", model)
+        await config_manager.set_value("image_model", model)
+        reset_ai_clients()
         return {"message": "Updated Image model", "model": model}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -548,11 +548,11 @@ async def update_image_model(
 async def update_system_prompt(
     prompt: str = Body(..., embed=True),
     current_user: dict = Depends(verify_admin),
-    config_manager: ConfigManager = Depends(get_config_manager)
+    config_manager: AsyncManager = Depends(get_config_manager)
 ):
     """Update System Prompt for generation"""
     try:
-        config_manager.set_value("system_prompt", prompt)
+        await config_manager.set_value("system_prompt", prompt)
         return {"message": "Updated System Prompt"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -561,11 +561,12 @@ async def update_system_prompt(
 async def update_google_api_key(
     api_key: str = Body(..., embed=True),
     current_user: dict = Depends(verify_admin),
-    config_manager: ConfigManager = Depends(get_config_manager)
+    config_manager: AsyncManager = Depends(get_config_manager)
 ):
     """Update Google API Key"""
     try:
-        config_manager.set_value("google_api_key", api_key)
+        await config_manager.set_value("google_api_key", api_key)
+        reset_ai_clients()
         return {"message": "Updated API Key"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -573,17 +574,19 @@ async def update_google_api_key(
 @router.get("/config")
 async def get_all_config(
     current_user: dict = Depends(verify_admin),
-    config_manager: ConfigManager = Depends(get_config_manager)
+    config_manager: AsyncManager = Depends(get_config_manager)
 ):
     """Get all configuration values"""
     try:
-        banner_cost = int(config_manager.get_value("banner_cost", "1"))
-        reference_image_cost = float(config_manager.get_value("reference_image_cost", "0.5"))
-        gemini_safe_mode = config_manager.get_value("gemini_safe_mode", "OFF")
-        ai_model = config_manager.get_value("ai_model", "gemini-2.5-flash")
-        image_model = config_manager.get_value("image_model", "gemini-3.0-fast-image-preview")
-        system_prompt = config_manager.get_value("system_prompt", "")
-        google_api_key = config_manager.get_value("google_api_key", "")
+        # Một lượt đọc executor cho cả bảng config
+        values = await config_manager.get_all_values()
+        banner_cost = int(values.get("banner_cost", "1"))
+        reference_image_cost = float(values.get("reference_image_cost", "0.5"))
+        gemini_safe_mode = values.get("gemini_safe_mode", "OFF")
+        ai_model = values.get("ai_model", "gemini-2.5-flash")
+        image_model = values.get("image_model", "gemini-3.0-fast-image-preview")
+        system_prompt = values.get("system_prompt", "")
+        google_api_key = values.get("google_api_key", "")
         
         return {
             "banner_cost": banner_cost,
@@ -710,12 +713,12 @@ def extract_seo_from_index_html() -> dict:
 @router.get("/seo")
 async def get_seo_settings(
     admin: dict = Depends(verify_admin),
-    config_manager: ConfigManager = Depends(get_config_manager)
+    config_manager: AsyncManager = Depends(get_config_manager)
 ):
     """Get SEO settings"""
     try:
         # Try to get from DB first
-        seo_json = config_manager.get_value("seo_settings")
+        seo_json = await config_manager.get_value("seo_settings")
         if seo_json:
             import json
             return json.loads(seo_json)
@@ -729,7 +732,7 @@ async def get_seo_settings(
 async def update_seo_settings(
     settings: SeoSettings,
     admin: dict = Depends(verify_admin),
-    config_manager: ConfigManager = Depends(get_config_manager)
+    config_manager: AsyncManager = Depends(get_config_manager)
 ):
     """Update SEO settings (DB + HTML)"""
     try:
@@ -742,7 +745,7 @@ async def update_seo_settings(
         
         # 2. Save to DB (Primary source of truth)
         import json
-        config_manager.set_value("seo_settings", json.dumps(settings.dict()))
+        await config_manager.set_value("seo_settings", json.dumps(settings.dict()))
         
         return {"message": "SEO settings updated successfully in database"}
     except HTTPException:
@@ -754,7 +757,7 @@ async def update_seo_settings(
 @router.post("/seo/sync")
 async def sync_seo_from_html(
     admin: dict = Depends(verify_admin),
-    config_manager: ConfigManager = Depends(get_config_manager)
+    config_manager: AsyncManager = Depends(get_config_manager)
 ):
     """Sync SEO settings from HTML to Database"""
     try:
@@ -763,7 +766,7 @@ async def sync_seo_from_html(
             raise HTTPException(status_code=404, detail="Could not read index.html")
             
         import json
-        config_manager.set_value("seo_settings", json.dumps(data))
+        await config_manager.set_value("seo_settings", json.dumps(data))
         return {"message": "Synced from HTML successfully", "data": data}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
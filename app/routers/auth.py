@@ -4,10 +4,12 @@ from app.models.banner_db import UserManager, LoginSessionManager
 from app.config import settings
 from app.security.jwt import create_access_token, get_current_user
 from app.security.password import get_password_hash, verify_password
+from app.utils.async_db import AsyncManager
 from google.oauth2 import id_token
 from google.auth.transport import requests
 from pydantic import BaseModel, EmailStr
 from datetime import datetime, timedelta
+import asyncio
 import logging
 import httpx
 import json
@@ -17,27 +19,21 @@ logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/auth", tags=["auth"])
 
 def get_user_manager():
-    manager = UserManager()
-    try:
-        yield manager
-    finally:
-        manager.close()
+    return AsyncManager(UserManager)
 
 def get_login_session_manager():
-    manager = LoginSessionManager()
-    try:
-        yield manager
-    finally:
-        manager.close()
+    return AsyncManager(LoginSessionManager)
 
 @router.post("/google")
 async def google_login(
     token: str = Body(..., embed=True), 
-    user_manager: UserManager = Depends(get_user_manager)
+    user_manager: AsyncManager = Depends(get_user_manager)
 ):
     try:
         # Xác thực Google Token thật
-        idinfo = id_token.verify_oauth2_token(
+        # verify_oauth2_token tải cert Google bằng HTTP đồng bộ: chạy ngoài event loop
+        idinfo = await asyncio.to_thread(
+            id_token.verify_oauth2_token,
             token, 
             requests.Request(), 
             settings.GOOGLE_CLIENT_ID
@@ -50,17 +46,17 @@ async def google_login(
         picture = idinfo.get('picture', '')
 
         # Kiểm tra user trong DB
-        user = user_manager.get_by_google_id(google_id)
+        user = await user_manager.get_by_google_id(google_id)
         
         if not user:
             # Nếu chưa có, tạo mới
-            user_id = user_manager.create(
+            user_id = await user_manager.create(
                 email=email, 
                 full_name=name, 
                 google_id=google_id, 
                 avatar_url=picture
             )
-            user = user_manager.get_by_id(user_id)
+            user = await user_manager.get_by_id(user_id)
         
         # Tạo JWT Token
         access_token = create_access_token(data={"sub": str(user['id']), "email": user['email']})
@@ -113,19 +109,19 @@ class RegisterRequest(BaseModel):
 @router.post("/register")
 async def register(
     data: RegisterRequest,
-    user_manager: UserManager = Depends(get_user_manager)
+    user_manager: AsyncManager = Depends(get_user_manager)
 ):
     # Check duplicate username
-    if user_manager.get_by_username(data.username):
+    if await user_manager.get_by_username(data.username):
         raise HTTPException(status_code=400, detail="Tên đăng nhập đã tồn tại")
     
     # Check duplicate email
-    if user_manager.get_by_email(data.email):
+    if await user_manager.get_by_email(data.email):
         raise HTTPException(status_code=400, detail="Email đã được sử dụng")
     
     try:
-        pw_hash = get_password_hash(data.password)
-        user_id = user_manager.create_with_password(
+        pw_hash = await asyncio.to_thread(get_password_hash, data.password)
+        user_id = await user_manager.create_with_password(
             username=data.username,
             email=data.email,
             full_name=data.full_name,
@@ -139,18 +135,18 @@ async def register(
 @router.post("/login")
 async def login(
     data: LoginRequest,
-    user_manager: UserManager = Depends(get_user_manager)
+    user_manager: AsyncManager = Depends(get_user_manager)
 ):
     # Try find by username first
-    user = user_manager.get_by_username(data.account)
+    user = await user_manager.get_by_username(data.account)
     if not user:
         # Then try by email
-        user = user_manager.get_by_email(data.account)
+        user = await user_manager.get_by_email(data.account)
     
     if not user or not user.get('password_hash'):
         raise HTTPException(status_code=401, detail="Tài khoản hoặc mật khẩu không chính xác")
     
-    if not verify_password(data.password, user['password_hash']):
+    if not await asyncio.to_thread(verify_password, data.password, user['password_hash']):
         raise HTTPException(status_code=401, detail="Tài khoản hoặc mật khẩu không chính xác")
     
     # Create Token
@@ -176,11 +172,11 @@ class ForgotPasswordRequest(BaseModel):
 @router.post("/forgot-password")
 async def forgot_password(
     data: ForgotPasswordRequest,
-    user_manager: UserManager = Depends(get_user_manager)
+    user_manager: AsyncManager = Depends(get_user_manager)
 ):
-    user = user_manager.get_by_username(data.account)
+    user = await user_manager.get_by_username(data.account)
     if not user:
-        user = user_manager.get_by_email(data.account)
+        user = await user_manager.get_by_email(data.account)
         
     if not user:
         # For security, don't reveal if user exists. 
@@ -212,14 +208,14 @@ async def forgot_password(
     else:
         count = 1
         
-    user_manager.update_forgot_password_stats(user['id'], count, now.isoformat())
+    await user_manager.update_forgot_password_stats(user['id'], count, now.isoformat())
     
     # Generate a temporary token or simple mock link
     reset_token = create_access_token(data={"sub": str(user['id']), "purpose": "reset_password"}, expires_delta=timedelta(minutes=15))
     
     # [THỰC TẾ] Gửi email chứa link reset
     from app.utils.email_utils import send_reset_email
-    email_sent = send_reset_email(user['email'], reset_token)
+    email_sent = await asyncio.to_thread(send_reset_email, user['email'], reset_token)
     
     # Chuẩn hóa base_url cho mock_link
     base_url = settings.FRONTEND_URL.rstrip('/') if settings.FRONTEND_URL else "http://localhost:3000"
@@ -237,7 +233,7 @@ class ResetPasswordRequest(BaseModel):
 @router.post("/reset-password")
 async def reset_password(
     data: ResetPasswordRequest,
-    user_manager: UserManager = Depends(get_user_manager)
+    user_manager: AsyncManager = Depends(get_user_manager)
 ):
     from jose import jwt, JWTError
     
@@ -249,8 +245,8 @@ async def reset_password(
         if not user_id or purpose != "reset_password":
             raise HTTPException(status_code=401, detail="Token không hợp lệ hoặc đã hết hạn")
             
-        pw_hash = get_password_hash(data.new_password)
-        user_manager.reset_password(int(user_id), pw_hash)
+        pw_hash = await asyncio.to_thread(get_password_hash, data.new_password)
+        await user_manager.reset_password(int(user_id), pw_hash)
         
         return {"success": True, "message": "Đổi mật khẩu thành công. Vui lòng đăng nhập lại."}
         
@@ -264,20 +260,20 @@ async def reset_password(
 @router.post("/login-session")
 async def create_login_session(
     session_id: str = Body(..., embed=True),
-    ls_manager: LoginSessionManager = Depends(get_login_session_manager)
+    ls_manager: AsyncManager = Depends(get_login_session_manager)
 ):
     """Khởi tạo phiên chờ đăng nhập cho Hybrid App."""
-    ls_manager.create_session(session_id)
+    await ls_manager.create_session(session_id)
     return {"success": True, "session_id": session_id}
 
 @router.get("/login-session/{session_id}")
 async def check_login_session(
     session_id: str,
-    ls_manager: LoginSessionManager = Depends(get_login_session_manager),
-    user_manager: UserManager = Depends(get_user_manager)
+    ls_manager: AsyncManager = Depends(get_login_session_manager),
+    user_manager: AsyncManager = Depends(get_user_manager)
 ):
     """Frontend gọi endpoint này để poll trạng thái đăng nhập."""
-    session = ls_manager.get_session(session_id)
+    session = await ls_manager.get_session(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
@@ -287,10 +283,10 @@ async def check_login_session(
         try:
             payload = jwt.decode(session['token'], settings.JWT_SECRET_KEY, algorithms=[settings.JWT_ALGORITHM])
             user_id = payload.get("sub")
-            user = user_manager.get_by_id(user_id)
+            user = await user_manager.get_by_id(user_id)
             
             # Xóa session sau khi lấy thành công (One-time use)
-            ls_manager.delete_session(session_id)
+            await ls_manager.delete_session(session_id)
             
             return {
                 "status": "completed",
@@ -332,8 +328,8 @@ async def google_login_flutter(session_id: str):
 @router.get("/google/callback/flutter")
 async def google_callback_flutter(
     request: Request,
-    ls_manager: LoginSessionManager = Depends(get_login_session_manager),
-    user_manager: UserManager = Depends(get_user_manager)
+    ls_manager: AsyncManager = Depends(get_login_session_manager),
+    user_manager: AsyncManager = Depends(get_user_manager)
 ):
     """Xử lý callback từ Google, cấp JWT và cập nhật DB."""
     code = request.query_params.get("code")
@@ -363,23 +359,23 @@ async def google_callback_flutter(
             return HTMLResponse(content=f"<h2>Lỗi Google Token Exchange</h2><pre>{json.dumps(token_data)}</pre>")
 
         # 2. Verify Google Token
-        idinfo = id_token.verify_oauth2_token(id_token_str, requests.Request(), settings.GOOGLE_CLIENT_ID)
+        idinfo = await asyncio.to_thread(id_token.verify_oauth2_token, id_token_str, requests.Request(), settings.GOOGLE_CLIENT_ID)
         google_id = idinfo['sub']
         email = idinfo['email']
         name = idinfo.get('name', 'User')
         picture = idinfo.get('picture', '')
 
         # 3. Get/Create User in DB
-        user = user_manager.get_by_google_id(google_id)
+        user = await user_manager.get_by_google_id(google_id)
         if not user:
-            user_id = user_manager.create(email=email, full_name=name, google_id=google_id, avatar_url=picture)
-            user = user_manager.get_by_id(user_id)
+            user_id = await user_manager.create(email=email, full_name=name, google_id=google_id, avatar_url=picture)
+            user = await user_manager.get_by_id(user_id)
         
         # 4. Create internal JWT Token
         access_token = create_access_token(data={"sub": str(user['id']), "email": user['email']})
         
         # 5. Update Login Session in DB
-        ls_manager.update_session(session_id, access_token)
+        await ls_manager.update_session(session_id, access_token)
         
         # 6. Return Success Page
         return HTMLResponse(content="""
@@ -1,61 +1,56 @@
-from app.models.banner_db import UserManager, BannerHistoryManager, ConfigManager, TasksManager
-from fastapi import APIRouter, Request, Form, HTTPException, Depends, Body, BackgroundTasks, UploadFile, File
-from fastapi.responses import JSONResponse, FileResponse
+from app.models.banner_db import UserManager, BannerHistoryManager, ConfigManager, TasksManager, LeaseLostError
+from fastapi import APIRouter, Request, Response, Form, HTTPException, Depends, Body, BackgroundTasks, UploadFile, File, Query
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from app.config import settings
 from app.security.security import get_api_key
-from app.security.jwt import get_current_user
+from app.security.jwt import get_current_user, get_current_user_stream, create_stream_token
 from app.utils.image_processing import (
     get_compatible_aspect_ratio,
     resize_image,
     get_resolution,
-    create_text_reference_image
+    create_text_reference_image,
+    encode_banner,
+    write_file_bytes
 )
-from chatbot.chatbot.utils.prompt_generator import PromptGenerator
-from chatbot.chatbot.utils.prompt_analyzer import PromptAnalyzer
-from chatbot.chatbot.utils.llm import LLM
-from app.utils.font_manager import download_fonts, get_font_path
-from google import genai
+from app.utils.font_manager import get_font_path
 from google.genai import types
 from PIL import Image
 from io import BytesIO
 import uuid
 import os
+import mimetypes
 import json
 import asyncio
 from typing import Optional
 from app.utils.task_manager import ram_task_manager
+from app.utils.event_bus import task_event_bus
+from app.utils.async_db import AsyncManager
+from app.utils.ai_clients import get_genai_client, get_prompt_analyzer_chain, get_prompt_generator_chain
+from app.utils.prompt_cache import prompt_result_cache
+from app.utils.semantic_cache import semantic_prompt_cache
+from chatbot.chatbot.utils.prompt_analyzer import PromptAnalyzerFormat
 from app.utils.cloudinary_utils import upload_to_cloudinary
+from app.utils.upload_pipeline import upload_pipeline
+from app.utils.image_variants import add_image_variants, generate_variants, get_variant_path, snap_width
 
 router = APIRouter(prefix="/generate", tags=["banner"])
 
 def get_config_manager():
-    manager = ConfigManager()
-    try:
-        yield manager
-    finally:
-        manager.close()
+    return AsyncManager(ConfigManager)
 
 def get_user_manager():
-    manager = UserManager()
-    try:
-        yield manager
-    finally:
-        manager.close()
+    return AsyncManager(UserManager)
 
 def get_banner_history_manager():
-    manager = BannerHistoryManager()
-    try:
-        yield manager
-    finally:
-        manager.close()
+    return AsyncManager(BannerHistoryManager)
 
 def get_tasks_manager():
-    manager = TasksManager()
-    try:
-        yield manager
-    finally:
-        manager.close()
+    return AsyncManager(TasksManager)
+
+# Python 3.10 chưa nhận diện đuôi .avif/.webp ở mọi hệ điều hành
+mimetypes.add_type("image/webp", ".webp")
+mimetypes.add_type("image/avif", ".avif")
 
 # Định nghĩa thư mục chứa banner
 project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -70,23 +65,63 @@ if not os.path.exists(BASE_DIR):
             os.makedirs(BASE_DIR)
 
 from app.utils.url import fix_banner_url
+from app.utils.http_cache import cached_file_response, cached_bytes_response
+from app.utils.banner_files import banner_file_index
+from app.utils.gallery_cache import public_gallery_cache
+from app.utils.pagination import clamp_limit, decode_cursor, paginate
 
 async def generate_prompt_text(aspect_ratio: str, resolution: str, user_request: str):
-    llm_generate = PromptGenerator(LLM().get_llm(settings.LLM_PROVIDER)).get_chain()
-    prompt = await llm_generate.ainvoke({
+    inputs = {
         "aspect_ratio": aspect_ratio,
         "size_images": resolution,
         "user_request": user_request,
-    })
-    return prompt
+    }
 
-async def generate_banner(
+    async def compute():
+        llm_generate = get_prompt_generator_chain(settings.LLM_PROVIDER)
+        return await llm_generate.ainvoke(inputs)
+
+    async def similar_inputs():
+        return [{**inputs, "user_request": text} for text in semantic_prompt_cache.find_similar(user_request)]
+
+    # Request lặp lại (cùng yêu cầu, tỉ lệ, kích thước, model) dùng lại prompt đã sinh,
+    # request cùng nội dung nhưng khác cách viết (thứ tự từ, dấu câu, khoảng trắng) dùng lại prompt của request cũ
+    return await prompt_result_cache.get_or_compute(
+        "prompt", inputs, compute,
+        provider=settings.LLM_PROVIDER,
+        alternates=similar_inputs
+    )
+
+async def analyze_request(user_request: str):
+    inputs = {"description": user_request}
+
+    async def compute():
+        analyzer = get_prompt_analyzer_chain(settings.LLM_PROVIDER)
+        result = await analyzer.ainvoke(inputs)
+        if result is not None:
+            # Ghi nhớ request để các request cùng nội dung sau này dùng lại kết quả
+            semantic_prompt_cache.remember(user_request)
+        return result
+
+    async def similar_inputs():
+        return [{"description": text} for text in semantic_prompt_cache.find_similar(user_request)]
+
+    return await prompt_result_cache.get_or_compute(
+        "analysis", inputs, compute,
+        encode=lambda result: PromptAnalyzerFormat.model_validate(result).model_dump_json(),
+        decode=PromptAnalyzerFormat.model_validate_json,
+        provider=settings.LLM_PROVIDER,
+        alternates=similar_inputs
+    )
+
+async def generate_banner_bytes(
     prompt: str, 
     aspect_ratio: str = "1:1", 
     reference_images: Optional[list] = None,
     api_key: str = None,
     model_id: str = None
-) -> Optional[Image.Image]:
+) -> Optional[bytes]:
+    """Gọi model sinh ảnh và trả về nguyên bytes ảnh đã mã hóa (PNG/JPEG...) mà model trả về."""
     full_prompt = prompt
     
     contents = [full_prompt]
@@ -96,7 +131,7 @@ async def generate_banner(
 
     api_key = api_key or settings.KEY_API_GOOGLE
     model_id = model_id or settings.GOOGLE_LLM_IMAGE
-    client = genai.Client(api_key=api_key)
+    client = get_genai_client(api_key)
     try:
         def sync_generate():
             if 'imagen' in model_id.lower():
@@ -127,22 +162,19 @@ async def generate_banner(
 
         # For Imagen Models (GenerateImagesResponse)
         if hasattr(response, 'generated_images') and response.generated_images:
-            image_bytes = response.generated_images[0].image.image_bytes
-            return await asyncio.to_thread(Image.open, BytesIO(image_bytes))
+            return response.generated_images[0].image.image_bytes
 
         # New SDK structure (Gemini 3.1 / 2.x)
         if hasattr(response, 'candidates') and response.candidates:
             for part in response.candidates[0].content.parts:
                 if part.inline_data:
-                    image = await asyncio.to_thread(Image.open, BytesIO(part.inline_data.data))
-                    return image
+                    return part.inline_data.data
         
         # Fallback for direct parts shortcut (if exists)
         if hasattr(response, 'parts') and response.parts:
             for part in response.parts:
                 if part.inline_data:
-                    image = await asyncio.to_thread(Image.open, BytesIO(part.inline_data.data))
-                    return image
+                    return part.inline_data.data
                     
         return None
     except Exception as e:
@@ -151,156 +183,196 @@ async def generate_banner(
         traceback.print_exc()
         return None
 
+async def generate_banner(
+    prompt: str, 
+    aspect_ratio: str = "1:1", 
+    reference_images: Optional[list] = None,
+    api_key: str = None,
+    model_id: str = None
+) -> Optional[Image.Image]:
+    image_bytes = await generate_banner_bytes(prompt, aspect_ratio, reference_images, api_key, model_id)
+    if not image_bytes:
+        return None
+    return await asyncio.to_thread(Image.open, BytesIO(image_bytes))
+
 @router.get("/public-banners")
 async def get_public_banners(
     request: Request,
-    limit: int = 20,
-    banner_history: BannerHistoryManager = Depends(get_banner_history_manager)
+    limit: int = 20
 ):
     """
     Lấy danh sách banner public — không yêu cầu xác thực.
-    Dùng để hiển thị gallery trên trang chủ.
+    Dùng để hiển thị gallery trên trang chủ. Phục vụ từ snapshot trong RAM kèm ETag (304 khi không đổi).
     """
-    banners = banner_history.get_public_banners(limit=min(limit, 50))
-    for b in banners:
-        b['image_url'] = fix_banner_url(b['image_url'], request)
-    return banners
+    body, etag = await public_gallery_cache.render(request, limit)
+    return cached_bytes_response(request, body, etag, max_age=settings.GALLERY_CACHE_MAX_AGE)
 
 @router.patch("/history/{banner_id}/public")
 async def toggle_banner_public(
     banner_id: int,
     is_public: bool = Body(..., embed=True),
     current_user: dict = Depends(get_current_user),
-    banner_history: BannerHistoryManager = Depends(get_banner_history_manager)
+    banner_history: AsyncManager = Depends(get_banner_history_manager)
 ):
     """
     Toggle trạng thái public/private của một banner.
     """
-    count = banner_history.set_public(banner_id, current_user['id'], is_public)
+    count = await banner_history.set_public(banner_id, current_user['id'], is_public)
     if count == 0:
         raise HTTPException(status_code=404, detail="Banner không tìm thấy hoặc không có quyền")
     return {"message": "Cập nhật thành công", "is_public": is_public}
 
 @router.get("/view/{file_id}")
-async def view_banner(file_id: str, download: bool = False):
+async def view_banner(request: Request, file_id: str, download: bool = False, w: Optional[int] = Query(None, gt=0)):
     """
     Tự động tìm ảnh theo UUID hoặc tên file trong thư mục banners.
-    Hỗ trợ tìm kiếm cả khi có hoặc không có đuôi mở rộng .png.
+    Hỗ trợ tìm kiếm cả khi có hoặc không có đuôi mở rộng (.png/.webp/.jpg/.avif).
+    ?w=<px>: trả biến thể WebP thu nhỏ (làm tròn lên theo IMAGE_VARIANT_WIDTHS, cache trên đĩa).
     """
-    # Nếu file_id đã có đuôi mở rộng phổ biến
-    if any(file_id.lower().endswith(ext) for ext in ['.png', '.jpg', '.jpeg', '.webp']):
-        filename = file_id
-    else:
-        filename = f"{file_id}.png"
-        
-    file_path = os.path.join(BASE_DIR, filename)
-    
-    if not os.path.exists(file_path):
-        # Thử tìm file bất kỳ bắt đầu bằng file_id nếu không tìm thấy chính xác
-        try:
-            files = [f for f in os.listdir(BASE_DIR) if f.startswith(file_id)]
-            if files:
-                file_path = os.path.join(BASE_DIR, files[0])
-            else:
-                raise HTTPException(status_code=404, detail="Không tìm thấy ảnh")
-        except:
-             raise HTTPException(status_code=404, detail="Không tìm thấy ảnh")
+    # Tra trong index (O(1)), không liệt kê thư mục banners khi không tìm thấy
+    file_path = banner_file_index.lookup(BASE_DIR, file_id)
+    if not file_path:
+        raise HTTPException(status_code=404, detail="Không tìm thấy ảnh")
+    filename = os.path.basename(file_path)
             
     if download:
-        return FileResponse(file_path, filename=filename)
-    return FileResponse(file_path)
+        return cached_file_response(request, file_path, filename=filename)
+
+    if w:
+        variant_width = snap_width(w)
+        if variant_width:
+            try:
+                file_path = await asyncio.to_thread(get_variant_path, file_path, variant_width)
+            except Exception as e:
+                print(f"[WARN] Không tạo được biến thể {variant_width}px cho {filename}: {e}")
+                # Trả ảnh gốc tạm thời: không cho cache lâu dài dưới URL biến thể (lần sau có thể tạo được)
+                return cached_file_response(request, file_path, immutable=False)
+    return cached_file_response(request, file_path)
 
 @router.get("/reference/{filename}")
-async def view_reference_image(filename: str):
+async def view_reference_image(request: Request, filename: str):
     """
     Xem ảnh tham chiếu đã upload
     """
     file_path = os.path.join(project_root, "uploads", "references", filename)
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="Không tìm thấy ảnh tham chiếu")
-    return FileResponse(file_path)
+    return cached_file_response(request, file_path)
 
 async def process_banner_task(task_id: str, user_id: int, request_data: dict):
     """
     Background worker to process banner generation
     """
-    tasks_manager = TasksManager()
-    user_manager = UserManager()
-    banner_history = BannerHistoryManager()
-    config_manager = ConfigManager()
+    tasks_manager = AsyncManager(TasksManager)
+    user_manager = AsyncManager(UserManager)
+    banner_history = AsyncManager(BannerHistoryManager)
+    config_manager = AsyncManager(ConfigManager)
+    # Backend "db": mọi lượt ghi đều kèm worker đang giữ lease, hết lease thì LeaseLostError và dừng
+    lease_owner = ram_task_manager.get_lease_owner(task_id)
+
+    async def set_task_status(status: str, result=None, error_message=None):
+        # Ghi trạng thái vào DB rồi đẩy ngay tới các client đang stream tiến trình
+        await tasks_manager.update_task(task_id, status, result=json.dumps(result) if result is not None else None, error_message=error_message, lease_owner=lease_owner)
+        ram_task_manager.publish(task_id, "status", status=status, result=result or [], error=error_message)
     
     try:
-        tasks_manager.update_task(task_id, "processing")
+        # Khi task được claim lại (restart/lease hết hạn), giữ các ảnh đã sinh và đã trừ token
+        passed_banner = []
+        existing_task = await tasks_manager.get_task(task_id)
+        if existing_task and existing_task.get('result'):
+            try:
+                passed_banner = json.loads(existing_task['result']) or []
+            except Exception:
+                passed_banner = []
+        await set_task_status("processing", result=passed_banner if passed_banner else None)
         
         # Extract params
         width = request_data.get("width")
         height = request_data.get("height")
-        number = request_data.get("number")
+        number = request_data.get("number") - len(passed_banner)
+        if number <= 0:
+            await set_task_status("completed", result=passed_banner)
+            return
         user_request = request_data.get("user_request")
         reference_image_paths = request_data.get("reference_image_paths", [])  # Danh sách đường dẫn ảnh tham chiếu
         reference_labels = request_data.get("reference_labels", [])  # Danh sách nhãn tương ứng
         is_public = request_data.get("is_public", True)
         
+        # Đọc toàn bộ cấu hình hệ thống một lần (từ cache của ConfigManager)
+        configs = await config_manager.get_all_values()
+
         # Get dynamic cost
-        cost_per_image = int(config_manager.get_value("banner_cost", "1"))
+        cost_per_image = int(configs.get("banner_cost", "1"))
         # Mỗi ảnh tham chiếu tính thêm token (có thể cấu hình trong admin)
-        reference_image_cost = len(reference_image_paths) * float(config_manager.get_value("reference_image_cost", "0.5"))
+        reference_image_cost = len(reference_image_paths) * float(configs.get("reference_image_cost", "0.5"))
         total_cost = number * (cost_per_image + reference_image_cost)
         
         # Check balance again (double check)
-        user = user_manager.get_by_id(user_id)
+        user = await user_manager.get_by_id(user_id)
         if user['tokens'] < total_cost:
-            tasks_manager.update_task(task_id, "failed", error_message="Insufficient tokens during processing")
+            await set_task_status("failed", error_message="Insufficient tokens during processing")
             return
 
-        # 0. Chuẩn bị font chữ
-        download_fonts()
-
         aspect_ratio = get_compatible_aspect_ratio(width, height)
         resolution = get_resolution(aspect_ratio)
-
-        passed_banner = []
         
-        # 1. Phân tích yêu cầu
+        # 1. Phân tích yêu cầu và tạo prompt chi tiết là hai lượt gọi LLM độc lập -> chạy song song.
+        # Ảnh tham chiếu text chỉ phụ thuộc kết quả phân tích nên được render ngay khi phân tích xong.
         print("[INFO] Đang phân tích yêu cầu...")
-        analyzer = PromptAnalyzer(LLM().get_llm(settings.LLM_PROVIDER)).get_chain()
-        conditions = await analyzer.ainvoke({"description": user_request})
-        text_elements = conditions.text_elements if hasattr(conditions, 'text_elements') and conditions.text_elements else []
-        
-        # 2. Load ảnh tham chiếu từ người dùng (nếu có)
-        user_reference_images = []
-        if reference_image_paths:
-            print(f"📸 Đang load {len(reference_image_paths)} ảnh tham chiếu từ người dùng...")
-            for i, img_path in enumerate(reference_image_paths):
-                try:
-                    img = await asyncio.to_thread(Image.open, img_path)
-                    user_reference_images.append(img)
-                    label = reference_labels[i] if i < len(reference_labels) else f"img_{i}"
-                    print(f"  ✅ Đã load: {os.path.basename(img_path)} as @{label}")
-                except Exception as e:
-                    print(f"  ⚠️ Không thể load ảnh {img_path}: {e}")
-        
-        # 3. Tạo danh sách các ảnh tham chiếu từ text
-        text_refs = []
-        for el in text_elements:
-            font_path = get_font_path(el.font_suggestion)
+        analysis_task = asyncio.create_task(analyze_request(user_request))
+        prompt_task = asyncio.create_task(generate_prompt_text(aspect_ratio, resolution, user_request))
+
+        async def render_text_references():
+            conditions = await analysis_task
+            elements = conditions.text_elements if hasattr(conditions, 'text_elements') and conditions.text_elements else []
             # create_text_reference_image usually involves drawing, better in thread
-            ref = await asyncio.to_thread(
-                create_text_reference_image,
-                width * 2, height * 2, 
-                text=el.content, 
-                font_path=font_path, 
-                text_color=el.color_suggestion,
-                position=el.position_suggestion
+            refs = await asyncio.gather(*(
+                asyncio.to_thread(
+                    create_text_reference_image,
+                    width * 2, height * 2, 
+                    text=el.content, 
+                    font_path=get_font_path(el.font_suggestion), 
+                    text_color=el.color_suggestion,
+                    position=el.position_suggestion
+                )
+                for el in elements
+            ))
+            return elements, list(refs)
+
+        # 2. Load ảnh tham chiếu từ người dùng (nếu có)
+        async def load_user_references():
+            images = []
+            if reference_image_paths:
+                print(f"📸 Đang load {len(reference_image_paths)} ảnh tham chiếu từ người dùng...")
+                for i, img_path in enumerate(reference_image_paths):
+                    try:
+                        img = await asyncio.to_thread(Image.open, img_path)
+                        # Load hẳn dữ liệu ảnh vì nhiều lượt sinh ảnh song song sẽ đọc chung object này
+                        await asyncio.to_thread(img.load)
+                        images.append(img)
+                        label = reference_labels[i] if i < len(reference_labels) else f"img_{i}"
+                        print(f"  ✅ Đã load: {os.path.basename(img_path)} as @{label}")
+                    except Exception as e:
+                        print(f"  ⚠️ Không thể load ảnh {img_path}: {e}")
+            return images
+
+        # 3. Đợi cả ba nhánh: (phân tích -> ảnh text), prompt chi tiết, ảnh tham chiếu người dùng
+        try:
+            (text_elements, text_refs), base_prompt, user_reference_images = await asyncio.gather(
+                render_text_references(),
+                prompt_task,
+                load_user_references()
             )
-            text_refs.append(ref)
+        except Exception:
+            analysis_task.cancel()
+            prompt_task.cancel()
+            raise
 
         # 4. Tạo prompt chi tiết
         text_descriptions = [f"'{el.content}' (Màu: {el.color_suggestion}, Vị trí: {el.position_suggestion})" for el in text_elements]
-        base_prompt = await generate_prompt_text(aspect_ratio, resolution, user_request)
         
         # Thêm System Prompt từ Admin Config
-        custom_system_prompt = config_manager.get_value("system_prompt", "")
+        custom_system_prompt = configs.get("system_prompt", "")
         if custom_system_prompt:
             base_prompt += "\n\nCRITICAL DESIGN STYLE/SYSTEM PROMPT:\n" + custom_system_prompt + "\n"
         
@@ -354,18 +426,36 @@ async def process_banner_task(task_id: str, user_id: int, request_data: dict):
         all_reference_images = user_reference_images + text_refs
 
         # Lấy cấu hình API Key và Image Model từ DB
-        db_api_key = config_manager.get_value("google_api_key", "")
-        db_image_model = config_manager.get_value("image_model", "")
+        db_api_key = configs.get("google_api_key", "")
+        db_image_model = configs.get("image_model", "")
 
         # 5. Sinh banner
         # Tính chi phí đầy đủ cho mỗi banner (bao gồm ảnh tham chiếu)
-        reference_image_cost_per_banner = len(reference_image_paths) * float(config_manager.get_value("reference_image_cost", "0.5"))
-        total_cost_per_banner = cost_per_image + reference_image_cost_per_banner
+        total_cost_per_banner = cost_per_image + reference_image_cost
         
+        # Trải phẳng reference_images để lưu vào DB
+        ref_images_data = []
+        if reference_image_paths:
+            for i, p in enumerate(reference_image_paths):
+                ref_images_data.append({
+                    "path": os.path.basename(p),
+                    "label": reference_labels[i] if i < len(reference_labels) else f"img_{i}"
+                })
+
+        # Các ảnh được sinh song song (giới hạn bởi semaphore); kết quả giữ đúng thứ tự theo slot
+        previous_banners = list(passed_banner)
+        banner_slots = [None] * number
+        image_semaphore = asyncio.Semaphore(max(1, settings.BANNER_IMAGE_CONCURRENCY))
+        result_lock = asyncio.Lock()
         generated_count = 0
-        for _ in range(number):
-            try:
-                banner = await generate_banner(
+
+        def collect_banners():
+            return previous_banners + [url for url in banner_slots if url]
+
+        async def generate_one(index: int):
+            nonlocal generated_count
+            async with image_semaphore:
+                image_bytes = await generate_banner_bytes(
                     full_prompt_to_ai, 
                     aspect_ratio, 
                     reference_images=all_reference_images,
@@ -373,86 +463,90 @@ async def process_banner_task(task_id: str, user_id: int, request_data: dict):
                     model_id=db_image_model if db_image_model else None
                 )
                 
-                if not banner:
-                    continue
+                if not image_bytes:
+                    return
 
-                # Resize và lưu
-                banner = await asyncio.to_thread(resize_image, banner, width, height)
-                file_name = f"{uuid.uuid4()}.png"
+                # Resize + mã hóa trong bộ nhớ (giữ nguyên bytes gốc nếu model đã trả đúng kích thước/định dạng)
+                image_bytes, ext = await asyncio.to_thread(encode_banner, image_bytes, width, height)
+                file_name = f"{uuid.uuid4()}{ext}"
                 file_path = os.path.join(BASE_DIR, file_name)
-                await asyncio.to_thread(banner.save, file_path, "PNG")
-                
-                # Tải lên Cloudinary để lưu trữ vĩnh viễn (Phòng trường hợp chạy local/restart Render)
-                cloud_url = await asyncio.to_thread(upload_to_cloudinary, file_path, folder="banners")
-                
-                # Ưu tiên dùng Cloud URL, nếu thất bại mới dùng Local URL
-                banner_url = cloud_url if cloud_url else f"{settings.API_URL}/api/v1/generate/view/{file_name}"
-                # Fallback if API_URL not set in settings? app/config.py usually has it?
-                # If not, let's use relative path "/banners/..." and let frontend prepend host if needed.
-                # User's previous code used `request.url_for`.
-                # Let's use relative for now: `/banners/{file_name}`.
-                
-                passed_banner.append(banner_url)
-                
-                # Update task results in DB immediately to prevent loss on F5
-                tasks_manager.update_task(task_id, "processing", result=json.dumps(passed_banner)) 
-
-                # Trải phẳng reference_images để lưu vào DB
-                ref_images_data = []
-                if reference_image_paths:
-                    for i, p in enumerate(reference_image_paths):
-                        ref_images_data.append({
-                            "path": os.path.basename(p),
-                            "label": reference_labels[i] if i < len(reference_labels) else f"img_{i}"
-                        })
-
-                # 1. Lưu lịch sử trước (the product)
-                history_id = banner_history.create(
-                    user_id=user_id,
-                    description=user_request,
-                    aspect_ratio=aspect_ratio,
-                    resolution=resolution,
-                    prompt=full_prompt_to_ai,
-                    image_url=banner_url,
-                    token_cost=total_cost_per_banner,
-                    reference_images=json.dumps(ref_images_data) if ref_images_data else None,
-                    is_public=is_public
-                )
-
-                if history_id:
-                    # 2. Chỉ trừ token nếu đã lưu lịch sử thành công
-                    user_manager.update_token(user_id, -total_cost_per_banner)
-                    generated_count += 1
-                else:
+                await asyncio.to_thread(write_file_bytes, file_path, image_bytes)
+                banner_file_index.add(file_name)
+                if settings.IMAGE_VARIANTS_EAGER:
+                    # Tạo thumbnail/medium nền, không chặn slot sinh ảnh
+                    asyncio.create_task(asyncio.to_thread(generate_variants, file_path))
+            
+            # Trả URL local ngay; upload Cloudinary chạy nền và đổi sang URL CDN khi xong
+            banner_url = f"{settings.API_URL}/api/v1/generate/view/{file_name}"
+
+            # Lưu lịch sử, trừ token và lưu tiến độ task (để không mất khi F5/restart) trong một transaction:
+            # task được claim lại không bao giờ coi là xong một ảnh chưa trừ token.
+            # (khóa để các lượt ghi song song không ghi đè tiến độ bằng danh sách cũ hơn)
+            async with result_lock:
+                banner_slots[index] = banner_url
+                try:
+                    history_id = await banner_history.create_for_task(
+                        task_id,
+                        json.dumps(collect_banners()),
+                        user_id=user_id,
+                        description=user_request,
+                        aspect_ratio=aspect_ratio,
+                        resolution=resolution,
+                        prompt=full_prompt_to_ai,
+                        image_url=banner_url,
+                        token_cost=total_cost_per_banner,
+                        reference_images=json.dumps(ref_images_data) if ref_images_data else None,
+                        is_public=is_public,
+                        lease_owner=lease_owner
+                    )
+                except Exception as e:
                     print(f"⚠️ Lỗi: Không thể lưu banner_history cho user {user_id}. Token không bị trừ.")
-
-            except Exception as e:
-                print(f"Lỗi tạo banner: {str(e)}")
-                continue
+                    banner_slots[index] = None
+                    if isinstance(e, LeaseLostError):
+                        # Worker khác đã tiếp quản task: dừng các ảnh còn lại, không gọi model thêm
+                        for job in jobs:
+                            if job is not asyncio.current_task():
+                                job.cancel()
+                    raise
+            generated_count += 1
+            ram_task_manager.publish(task_id, "image", url=banner_url, index=len(previous_banners) + index)
+
+            # Tải lên Cloudinary để lưu trữ vĩnh viễn (Phòng trường hợp chạy local/restart Render)
+            upload_pipeline.enqueue(file_path, history_id, banner_url)
+
+        jobs = [asyncio.create_task(generate_one(i)) for i in range(number)]
+        results = await asyncio.gather(*jobs, return_exceptions=True)
+        for result in results:
+            if isinstance(result, LeaseLostError):
+                raise result
+            if isinstance(result, Exception):
+                print(f"Lỗi tạo banner: {str(result)}")
+        passed_banner = collect_banners()
         
-        if generated_count > 0:
-            tasks_manager.update_task(task_id, "completed", result=json.dumps(passed_banner))
+        if generated_count > 0 or passed_banner:
+            await set_task_status("completed", result=passed_banner)
         else:
-            tasks_manager.update_task(task_id, "failed", error_message="Failed to generate any banners")
+            await set_task_status("failed", error_message="Failed to generate any banners")
             
+    except LeaseLostError:
+        raise
     except Exception as e:
         print(f"Task failed: {e}")
-        tasks_manager.update_task(task_id, "failed", error_message=str(e))
-    finally:
-        tasks_manager.close()
-        user_manager.close()
-        banner_history.close()
-        config_manager.close()
+        await set_task_status("failed", error_message=str(e))
+
+ram_task_manager.set_handler(process_banner_task)
 
 @router.get("/stats")
 async def get_dashboard_stats(
     request: Request,
     current_user: dict = Depends(get_current_user),
-    banner_history: BannerHistoryManager = Depends(get_banner_history_manager)
+    banner_history: AsyncManager = Depends(get_banner_history_manager)
 ):
     user_id = current_user['id']
-    total_banners = banner_history.count_by_user(user_id)
-    recent_banners = banner_history.get_recent_by_user(user_id, limit=4)
+    # Counter user_stats được cập nhật cùng transaction khi tạo/xóa banner
+    user_stats = await banner_history.get_user_stats(user_id)
+    total_banners = user_stats['banner_count']
+    recent_banners = await banner_history.get_recent_by_user(user_id, limit=4)
     
     score_label = "Beginner"
     if total_banners > 10:
@@ -465,6 +559,7 @@ async def get_dashboard_stats(
     # Fix URLs và reference images
     for project in recent_banners:
         project['image_url'] = fix_banner_url(project['image_url'], request)
+        add_image_variants(project)
         if project.get('reference_images'):
             try:
                 refs = json.loads(project['reference_images'])
@@ -475,7 +570,7 @@ async def get_dashboard_stats(
             except:
                 project['reference_images_list'] = []
 
-    total_spent = banner_history.get_total_spent_by_user(user_id)
+    total_spent = user_stats['total_spent']
     
     return {
         "total_banners": total_banners,
@@ -486,8 +581,8 @@ async def get_dashboard_stats(
     }
 
 @router.get("/cost")
-async def get_banner_cost(config_manager: ConfigManager = Depends(get_config_manager)):
-    cost = config_manager.get_value("banner_cost", "1")
+async def get_banner_cost(config_manager: AsyncManager = Depends(get_config_manager)):
+    cost = await config_manager.get_value("banner_cost", "1")
     return {"cost": int(cost)}
 
 @router.post("/banners")
@@ -503,8 +598,8 @@ async def create_generate_task(
     existing_reference_images: Optional[str] = Form(None), # JSON string: [{"path": "...", "label": "..."}]
     is_public: bool = Form(True),
     current_user: dict = Depends(get_current_user),
-    config_manager: ConfigManager = Depends(get_config_manager),
-    tasks_manager: TasksManager = Depends(get_tasks_manager)
+    config_manager: AsyncManager = Depends(get_config_manager),
+    tasks_manager: AsyncManager = Depends(get_tasks_manager)
 ):
     """
     Initiates banner generation task with optional reference images.
@@ -563,8 +658,9 @@ async def create_generate_task(
                 print(f"Lỗi tải ảnh tham chiếu lên Cloudinary: {e}")
     
     # 2. Validate Balance (bao gồm cả chi phí ảnh tham chiếu)
-    cost_per_image = int(config_manager.get_value("banner_cost", "1"))
-    reference_image_cost_per_banner = len(reference_image_paths) * float(config_manager.get_value("reference_image_cost", "0.5"))
+    configs = await config_manager.get_all_values()
+    cost_per_image = int(configs.get("banner_cost", "1"))
+    reference_image_cost_per_banner = len(reference_image_paths) * float(configs.get("reference_image_cost", "0.5"))
     total_cost_per_banner = cost_per_image + reference_image_cost_per_banner
     total_cost = number * total_cost_per_banner
 
@@ -590,9 +686,9 @@ async def create_generate_task(
         "is_public": is_public
     }
     
-    tasks_manager.create_task(task_id, user_id, json.dumps(request_data))
+    await tasks_manager.create_task(task_id, user_id, json.dumps(request_data))
     
-    # 4. Trigger RAM Background Process (Sequential)
+    # 4. Trigger RAM Background Process (Worker pool)
     await ram_task_manager.add_task(task_id, user_id, request_data, process_banner_task)
     
     # Thông báo về ảnh tham chiếu
@@ -603,20 +699,7 @@ async def create_generate_task(
     
     return {"task_id": task_id, "status": "pending", "message": message, "reference_images_count": len(reference_image_paths)}
 
-@router.get("/tasks/{task_id}")
-async def get_task_status(
-    task_id: str,
-    request: Request,
-    current_user: dict = Depends(get_current_user),
-    tasks_manager: TasksManager = Depends(get_tasks_manager)
-):
-    task = tasks_manager.get_task(task_id)
-    if not task:
-        raise HTTPException(status_code=404, detail="Task not found")
-    
-    if task['user_id'] != current_user['id']:
-        raise HTTPException(status_code=403, detail="Not authorized to view this task")
-        
+def _task_payload(task: dict, request: Request) -> dict:
     result = None
     if task['result']:
         try:
@@ -634,16 +717,152 @@ async def get_task_status(
         "created_at": task['created_at']
     }
 
+def _sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str, ensure_ascii=False)}\n\n"
+
+@router.get("/tasks/{task_id}")
+async def get_task_status(
+    task_id: str,
+    request: Request,
+    current_user: dict = Depends(get_current_user),
+    tasks_manager: AsyncManager = Depends(get_tasks_manager)
+):
+    task = await tasks_manager.get_task(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    if task['user_id'] != current_user['id']:
+        raise HTTPException(status_code=403, detail="Not authorized to view this task")
+        
+    return _task_payload(task, request)
+
+@router.post("/tasks/{task_id}/stream-token")
+async def create_task_stream_token(
+    task_id: str,
+    current_user: dict = Depends(get_current_user),
+    tasks_manager: AsyncManager = Depends(get_tasks_manager)
+):
+    """
+    Cấp token ngắn hạn (TASK_STREAM_TOKEN_TTL) chỉ dùng cho /tasks/{task_id}/events:
+    EventSource không gửi được header Authorization nên token phải nằm trên URL.
+    """
+    task = await tasks_manager.get_task(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if task['user_id'] != current_user['id']:
+        raise HTTPException(status_code=403, detail="Not authorized to view this task")
+    return {"token": create_stream_token(current_user['id'], task_id), "expires_in": settings.TASK_STREAM_TOKEN_TTL}
+
+@router.get("/tasks/{task_id}/events")
+async def stream_task_events(
+    task_id: str,
+    request: Request,
+    current_user: dict = Depends(get_current_user_stream),
+    tasks_manager: AsyncManager = Depends(get_tasks_manager)
+):
+    """
+    Stream tiến trình task qua Server-Sent Events thay cho polling:
+    - event "status": snapshot đầy đủ (status, result, error) mỗi khi trạng thái đổi
+    - event "image": URL của từng ảnh ngay khi được sinh xong
+    Stream tự đóng khi task completed/failed.
+    """
+    # Subscribe trước khi đọc snapshot để không lỡ sự kiện xảy ra ở giữa
+    queue = task_event_bus.subscribe(task_id)
+    try:
+        task = await tasks_manager.get_task(task_id)
+    except Exception:
+        task_event_bus.unsubscribe(task_id, queue)
+        raise
+    if not task:
+        task_event_bus.unsubscribe(task_id, queue)
+        raise HTTPException(status_code=404, detail="Task not found")
+    if task['user_id'] != current_user['id']:
+        task_event_bus.unsubscribe(task_id, queue)
+        raise HTTPException(status_code=403, detail="Not authorized to view this task")
+
+    async def event_stream():
+        try:
+            snapshot = _task_payload(task, request)
+            last_state = (snapshot["status"], task['result'])
+            yield _sse_event("status", snapshot)
+            if snapshot["status"] in ("completed", "failed"):
+                return
+
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + settings.TASK_STREAM_MAX_SECONDS
+            last_sent = loop.time()
+            while loop.time() < deadline:
+                if await request.is_disconnected():
+                    return
+                # Task chạy trong process này thì sự kiện đến qua event bus; nếu không (TASK_QUEUE_BACKEND=db,
+                # nhiều worker uvicorn) phải đọc DB thường xuyên vì frontend không còn polling
+                local = task_id in ram_task_manager.active_tasks
+                timeout = settings.TASK_STREAM_HEARTBEAT_SECONDS if local else settings.TASK_STREAM_DB_POLL_SECONDS
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    # Đối chiếu DB, chỉ gửi khi trạng thái thay đổi
+                    latest = await tasks_manager.get_task(task_id)
+                    if latest and (latest['status'], latest['result']) != last_state:
+                        last_state = (latest['status'], latest['result'])
+                        payload = _task_payload(latest, request)
+                        yield _sse_event("status", payload)
+                        last_sent = loop.time()
+                        if payload["status"] in ("completed", "failed"):
+                            return
+                    elif loop.time() - last_sent >= settings.TASK_STREAM_HEARTBEAT_SECONDS:
+                        yield ": ping\n\n"
+                        last_sent = loop.time()
+                    continue
+
+                last_sent = loop.time()
+
+                if event["type"] == "image":
+                    yield _sse_event("image", {"url": fix_banner_url(event["url"], request), "index": event["index"]})
+                    continue
+
+                result = [fix_banner_url(u, request) for u in event.get("result") or []]
+                last_state = (event["status"], json.dumps(event["result"]) if event.get("result") else None)
+                yield _sse_event("status", {
+                    "id": task_id,
+                    "status": event["status"],
+                    "result": result,
+                    "error": event.get("error"),
+                    "created_at": task['created_at']
+                })
+                if event["status"] in ("completed", "failed"):
+                    return
+        finally:
+            task_event_bus.unsubscribe(task_id, queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.get("/history")
 async def get_user_history(
     request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, gt=0),
+    cursor: Optional[str] = None,
+    include_prompt: bool = False,
     current_user: dict = Depends(get_current_user),
-    banner_history: BannerHistoryManager = Depends(get_banner_history_manager)
+    banner_history: AsyncManager = Depends(get_banner_history_manager)
 ):
-    """Get all history for current user"""
-    history = banner_history.get_all(user_id=current_user['id'])
+    """
+    History of current user, newest first, paginated by cursor (keyset on created_at, id).
+    The next page cursor is returned in the X-Next-Cursor header; prompt_used only with include_prompt=true.
+    """
+    limit = clamp_limit(limit)
+    rows = await banner_history.list_page(
+        user_id=current_user['id'], limit=limit, after=decode_cursor(cursor), include_prompt=include_prompt
+    )
+    history = paginate(rows, limit, response)
     for item in history:
         item['image_url'] = fix_banner_url(item['image_url'], request)
+        add_image_variants(item)
         if item.get('reference_images'):
             try:
                 refs = json.loads(item['reference_images'])
@@ -655,15 +874,30 @@ async def get_user_history(
                 item['reference_images_list'] = []
     return history
 
+@router.get("/history/{banner_id}")
+async def get_history_item(
+    banner_id: int,
+    request: Request,
+    current_user: dict = Depends(get_current_user),
+    banner_history: AsyncManager = Depends(get_banner_history_manager)
+):
+    """Full detail (including prompt_used) of one banner of the current user"""
+    item = await banner_history.get_by_id(banner_id)
+    if not item or item['user_id'] != current_user['id']:
+        raise HTTPException(status_code=404, detail="Banner không tìm thấy hoặc không có quyền")
+    item['image_url'] = fix_banner_url(item['image_url'], request)
+    add_image_variants(item)
+    return item
+
 @router.delete("/history/{banner_id}")
 async def delete_history_item(
     banner_id: int,
     current_user: dict = Depends(get_current_user),
-    banner_history: BannerHistoryManager = Depends(get_banner_history_manager)
+    banner_history: AsyncManager = Depends(get_banner_history_manager)
 ):
     """Delete a specific history item"""
     # Verify ownership? Manager.delete checks user_id so it's safe if implemented correctly
-    count = banner_history.delete(banner_id, user_id=current_user['id'])
+    count = await banner_history.delete(banner_id, user_id=current_user['id'])
     if count == 0:
         raise HTTPException(status_code=404, detail="Item not found")
     return {"message": "Deleted successfully"}
@@ -671,8 +905,8 @@ async def delete_history_item(
 @router.delete("/history")
 async def delete_all_history(
     current_user: dict = Depends(get_current_user),
-    banner_history: BannerHistoryManager = Depends(get_banner_history_manager)
+    banner_history: AsyncManager = Depends(get_banner_history_manager)
 ):
     """Clear all history for current user"""
-    banner_history.delete_all(user_id=current_user['id'])
+    await banner_history.delete_all(user_id=current_user['id'])
     return {"message": "History cleared"}
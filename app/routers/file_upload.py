@@ -2,6 +2,7 @@ from fastapi import APIRouter
 from fastapi import FastAPI, File, UploadFile, Header, HTTPException, Request, Form  # noqa: E402, F401
 from fastapi.responses import FileResponse  # noqa: E402
 from app.config import settings
+from app.utils.http_cache import cached_file_response
 from mimetypes import guess_type
 import os
 
@@ -28,7 +29,7 @@ async def download_file(filename: str):
 
 
 @router.get("/view/{filename}")
-async def view_file(filename: str):
+async def view_file(request: Request, filename: str):
     """
     API để xem trước file (hình ảnh, video, audio, v.v.)
 
@@ -47,8 +48,8 @@ async def view_file(filename: str):
     media_type, _ = guess_type(file_path)
     media_type = media_type or "application/octet-stream"  # fallback nếu không đoán được
 
-    return FileResponse(
-        path=file_path, media_type=media_type, filename=filename, headers={"Content-Disposition": f"inline; filename={filename}"}
+    return cached_file_response(
+        request, file_path, media_type=media_type, filename=filename, content_disposition_type="inline"
     )
 @router.post("/upload")
 async def upload_file_handler(file: UploadFile = File(...)):
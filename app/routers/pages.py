@@ -4,6 +4,7 @@ from typing import List, Optional
 from datetime import datetime
 from app.models.banner_db import DBConnection
 from app.security.auth import get_admin_user
+from app.utils.async_db import AsyncManager
 
 router = APIRouter(prefix="/pages", tags=["Pages"])
 
@@ -52,18 +53,16 @@ class PageDB(DBConnection):
 
 
 # PUBLIC ROUTES
+# Mỗi lời gọi chạy trong executor DB (không chặn event loop)
+page_db = AsyncManager(PageDB)
+
 @router.get("", response_model=List[dict])
 async def get_public_pages():
-    db = PageDB()
-    pages = db.get_public()
-    db.close()
-    return pages
+    return await page_db.get_public()
 
 @router.get("/{slug}", response_model=dict)
 async def get_page(slug: str):
-    db = PageDB()
-    page = db.get_by_slug(slug)
-    db.close()
+    page = await page_db.get_by_slug(slug)
     if not page or not page['is_published']:
         raise HTTPException(status_code=404, detail="Page not found")
     return page
@@ -71,38 +70,25 @@ async def get_page(slug: str):
 # ADMIN ROUTES
 @router.get("/admin/all", response_model=List[dict])
 async def get_all_pages(admin=Depends(get_admin_user)):
-    db = PageDB()
-    pages = db.get_all()
-    db.close()
-    return pages
+    return await page_db.get_all()
 
 @router.post("/admin/create")
 async def create_page(page: PageCreate, admin=Depends(get_admin_user)):
-    db = PageDB()
-    try:
-        existing = db.get_by_slug(page.slug)
-        if existing:
-            raise HTTPException(status_code=400, detail="Slug already exists")
-        db.create(page.slug, page.title, page.content, page.is_published)
-    finally:
-        db.close()
+    existing = await page_db.get_by_slug(page.slug)
+    if existing:
+        raise HTTPException(status_code=400, detail="Slug already exists")
+    await page_db.create(page.slug, page.title, page.content, page.is_published)
     return {"message": "Page created"}
 
 @router.put("/admin/{slug}")
 async def update_page(slug: str, page: PageUpdate, admin=Depends(get_admin_user)):
-    db = PageDB()
-    try:
-        existing = db.get_by_slug(slug)
-        if not existing:
-            raise HTTPException(status_code=404, detail="Page not found")
-        db.update(slug, page.title, page.content, page.is_published)
-    finally:
-        db.close()
+    existing = await page_db.get_by_slug(slug)
+    if not existing:
+        raise HTTPException(status_code=404, detail="Page not found")
+    await page_db.update(slug, page.title, page.content, page.is_published)
     return {"message": "Page updated"}
 
 @router.delete("/admin/{slug}")
 async def delete_page(slug: str, admin=Depends(get_admin_user)):
-    db = PageDB()
-    db.delete(slug)
-    db.close()
+    await page_db.delete(slug)
     return {"message": "Page deleted"}
@@ -1,7 +1,11 @@
-from fastapi import APIRouter, HTTPException, Depends, Form
+from fastapi import APIRouter, HTTPException, Depends, Form, Query, Response
+from typing import Optional
 from app.models.banner_db import PaymentManager, UserManager
 from app.config import settings
 from app.security.jwt import get_current_user
+from app.utils.async_db import AsyncManager
+from app.utils.pagination import clamp_limit, decode_cursor, paginate
+import asyncio
 import hashlib
 import string
 import requests
@@ -24,32 +28,24 @@ def decode_payment_id(hex_str: str) -> int:
 router = APIRouter(prefix="/payment", tags=["payment"])
 
 def get_payment_manager():
-    manager = PaymentManager()
-    try:
-        yield manager
-    finally:
-        manager.close()
+    return AsyncManager(PaymentManager)
 
 def get_user_manager():
-    manager = UserManager()
-    try:
-        yield manager
-    finally:
-        manager.close()
+    return AsyncManager(UserManager)
 
 @router.get("/packages")
-async def get_packages(payment_manager: PaymentManager = Depends(get_payment_manager)):
-    return payment_manager.get_packages()
+async def get_packages(payment_manager: AsyncManager = Depends(get_payment_manager)):
+    return await payment_manager.get_packages()
 
 @router.post("/create")
 async def create_payment(
     package_id: int = Form(...),
     current_user: dict = Depends(get_current_user),
-    payment_manager: PaymentManager = Depends(get_payment_manager)
+    payment_manager: AsyncManager = Depends(get_payment_manager)
 ):
     user_id = current_user['id']
     
-    packages = payment_manager.get_packages()
+    packages = await payment_manager.get_packages()
     package = next((p for p in packages if p['id'] == package_id), None)
     
     if not package:
@@ -57,7 +53,7 @@ async def create_payment(
         
     # Tạo record payment trước để có ID
     # Lưu ý: payment_code ban đầu để tạm, sẽ update sau khi có ID
-    payment_id = payment_manager.create_payment(
+    payment_id = await payment_manager.create_payment(
         user_id, 
         package_id, 
         package['amount_vnd'], 
@@ -70,9 +66,7 @@ async def create_payment(
     payment_code = f"{settings.NAME_WEB}NAPTOKEN{hex_id}"
     
     # Update payment_code vào DB
-    sql = f"UPDATE payments SET payment_code = {payment_manager.p} WHERE id = {payment_manager.p}"
-    payment_manager.cursor.execute(sql, (payment_code, payment_id))
-    payment_manager.conn.commit()
+    await payment_manager.set_payment_code(payment_id, payment_code)
     
     return {
         "payment_id": payment_id,
@@ -87,26 +81,30 @@ async def create_payment(
 
 @router.get("/history")
 async def get_history(
+    response: Response,
+    limit: Optional[int] = Query(None, gt=0),
+    cursor: Optional[str] = None,
     current_user: dict = Depends(get_current_user),
-    payment_manager: PaymentManager = Depends(get_payment_manager)
+    payment_manager: AsyncManager = Depends(get_payment_manager)
 ):
-    return payment_manager.get_user_payments(current_user['id'])
+    """Payments of current user, newest first, paginated by cursor (next page cursor in X-Next-Cursor header)."""
+    limit = clamp_limit(limit)
+    rows = await payment_manager.list_page(user_id=current_user['id'], limit=limit, after=decode_cursor(cursor))
+    return paginate(rows, limit, response)
 
 @router.post("/check-status/{payment_id}")
 async def check_payment_status(
     payment_id: int,
     current_user: dict = Depends(get_current_user),
-    payment_manager: PaymentManager = Depends(get_payment_manager),
-    user_manager: UserManager = Depends(get_user_manager)
+    payment_manager: AsyncManager = Depends(get_payment_manager),
+    user_manager: AsyncManager = Depends(get_user_manager)
 ):
     # Lấy thông tin thanh toán từ DB check sở hữu
-    payment_manager.cursor.execute(f"SELECT * FROM payments WHERE id = {payment_manager.p}", (payment_id,))
-    payment_row = payment_manager.cursor.fetchone()
+    payment = await payment_manager.get_by_id(payment_id)
     
-    if not payment_row:
+    if not payment:
         raise HTTPException(status_code=404, detail="Payment not found")
         
-    payment = dict(payment_row)
     if payment['user_id'] != current_user['id']:
         raise HTTPException(status_code=403, detail="Not authorized")
 
@@ -124,7 +122,8 @@ async def check_payment_status(
         headers = {"Authorization": f"Bearer {settings.SEPAY_API_KEY}"}
         params = {"account_number": settings.SEPAY_ACCOUNT_NUMBER, "limit": 20}
         
-        response = requests.get(url, headers=headers, params=params)
+        # requests là HTTP đồng bộ: chạy ngoài event loop
+        response = await asyncio.to_thread(requests.get, url, headers=headers, params=params)
         if response.status_code == 200:
             transactions = response.json().get('transactions', [])
             
@@ -154,9 +153,9 @@ async def check_payment_status(
                         break
             
             if found:
-                # Update status completed
-                payment_manager.update_payment(payment_id, 'completed', matched_tx_id)
-                user_manager.update_token(payment['user_id'], payment['tokens_received'])
+                # Update status completed; chỉ request chuyển được trạng thái mới cộng token
+                if await payment_manager.update_payment(payment_id, 'completed', matched_tx_id):
+                    await user_manager.update_token(payment['user_id'], payment['tokens_received'])
                 return {"status": "completed", "message": "Payment success"}
             else:
                  return {"status": payment['status'], "message": "Transaction not found yet"}
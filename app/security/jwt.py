@@ -1,12 +1,18 @@
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Query, status
 from fastapi.security import OAuth2PasswordBearer
 from app.config import settings
 from app.models.banner_db import UserManager
+from app.utils.async_db import AsyncManager
+from app.utils.user_cache import get_cached_user, set_cached_user
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/google")
+# Không bắt buộc header: EventSource của trình duyệt không gửi được Authorization
+oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="auth/google", auto_error=False)
+# Mục đích của token ngắn hạn dùng trên URL EventSource (chỉ mở được stream của một task)
+STREAM_TOKEN_PURPOSE = "task_stream"
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -19,38 +25,67 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, settings.JWT_SECRET_KEY, algorithm=settings.JWT_ALGORITHM)
     return encoded_jwt
 
-def verify_token(token: str, credentials_exception):
+def create_stream_token(user_id, task_id: str):
+    """Token ngắn hạn chỉ dùng để mở stream SSE của một task (đặt trên URL của EventSource)."""
+    return create_access_token(
+        data={"sub": str(user_id), "purpose": STREAM_TOKEN_PURPOSE, "task_id": task_id},
+        expires_delta=timedelta(seconds=settings.TASK_STREAM_TOKEN_TTL)
+    )
+
+def verify_token(token: str, credentials_exception, purpose: Optional[str] = None, task_id: Optional[str] = None):
+    """
+    Trả user_id của token. Token đăng nhập không có "purpose"; token có purpose khác
+    (reset mật khẩu, stream task) bị từ chối nếu không được yêu cầu đúng mục đích.
+    """
     try:
         payload = jwt.decode(token, settings.JWT_SECRET_KEY, algorithms=[settings.JWT_ALGORITHM])
         user_id: str = payload.get("sub")
-        if user_id is None:
+        if user_id is None or payload.get("purpose") != purpose:
+            raise credentials_exception
+        if task_id is not None and payload.get("task_id") != task_id:
             raise credentials_exception
         return user_id
     except JWTError:
         raise credentials_exception
 
 async def get_current_user(token: str = Depends(oauth2_scheme)):
+    return await resolve_user(token)
+
+async def get_current_user_stream(
+    task_id: str,
+    header_token: Optional[str] = Depends(oauth2_scheme_optional),
+    token: Optional[str] = Query(None)
+):
+    """
+    Xác thực cho endpoint stream (SSE) /tasks/{task_id}/events: token đăng nhập qua header,
+    hoặc ?token=... là stream token của đúng task đó (token đăng nhập trên URL bị từ chối
+    để không lọt vào log truy cập/proxy và lịch sử trình duyệt).
+    """
+    if header_token:
+        return await resolve_user(header_token)
+    return await resolve_user(token, purpose=STREAM_TOKEN_PURPOSE, task_id=task_id)
+
+async def resolve_user(token: Optional[str], purpose: Optional[str] = None, task_id: Optional[str] = None):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    user_id = verify_token(token, credentials_exception)
+    if not token:
+        raise credentials_exception
+    user_id = verify_token(token, credentials_exception, purpose=purpose, task_id=task_id)
     
-    # Kết nối DB để lấy thông tin user mới nhất
-    user_manager = UserManager()
-    try:
-        user = user_manager.get_by_id(user_id)
+    # Lấy user từ cache; chỉ khi miss (hoặc đã bị invalidate) mới truy vấn DB trong executor
+    user = get_cached_user(user_id)
+    if user is None:
+        user = await AsyncManager(UserManager).get_by_id(user_id)
         if user is None:
             raise credentials_exception
+        set_cached_user(user)
+        
+    # Tự động cấp quyền Admin nếu email nằm trong danh sách ADMIN_EMAILS
+    if settings.ADMIN_EMAIL_SET and (user.get('email') or '').lower() in settings.ADMIN_EMAIL_SET:
+        user['is_admin'] = 1
             
-        # Tự động cấp quyền Admin nếu email nằm trong danh sách ADMIN_EMAILS
-        if settings.ADMIN_EMAILS:
-            admin_list = [e.strip().lower() for e in settings.ADMIN_EMAILS.split(",")]
-            if user['email'].lower() in admin_list:
-                user['is_admin'] = 1
-                
-        return user
-    finally:
-        user_manager.close()
+    return user
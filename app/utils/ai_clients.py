@@ -0,0 +1,73 @@
+import threading
+from collections import OrderedDict
+from google import genai
+from app.config import settings
+from chatbot.chatbot.utils.llm import LLM
+from chatbot.chatbot.utils.prompt_analyzer import PromptAnalyzer
+from chatbot.chatbot.utils.prompt_generator import PromptGenerator
+
+# Registry dùng chung trong process cho genai.Client và các chain LangChain đã dựng sẵn.
+# Khóa gồm provider, model và API key: đổi key/model sẽ tự dựng object mới,
+# object cũ bị đẩy ra theo LRU (hoặc xóa ngay bằng reset_ai_clients khi admin đổi cấu hình).
+_MAX_ENTRIES = 16
+_registry: "OrderedDict[tuple, object]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def _get_or_create(key: tuple, factory):
+    with _lock:
+        if key in _registry:
+            _registry.move_to_end(key)
+            return _registry[key]
+    # Dựng ngoài lock (có thể tốn thời gian); nếu thread khác đã dựng trước thì dùng bản đó
+    value = factory()
+    with _lock:
+        if key in _registry:
+            _registry.move_to_end(key)
+            return _registry[key]
+        _registry[key] = value
+        while len(_registry) > _MAX_ENTRIES:
+            _registry.popitem(last=False)
+        return value
+
+
+def _llm_identity(provider: str) -> tuple:
+    """(provider, model, api_key) mà LLM().get_llm(provider) sẽ dùng."""
+    if provider == "gemini":
+        return provider, settings.GOOGLE_LLM, settings.KEY_API_GOOGLE
+    if provider == "xai":
+        return provider, getattr(settings, "OPENROUTER_XAI_LLM", None), getattr(settings, "OPENROUTER_XAI_API_KEY", None)
+    return "openai", settings.OPENAI_LLM, settings.KEY_API_GPT
+
+
+def get_llm_model(provider: str = None) -> tuple:
+    """(provider, model) của LLM sẽ được dùng, không gồm API key (dùng làm khóa cache kết quả)."""
+    return _llm_identity(provider or settings.LLM_PROVIDER)[:2]
+
+
+def get_genai_client(api_key: str = None) -> genai.Client:
+    """genai.Client dùng lại theo API key (giữ HTTP connection giữa các lần sinh ảnh)."""
+    api_key = api_key or settings.KEY_API_GOOGLE
+    return _get_or_create(("genai", api_key), lambda: genai.Client(api_key=api_key))
+
+
+def get_llm(provider: str = None):
+    identity = _llm_identity(provider or settings.LLM_PROVIDER)
+    return _get_or_create(("llm",) + identity, lambda: LLM().get_llm(identity[0]))
+
+
+def get_prompt_analyzer_chain(provider: str = None):
+    identity = _llm_identity(provider or settings.LLM_PROVIDER)
+    return _get_or_create(("analyzer",) + identity, lambda: PromptAnalyzer(get_llm(identity[0])).get_chain())
+
+
+def get_prompt_generator_chain(provider: str = None):
+    identity = _llm_identity(provider or settings.LLM_PROVIDER)
+    return _get_or_create(("generator",) + identity, lambda: PromptGenerator(get_llm(identity[0])).get_chain())
+
+
+def reset_ai_clients():
+    """Bỏ toàn bộ client/chain đã cache; lần gọi sau sẽ dựng lại với cấu hình mới."""
+    with _lock:
+        _registry.clear()
+    print("[OK] AI client registry reset")
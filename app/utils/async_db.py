@@ -0,0 +1,56 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from app.config import settings
+
+# Executor riêng cho truy vấn DB để I/O database không chặn event loop
+# và không tranh thread với asyncio.to_thread (sinh ảnh, upload...).
+_db_executor = ThreadPoolExecutor(max_workers=settings.DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+
+
+async def run_db(func, *args, **kwargs):
+    """Chạy một hàm truy vấn đồng bộ trong executor DB và await kết quả."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, functools.partial(func, *args, **kwargs))
+
+
+def submit_db(func, *args, **kwargs):
+    """Đưa một hàm đồng bộ vào executor DB mà không chờ kết quả (gọi được từ mọi thread)."""
+    return _db_executor.submit(func, *args, **kwargs)
+
+
+class AsyncManager:
+    """
+    Bản async của một manager trong banner_db, giữ nguyên tên và tham số các method:
+
+        banner_history = AsyncManager(BannerHistoryManager)
+        history = await banner_history.list_page(user_id=1)
+
+    Mỗi lời gọi mượn connection, chạy method và trả connection về pool
+    trong cùng một thread của executor DB.
+    """
+
+    def __init__(self, manager_cls):
+        self._manager_cls = manager_cls
+
+    def __getattr__(self, name):
+        attr = getattr(self._manager_cls, name, None)
+        if name.startswith("_") or not callable(attr):
+            raise AttributeError(f"{self._manager_cls.__name__} has no method '{name}'")
+
+        async def call(*args, **kwargs):
+            return await run_db(self._call_sync, name, args, kwargs)
+
+        call.__name__ = name
+        return call
+
+    def _call_sync(self, name, args, kwargs):
+        manager = self._manager_cls()
+        try:
+            return getattr(manager, name)(*args, **kwargs)
+        finally:
+            manager.close()
+
+    def close(self):
+        # Không giữ connection nào giữa các lời gọi
+        pass
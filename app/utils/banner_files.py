@@ -0,0 +1,67 @@
+import os
+import threading
+from typing import Dict, Optional
+
+# Các đuôi ảnh banner có thể có (PNG mặc định, WebP/JPEG/AVIF theo BANNER_OUTPUT_FORMAT)
+IMAGE_EXTENSIONS = (".png", ".webp", ".jpg", ".jpeg", ".avif")
+
+
+class BannerFileIndex:
+    """
+    Bảng tra file id (tên file không đuôi) -> tên file trong thư mục banners.
+
+    Dựng một lần lúc startup bằng os.scandir, cập nhật khi banner mới được ghi,
+    nên /generate/view tra cứu O(1) và không phải liệt kê thư mục khi miss.
+    """
+
+    def __init__(self):
+        self.base_dir: Optional[str] = None
+        self.files: Dict[str, str] = {}
+        self.lock = threading.Lock()
+
+    def build(self, base_dir: str) -> int:
+        files = {}
+        if os.path.isdir(base_dir):
+            with os.scandir(base_dir) as entries:
+                for entry in entries:
+                    stem, ext = os.path.splitext(entry.name)
+                    if ext.lower() in IMAGE_EXTENSIONS and entry.is_file():
+                        files[stem] = entry.name
+        with self.lock:
+            self.base_dir = base_dir
+            self.files = files
+        print(f"[OK] Banner file index: {len(files)} files")
+        return len(files)
+
+    def add(self, filename: str):
+        stem, ext = os.path.splitext(os.path.basename(filename))
+        if ext.lower() in IMAGE_EXTENSIONS:
+            with self.lock:
+                self.files[stem] = os.path.basename(filename)
+
+    def remove(self, filename: str):
+        stem = os.path.splitext(os.path.basename(filename))[0]
+        with self.lock:
+            self.files.pop(stem, None)
+
+    def lookup(self, base_dir: str, file_id: str) -> Optional[str]:
+        """Đường dẫn file theo id (có hoặc không có đuôi). Trả về None nếu không có."""
+        stem = os.path.splitext(file_id)[0] if file_id.lower().endswith(IMAGE_EXTENSIONS) else file_id
+        filename = self.files.get(stem)
+        if filename:
+            path = os.path.join(base_dir, filename)
+            if os.path.exists(path):
+                return path
+            self.remove(filename)
+
+        # Chưa có trong index (vd. file do process khác ghi): chỉ thử vài đuôi đã biết, không liệt kê thư mục
+        for ext in IMAGE_EXTENSIONS:
+            path = os.path.join(base_dir, f"{stem}{ext}")
+            if os.path.exists(path):
+                self.add(path)
+                return path
+        return None
+
+
+# Singleton instance
+banner_file_index = BannerFileIndex()
@@ -2,6 +2,7 @@ import cloudinary
 import cloudinary.uploader
 from app.config import settings
 import os
+from io import BytesIO
 
 # Cấu hình Cloudinary
 cloudinary.config(
@@ -11,22 +12,26 @@ cloudinary.config(
     secure=True
 )
 
-def upload_to_cloudinary(file_path: str, folder: str = "banners") -> str:
+def is_cloudinary_configured() -> bool:
+    return bool(settings.CLOUDINARY_API_KEY and settings.CLOUDINARY_API_SECRET)
+
+def upload_to_cloudinary(file_path: str, folder: str = "banners", data: bytes = None) -> str:
     """
     Tải ảnh lên Cloudinary và trả về URL ổn định.
+    Nếu có data (bytes ảnh đã mã hóa) thì upload thẳng từ bộ nhớ, không đọc lại file.
     """
     if not settings.CLOUDINARY_API_KEY or not settings.CLOUDINARY_API_SECRET:
         print("Cloudinary Error: API Key or Secret not found in settings")
         return None
         
     try:
-        if not os.path.exists(file_path):
+        if data is None and not os.path.exists(file_path):
             print(f"Cloudinary Error: File not found at {file_path}")
             return None
             
         print(f"Uploading {file_path} to Cloudinary folder '{folder}'...")
         response = cloudinary.uploader.upload(
-            file_path, 
+            BytesIO(data) if data is not None else file_path, 
             folder=folder,
             resource_type="image"
         )
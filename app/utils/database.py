@@ -1,50 +1,386 @@
 import sqlite3
 import mysql.connector
+from mysql.connector.constants import ClientFlag
 import os
 import json
+import threading
+import time
+from collections import deque
+from typing import Optional
 from app.config import settings
 from datetime import datetime
 
+class PooledConnection:
+    """
+    Connection mượn từ pool. Mọi thuộc tính được chuyển tiếp tới connection thật;
+    close() trả connection về pool thay vì đóng kết nối.
+    """
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._pool.release(self._raw)
+
+
+class MySQLConnectionPool:
+    """
+    Pool connection MySQL/TiDB (LIFO) để tránh bắt tay TCP + SSL cho mỗi manager.
+    Khi pool cạn vẫn mở thêm connection (overflow) và đóng chúng khi trả về.
+    """
+
+    def __init__(self, config: dict, size: int, pre_ping: bool = True, ping_interval: float = 30):
+        self.config = config
+        self.size = max(1, size)
+        self.pre_ping = pre_ping
+        self.ping_interval = ping_interval
+        self._idle = deque()  # (connection, thời điểm trả về pool)
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._stats = {"created": 0, "checkouts": 0, "reused": 0, "overflow": 0, "ping_failures": 0}
+
+    def acquire(self) -> PooledConnection:
+        raw = None
+        while raw is None:
+            with self._lock:
+                idle = self._idle.pop() if self._idle else None
+            if idle is None:
+                break
+            conn, last_used = idle
+            if self.pre_ping and time.monotonic() - last_used >= self.ping_interval:
+                try:
+                    conn.ping(reconnect=False)
+                except Exception:
+                    self._stats["ping_failures"] += 1
+                    self._close_quietly(conn)
+                    continue
+            raw = conn
+            self._stats["reused"] += 1
+
+        if raw is None:
+            raw = mysql.connector.connect(**self.config)
+            self._stats["created"] += 1
+
+        with self._lock:
+            self._in_use += 1
+            if self._in_use > self.size:
+                self._stats["overflow"] += 1
+            self._stats["checkouts"] += 1
+        return PooledConnection(self, raw)
+
+    def release(self, raw):
+        try:
+            # Dọn trạng thái để người mượn kế tiếp nhận connection sạch
+            if getattr(raw, "unread_result", False):
+                raw.consume_results()
+            if getattr(raw, "in_transaction", False):
+                raw.rollback()
+        except Exception:
+            self._close_quietly(raw)
+            raw = None
+
+        with self._lock:
+            self._in_use -= 1
+            if raw is not None and len(self._idle) < self.size:
+                self._idle.append((raw, time.monotonic()))
+                return
+        if raw is not None:
+            self._close_quietly(raw)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": self.size,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                **self._stats
+            }
+
+
+class ThreadLocalSQLiteConnection:
+    """
+    Connection SQLite dùng chung trong một thread. close() không đóng kết nối để các manager
+    trong cùng thread tái sử dụng, nhưng rollback phần ghi chưa commit (giống MySQLConnectionPool.release):
+    nếu không, lệnh ghi lỗi giữ transaction mở và khóa ghi của cả file DB.
+    Manager phải được tạo và dùng trong cùng một thread (AsyncManager / run_db đảm bảo điều này).
+    """
+
+    def __init__(self, raw):
+        self._raw = raw
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def close(self):
+        try:
+            if self._raw.in_transaction:
+                self._raw.rollback()
+        except sqlite3.Error as e:
+            print(f"[WARN] SQLite rollback on release failed: {e}")
+            # Bỏ connection hỏng, lần mượn sau mở connection mới
+            if getattr(_sqlite_local, "conn", None) is self._raw:
+                _sqlite_local.conn = None
+
+
+_mysql_pool: Optional[MySQLConnectionPool] = None
+_mysql_pool_lock = threading.Lock()
+_sqlite_local = threading.local()
+_sqlite_stats = {"created": 0, "checkouts": 0}
+
+
+def _get_mysql_config() -> dict:
+    config = {
+        'host': settings.DB_HOST,
+        'port': settings.DB_PORT,
+        'user': settings.DB_USER,
+        'password': settings.DB_PASSWORD,
+        'database': settings.DB_DATABASE,
+        'autocommit': True,
+        'charset': 'utf8mb4',
+        'collation': 'utf8mb4_bin',
+        'connect_timeout': 10, # Giới hạn 10 giây để tránh Render bị timeout
+        # rowcount = số row khớp WHERE (như SQLite), không phải số row đổi giá trị:
+        # các UPDATE có điều kiện (lease, trạng thái) dựa vào rowcount để biết mình có thắng hay không
+        'client_flags': [ClientFlag.FOUND_ROWS]
+    }
+    
+    # TiDB Cloud requires TLS (SSL)
+    if hasattr(settings, "DB_SSL") and settings.DB_SSL:
+        ssl_val = settings.DB_SSL
+        if isinstance(ssl_val, str) and ssl_val.startswith('{'):
+            try:
+                ssl_dict = json.loads(ssl_val)
+                if 'ca' in ssl_dict:
+                    config['ssl_ca'] = ssl_dict['ca']
+            except:
+                pass
+        elif isinstance(ssl_val, str) and ssl_val:
+            # If it's a raw string, use as CA path
+            config['ssl_ca'] = ssl_val
+        
+        # Ensure SSL is NOT disabled
+        config['ssl_disabled'] = False
+    return config
+
+
+def _get_mysql_pool() -> MySQLConnectionPool:
+    global _mysql_pool
+    if _mysql_pool is None:
+        with _mysql_pool_lock:
+            if _mysql_pool is None:
+                _mysql_pool = MySQLConnectionPool(
+                    _get_mysql_config(),
+                    size=settings.DB_POOL_SIZE,
+                    pre_ping=settings.DB_POOL_PRE_PING,
+                    ping_interval=settings.DB_POOL_PING_INTERVAL
+                )
+    return _mysql_pool
+
+
+def _get_sqlite_connection() -> ThreadLocalSQLiteConnection:
+    conn = getattr(_sqlite_local, "conn", None)
+    if conn is not None and settings.DB_POOL_PRE_PING:
+        try:
+            conn.execute("SELECT 1")
+        except sqlite3.Error:
+            conn = None
+    if conn is None:
+        conn = sqlite3.connect(settings.DB_PATH, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        _sqlite_local.conn = conn
+        _sqlite_stats["created"] += 1
+    _sqlite_stats["checkouts"] += 1
+    return ThreadLocalSQLiteConnection(conn)
+
+
 def get_db_connection():
     db_type = getattr(settings, "DB_TYPE", "sqlite").lower()
     
     if db_type == "mysql":
-        config = {
-            'host': settings.DB_HOST,
-            'port': settings.DB_PORT,
-            'user': settings.DB_USER,
-            'password': settings.DB_PASSWORD,
-            'database': settings.DB_DATABASE,
-            'autocommit': True,
-            'charset': 'utf8mb4',
-            'collation': 'utf8mb4_bin',
-            'connect_timeout': 10 # Giới hạn 10 giây để tránh Render bị timeout
-        }
-        
-        # TiDB Cloud requires TLS (SSL)
-        if hasattr(settings, "DB_SSL") and settings.DB_SSL:
-            ssl_val = settings.DB_SSL
-            if isinstance(ssl_val, str) and ssl_val.startswith('{'):
-                try:
-                    ssl_dict = json.loads(ssl_val)
-                    if 'ca' in ssl_dict:
-                        config['ssl_ca'] = ssl_dict['ca']
-                except:
-                    pass
-            elif isinstance(ssl_val, str) and ssl_val:
-                # If it's a raw string, use as CA path
-                config['ssl_ca'] = ssl_val
-            
-            # Ensure SSL is NOT disabled
-            config['ssl_disabled'] = False
-            
-        conn = mysql.connector.connect(**config)
-        return conn
+        return _get_mysql_pool().acquire()
     else:
-        # Default to SQLite
-        conn = sqlite3.connect(settings.DB_PATH, check_same_thread=False)
-        conn.row_factory = sqlite3.Row
-        return conn
+        # Default to SQLite (mỗi thread giữ một connection)
+        return _get_sqlite_connection()
+
+
+def get_pool_stats() -> dict:
+    """Thống kê pool connection của process hiện tại."""
+    db_type = getattr(settings, "DB_TYPE", "sqlite").lower()
+    if db_type == "mysql":
+        return {"db_type": db_type, **_get_mysql_pool().stats()}
+    return {"db_type": db_type, "thread_connections": _sqlite_stats["created"], "checkouts": _sqlite_stats["checkouts"]}
+
+# Index phụ cho các truy vấn nóng: tên index -> (bảng, cột)
+INDEXES = {
+    "idx_banner_history_user_created": ("banner_history", ("user_id", "created_at", "id")),  # Lịch sử của user (keyset)
+    "idx_banner_history_created": ("banner_history", ("created_at", "id")),  # Danh sách banner admin (keyset)
+    "idx_banner_history_public": ("banner_history", ("is_public", "is_hidden", "created_at")),  # Gallery trang chủ
+    "idx_tasks_status": ("tasks", ("status", "created_at")),  # Reset task lúc startup, claim task
+    "idx_payments_status_created": ("payments", ("status", "created_at")),  # Thống kê admin
+    "idx_payments_user_created": ("payments", ("user_id", "created_at", "id")),  # Lịch sử thanh toán của user (keyset)
+    "idx_login_sessions_created": ("login_sessions", ("created_at",)),  # Dọn session hết hạn
+    "idx_users_is_admin": ("users", ("is_admin",)),  # Đếm admin cho thống kê
+    "idx_prompt_cache_expires": ("prompt_cache", ("expires_at",)),  # Dọn prompt cache hết hạn
+}
+
+# Truy vấn mẫu (cùng dạng với truy vấn thật) dùng để kiểm tra bằng EXPLAIN rằng index được dùng
+INDEX_CHECK_QUERIES = [
+    ("idx_banner_history_user_created",
+     "SELECT id FROM banner_history WHERE user_id = {p} ORDER BY created_at DESC, id DESC LIMIT 50", (1,)),
+    ("idx_banner_history_public",
+     "SELECT id FROM banner_history WHERE is_public = 1 AND is_hidden = 0 ORDER BY created_at DESC LIMIT 20", ()),
+    ("idx_tasks_status",
+     "SELECT id FROM tasks WHERE status = {p}", ("processing",)),
+    ("idx_payments_user_created",
+     "SELECT id FROM payments WHERE user_id = {p} ORDER BY created_at DESC, id DESC LIMIT 50", (1,)),
+    ("idx_payments_status_created",
+     "SELECT SUM(amount_vnd) FROM payments WHERE status = 'completed' AND created_at >= {p}", ("2000-01-01",)),
+    ("idx_login_sessions_created",
+     "SELECT session_id FROM login_sessions WHERE created_at < {p}", ("2000-01-01",)),
+]
+
+# Ngày thống kê của một row (row thiếu created_at được gom vào 1970-01-01)
+STAT_DATE_SQL = "COALESCE(DATE(created_at), '1970-01-01')"
+
+def rebuild_daily_stats(conn, cursor, db_type):
+    """
+    Tính lại toàn bộ bảng rollup daily_stats từ banner_history, payments (completed) và users.
+    Dùng để backfill khi tạo bảng và để đối soát nếu số liệu cộng dồn bị lệch.
+    """
+    if db_type == "mysql":
+        conn.start_transaction()
+    try:
+        cursor.execute("DELETE FROM daily_stats")
+        cursor.execute(f"""
+            INSERT INTO daily_stats (stat_date, banners, revenue_vnd, tokens_sold, new_users)
+            SELECT d, SUM(b), SUM(r), SUM(t), SUM(u) FROM (
+                SELECT {STAT_DATE_SQL} AS d, COUNT(*) AS b, 0 AS r, 0 AS t, 0 AS u
+                FROM banner_history GROUP BY {STAT_DATE_SQL}
+                UNION ALL
+                SELECT {STAT_DATE_SQL} AS d, 0 AS b, COALESCE(SUM(amount_vnd), 0) AS r, COALESCE(SUM(tokens_received), 0) AS t, 0 AS u
+                FROM payments WHERE status = 'completed' GROUP BY {STAT_DATE_SQL}
+                UNION ALL
+                SELECT {STAT_DATE_SQL} AS d, 0 AS b, 0 AS r, 0 AS t, COUNT(*) AS u
+                FROM users GROUP BY {STAT_DATE_SQL}
+            ) src
+            GROUP BY d
+        """)
+        rows = cursor.rowcount
+        conn.commit()
+        return rows
+    except Exception:
+        conn.rollback()
+        raise
+
+def reconcile_user_stats(conn, cursor, db_type):
+    """
+    Đối soát bảng counter user_stats với banner_history và sửa các user bị lệch.
+    Mỗi user lệch được tính lại bằng một câu upsert từ chính banner_history (không ghi đè
+    bằng số đã đọc trước đó), nên không làm mất các lượt cộng dồn chạy song song.
+    Trả về số user đã sửa.
+    """
+    cursor.execute("SELECT user_id, COUNT(*) as cnt, COALESCE(SUM(token_cost), 0) as spent FROM banner_history GROUP BY user_id")
+    expected = {row['user_id']: (row['cnt'], float(row['spent'])) for row in cursor.fetchall()}
+    cursor.execute("SELECT user_id, banner_count, total_spent FROM user_stats")
+    actual = {row['user_id']: (row['banner_count'], float(row['total_spent'])) for row in cursor.fetchall()}
+
+    drifted = []
+    for user_id in set(expected) | set(actual):
+        want = expected.get(user_id, (0, 0.0))
+        have = actual.get(user_id, (0, 0.0))
+        if user_id is not None and (want[0] != have[0] or abs(want[1] - have[1]) > 1e-6):
+            drifted.append(user_id)
+    if not drifted:
+        return 0
+
+    p = "%s" if db_type == "mysql" else "?"
+    if db_type == "mysql":
+        upsert = "ON DUPLICATE KEY UPDATE banner_count = VALUES(banner_count), total_spent = VALUES(total_spent)"
+    else:
+        upsert = "ON CONFLICT(user_id) DO UPDATE SET banner_count = excluded.banner_count, total_spent = excluded.total_spent"
+    try:
+        for user_id in drifted:
+            cursor.execute(f"""
+                INSERT INTO user_stats (user_id, banner_count, total_spent)
+                SELECT {p}, COUNT(*), COALESCE(SUM(token_cost), 0) FROM banner_history WHERE user_id = {p}
+                {upsert}
+            """, (user_id, user_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(drifted)
+
+def _index_exists(cursor, db_type, table, index_name):
+    if db_type == "mysql":
+        cursor.execute(
+            "SELECT COUNT(*) as cnt FROM information_schema.STATISTICS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s",
+            (table, index_name)
+        )
+        row = cursor.fetchone()
+        return (row['cnt'] if isinstance(row, dict) else row[0]) > 0
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name = ?", (index_name,))
+    return cursor.fetchone() is not None
+
+def ensure_indexes(conn, cursor, db_type):
+    """Tạo các index trong INDEXES nếu chưa có. Trả về danh sách index không tạo được."""
+    failed = []
+    for index_name, (table, columns) in INDEXES.items():
+        try:
+            if _index_exists(cursor, db_type, table, index_name):
+                continue
+            cursor.execute(f"CREATE INDEX {index_name} ON {table} ({', '.join(columns)})")
+            if db_type != "mysql": conn.commit()
+            print(f"[OK] Migration: Đã tạo index '{index_name}' trên {table}({', '.join(columns)})")
+        except Exception as e:
+            failed.append(index_name)
+            print(f"[WARN] Migration: Không tạo được index '{index_name}': {e}")
+    return failed
+
+def explain_query(cursor, db_type, sql, params=()):
+    """Trả về plan của truy vấn dưới dạng list chuỗi (EXPLAIN QUERY PLAN cho SQLite, EXPLAIN cho MySQL/TiDB)."""
+    prefix = "EXPLAIN" if db_type == "mysql" else "EXPLAIN QUERY PLAN"
+    cursor.execute(f"{prefix} {sql}", params)
+    plan = []
+    for row in cursor.fetchall():
+        values = row.values() if isinstance(row, dict) else tuple(row)
+        plan.append(" | ".join(str(v) for v in values if v is not None))
+    return plan
+
+def verify_index_usage(cursor, db_type):
+    """
+    Chạy EXPLAIN cho các truy vấn nóng và kiểm tra chúng dùng đúng index.
+    Trả về {tên index: True/False}. Với bảng rất nhỏ, MySQL có thể chủ động chọn full scan.
+    """
+    p = "%s" if db_type == "mysql" else "?"
+    results = {}
+    for index_name, sql, params in INDEX_CHECK_QUERIES:
+        try:
+            plan = explain_query(cursor, db_type, sql.format(p=p), params)
+            used = any(index_name in line for line in plan)
+        except Exception as e:
+            plan, used = [f"EXPLAIN failed: {e}"], False
+        results[index_name] = used
+        if used:
+            print(f"[OK] Index check: {index_name} được dùng")
+        else:
+            print(f"[WARN] Index check: {index_name} KHÔNG được dùng — plan: {' / '.join(plan)}")
+    return results
 
 def init_db():
     """Khởi tạo cấu trúc database ban đầu."""
@@ -148,6 +484,9 @@ def init_db():
             result {text_type},
             request_data {text_type},
             error_message {text_type},
+            lease_owner VARCHAR(255),
+            lease_expires_at DATETIME,
+            attempts INTEGER DEFAULT 0,
             created_at DATETIME DEFAULT {ts_default},
             updated_at DATETIME DEFAULT {ts_default}
         )
@@ -165,6 +504,17 @@ def init_db():
         )
         ''')
 
+        # Bảng Prompt Cache (kết quả phân tích/sinh prompt của LLM, theo fingerprint request)
+        cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS prompt_cache (
+            cache_key VARCHAR(64) PRIMARY KEY,
+            kind VARCHAR(32) NOT NULL,
+            `value` {text_type} NOT NULL,
+            created_at DATETIME DEFAULT {ts_default},
+            expires_at DATETIME NOT NULL
+        )
+        ''')
+
         # Bảng Login Sessions (Hybrid App Cloud-Sync)
         cursor.execute(f'''
         CREATE TABLE IF NOT EXISTS login_sessions (
@@ -202,6 +552,7 @@ def check_and_migrate_db():
         db_type = getattr(settings, "DB_TYPE", "sqlite").lower()
         text_type = "LONGTEXT" if db_type == "mysql" else "TEXT"
         bool_type = "BOOLEAN" if db_type == "mysql" else "BOOLEAN"
+        ts_default = "CURRENT_TIMESTAMP"
         
         conn = get_db_connection()
         cursor = conn.cursor(dictionary=True) if db_type == "mysql" else conn.cursor()
@@ -291,6 +642,27 @@ def check_and_migrate_db():
                 print(f"[OK] Migration: Đã thêm cột '{col_name}' vào users")
                 if db_type != "mysql": conn.commit()
 
+        # Migration cho hàng đợi task bền vững (lease/heartbeat): lease_owner, lease_expires_at, attempts
+        task_cols = {
+            "lease_owner": "VARCHAR(255)",
+            "lease_expires_at": "DATETIME",
+            "attempts": "INTEGER DEFAULT 0"
+        }
+
+        for col_name, col_def in task_cols.items():
+            if db_type == "mysql":
+                cursor.execute(f"SELECT COUNT(*) as cnt FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'tasks' AND COLUMN_NAME = '{col_name}'")
+                row = cursor.fetchone()
+                exists = (row['cnt'] if isinstance(row, dict) else row[0]) > 0
+            else:
+                cursor.execute("PRAGMA table_info(tasks)")
+                exists = col_name in [r[1] for r in cursor.fetchall()]
+
+            if not exists:
+                cursor.execute(f"ALTER TABLE tasks ADD COLUMN {col_name} {col_def}")
+                print(f"[OK] Migration: Đã thêm cột '{col_name}' vào tasks")
+                if db_type != "mysql": conn.commit()
+
         # Migration: Thêm bảng login_sessions nếu chưa có
         if db_type == "mysql":
             cursor.execute("SHOW TABLES LIKE 'login_sessions'")
@@ -311,6 +683,57 @@ def check_and_migrate_db():
             if db_type != "mysql": conn.commit()
             print("[OK] Migration: Đã tạo bảng 'login_sessions'")
 
+        # Migration: Bảng rollup daily_stats cho thống kê admin (cộng dồn khi tạo banner/thanh toán/user)
+        # Chỉ tạo ở đây (không trong init_db) để DB cũ luôn được backfill khi bảng vừa được tạo
+        if db_type == "mysql":
+            cursor.execute("SHOW TABLES LIKE 'daily_stats'")
+            exists = cursor.fetchone() is not None
+        else:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='daily_stats'")
+            exists = cursor.fetchone() is not None
+
+        if not exists:
+            cursor.execute('''
+            CREATE TABLE daily_stats (
+                stat_date DATE PRIMARY KEY,
+                banners INTEGER NOT NULL DEFAULT 0,
+                revenue_vnd INTEGER NOT NULL DEFAULT 0,
+                tokens_sold REAL NOT NULL DEFAULT 0,
+                new_users INTEGER NOT NULL DEFAULT 0
+            )
+            ''')
+            if db_type != "mysql": conn.commit()
+            days = rebuild_daily_stats(conn, cursor, db_type)
+            print(f"[OK] Migration: Đã tạo bảng 'daily_stats' và backfill {days} ngày")
+
+        # Migration: Bảng counter user_stats (số banner, tổng token đã dùng) cho /generate/stats
+        if db_type == "mysql":
+            cursor.execute("SHOW TABLES LIKE 'user_stats'")
+            exists = cursor.fetchone() is not None
+        else:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='user_stats'")
+            exists = cursor.fetchone() is not None
+
+        if not exists:
+            cursor.execute(f'''
+            CREATE TABLE user_stats (
+                user_id {"INT" if db_type == "mysql" else "INTEGER"} PRIMARY KEY,
+                banner_count INTEGER NOT NULL DEFAULT 0,
+                total_spent REAL NOT NULL DEFAULT 0
+            )
+            ''')
+            if db_type != "mysql": conn.commit()
+            users = reconcile_user_stats(conn, cursor, db_type)
+            print(f"[OK] Migration: Đã tạo bảng 'user_stats' và backfill {users} user")
+
+        # Migration: is_hidden luôn là 0/1 để gallery lọc bằng "is_hidden = 0" và dùng được index
+        cursor.execute("UPDATE banner_history SET is_hidden = 0 WHERE is_hidden IS NULL")
+        if db_type != "mysql": conn.commit()
+
+        # Migration: Index phụ cho các truy vấn nóng, sau đó kiểm tra bằng EXPLAIN
+        ensure_indexes(conn, cursor, db_type)
+        verify_index_usage(cursor, db_type)
+
     except Exception as e:
         print(f"[WARN] Migration warning: {e}")
     finally:
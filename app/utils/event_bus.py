@@ -0,0 +1,46 @@
+import asyncio
+from typing import Dict, Set
+
+
+class TaskEventBus:
+    """
+    Event bus trong process cho tiến trình của task banner.
+
+    Worker publish các sự kiện (đổi trạng thái, ảnh mới) theo task_id;
+    mỗi kết nối SSE subscribe một queue riêng và nhận sự kiện ngay khi có.
+    Chỉ có hiệu lực trong cùng process, nên endpoint stream vẫn đối chiếu DB định kỳ.
+    """
+
+    def __init__(self, max_queue_size: int = 100):
+        self.max_queue_size = max_queue_size
+        self.subscribers: Dict[str, Set[asyncio.Queue]] = {}
+
+    def subscribe(self, task_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self.subscribers.setdefault(task_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, task_id: str, queue: asyncio.Queue):
+        queues = self.subscribers.get(task_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self.subscribers[task_id]
+
+    def publish(self, task_id: str, event: dict):
+        for queue in list(self.subscribers.get(task_id, ())):
+            if queue.full():
+                # Client đọc chậm: bỏ sự kiện cũ nhất, sự kiện trạng thái mới nhất luôn được giữ
+                try:
+                    queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    pass
+            queue.put_nowait(event)
+
+    def subscriber_count(self) -> int:
+        return sum(len(queues) for queues in self.subscribers.values())
+
+
+# Singleton instance
+task_event_bus = TaskEventBus()
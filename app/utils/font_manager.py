@@ -1,9 +1,20 @@
 import os
+import json
+import hashlib
+import threading
 import urllib.request
 import tempfile
+from functools import lru_cache
+from io import BytesIO
+from PIL import ImageFont
+from app.config import settings
+
+BUNDLED_FONTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "assets", "fonts")
+# Manifest font đi kèm repo: tên font -> file, URL tải và sha256
+MANIFEST_PATH = os.path.join(BUNDLED_FONTS_DIR, "manifest.json")
 
 try:
-    FONTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "assets", "fonts")
+    FONTS_DIR = BUNDLED_FONTS_DIR
     if not os.path.exists(FONTS_DIR):
         os.makedirs(FONTS_DIR)
 except OSError:
@@ -11,41 +22,140 @@ except OSError:
     if not os.path.exists(FONTS_DIR):
         os.makedirs(FONTS_DIR)
 
+def _load_manifest():
+    try:
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"[WARN] Không đọc được font manifest {MANIFEST_PATH}: {e}")
+        return {}
+
+FONT_MANIFEST = _load_manifest()
+
 # Danh sách một số font Google Font hỗ trợ tiếng Việt tốt
-GOOGLE_FONTS = {
-    "BeVietnamPro-Bold": "https://github.com/google/fonts/raw/main/ofl/bevietnampro/BeVietnamPro-Bold.ttf",
-    "BeVietnamPro-Regular": "https://github.com/google/fonts/raw/main/ofl/bevietnampro/BeVietnamPro-Regular.ttf",
-    "Montserrat-Bold": "https://github.com/google/fonts/raw/main/ofl/montserrat/Montserrat%5Bwght%5D.ttf", # Đây là variable font, lấy bản tĩnh nếu cần
-    "PlayfairDisplay-Bold": "https://github.com/google/fonts/raw/main/ofl/playfairdisplay/PlayfairDisplay%5Bwght%5D.ttf",
-    "DancingScript-Bold": "https://github.com/google/fonts/raw/main/ofl/dancingscript/DancingScript%5Bwght%5D.ttf",
-    "Pacifico-Regular": "https://github.com/google/fonts/raw/main/ofl/pacifico/Pacifico-Regular.ttf"
-}
-
-def download_fonts():
-    """Tải các font từ Google Fonts nếu chưa tồn tại."""
+GOOGLE_FONTS = {font_name: entry["url"] for font_name, entry in FONT_MANIFEST.items()}
+
+# Font hệ thống dùng khi không có font riêng
+DEFAULT_FONT_PATH = "C:\\Windows\\Fonts\\arialbd.ttf" if os.name == 'nt' else "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
+
+# Bảng tên font -> đường dẫn đã kiểm tra, dựng một lần lúc startup (get_font_path chỉ tra dict)
+_font_index = {}
+_index_lock = threading.Lock()
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _font_file(font_name):
+    entry = FONT_MANIFEST.get(font_name) or {}
+    # Ưu tiên bản đi kèm repo, sau đó tới thư mục font có thể ghi (vd. /tmp/fonts)
+    for folder in (BUNDLED_FONTS_DIR, FONTS_DIR):
+        path = os.path.join(folder, entry.get("file", f"{font_name}.ttf"))
+        if os.path.exists(path):
+            return path
+    return None
+
+def build_font_index():
+    """Kiểm tra checksum các font trong manifest và dựng bảng tra cứu. Trả về các font còn thiếu."""
+    index = {}
+    missing = []
+    for font_name, entry in FONT_MANIFEST.items():
+        path = _font_file(font_name)
+        if path and (not entry.get("sha256") or _sha256(path) == entry["sha256"]):
+            index[font_name] = path
+        else:
+            if path:
+                print(f"[WARN] Font {font_name} sai checksum, bỏ qua: {path}")
+            missing.append(font_name)
+
+    # Các font .ttf khác trong thư mục (không có trong manifest) vẫn dùng được
+    for folder in (BUNDLED_FONTS_DIR, FONTS_DIR):
+        if not os.path.isdir(folder):
+            continue
+        for file_name in os.listdir(folder):
+            name, ext = os.path.splitext(file_name)
+            if ext.lower() == ".ttf" and name not in index and name not in FONT_MANIFEST:
+                index[name] = os.path.join(folder, file_name)
+
+    with _index_lock:
+        _font_index.clear()
+        _font_index.update(index)
+    print(f"[FONT] Font index: {len(index)} fonts, {len(missing)} missing")
+    return missing
+
+def download_fonts(font_names=None):
+    """
+    Tải các font còn thiếu theo manifest (chạy nền lúc startup, không chặn worker).
+    File được tải ra file tạm, chỉ đưa vào sử dụng khi đúng sha256.
+    """
     if not os.path.exists(FONTS_DIR):
         os.makedirs(FONTS_DIR)
     
     downloaded_fonts = {}
     print("[FONT] Kiểm tra và tải font chữ hỗ trợ tiếng Việt...")
     
-    for font_name, url in GOOGLE_FONTS.items():
-        font_path = os.path.join(FONTS_DIR, f"{font_name}.ttf")
-        if not os.path.exists(font_path):
-            try:
-                print(f"  [DOWN] Đang tải {font_name}...")
-                urllib.request.urlretrieve(url, font_path)
-                print(f"  [OK] Đã tải: {font_name}")
-            except Exception as e:
-                print(f"  [ERROR] Lỗi tải font {font_name}: {e}")
-                continue
-        downloaded_fonts[font_name] = font_path
+    for font_name in (font_names if font_names is not None else list(FONT_MANIFEST)):
+        entry = FONT_MANIFEST.get(font_name)
+        if not entry or get_font_path(font_name):
+            continue
+        font_path = os.path.join(FONTS_DIR, entry["file"])
+        tmp_path = f"{font_path}.download"
+        try:
+            print(f"  [DOWN] Đang tải {font_name}...")
+            urllib.request.urlretrieve(entry["url"], tmp_path)
+            if entry.get("sha256") and _sha256(tmp_path) != entry["sha256"]:
+                raise ValueError("checksum mismatch")
+            os.replace(tmp_path, font_path)
+            with _index_lock:
+                _font_index[font_name] = font_path
+            downloaded_fonts[font_name] = font_path
+            print(f"  [OK] Đã tải: {font_name}")
+        except Exception as e:
+            print(f"  [ERROR] Lỗi tải font {font_name}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
     
     return downloaded_fonts
 
 def get_font_path(font_name):
-    """Lấy đường dẫn font theo tên."""
-    path = os.path.join(FONTS_DIR, f"{font_name}.ttf")
-    if os.path.exists(path):
-        return path
-    return None
+    """Lấy đường dẫn font theo tên (tra trong font index, không chạm đĩa)."""
+    if not font_name:
+        return None
+    return _font_index.get(font_name)
+
+@lru_cache(maxsize=32)
+def _read_font_bytes(font_path):
+    with open(font_path, "rb") as f:
+        return f.read()
+
+@lru_cache(maxsize=settings.FONT_CACHE_SIZE)
+def _load_font(font_path, size):
+    return ImageFont.truetype(BytesIO(_read_font_bytes(font_path)), size)
+
+def get_font(font_path, size):
+    """
+    FreeTypeFont đã nạp sẵn, cache LRU theo (path, size).
+    File TTF chỉ đọc từ đĩa một lần; trả về font mặc định của Pillow nếu không có file.
+    """
+    if font_path and os.path.exists(font_path):
+        return _load_font(font_path, int(size))
+    return ImageFont.load_default()
+
+def preload_fonts():
+    """Nạp trước các font trong font index và font hệ thống vào cache (gọi lúc startup)."""
+    loaded = 0
+    paths = list(_font_index.values()) + [DEFAULT_FONT_PATH]
+    for font_path in paths:
+        if not os.path.exists(font_path):
+            continue
+        try:
+            # Đọc bytes và parse thử một lần để lỗi font hỏng lộ ra ngay khi khởi động
+            _load_font(font_path, 48)
+            loaded += 1
+        except Exception as e:
+            print(f"[WARN] Không nạp được font {font_path}: {e}")
+    print(f"[FONT] Preloaded {loaded} fonts")
+    return loaded
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from app.config import settings
+from app.utils.async_db import run_db, submit_db
+from app.utils.url import fix_banner_url
+from app.utils.image_variants import add_image_variants
+
+# Số banner tối đa của gallery (giới hạn limit của /generate/public-banners)
+GALLERY_MAX_ITEMS = 50
+
+
+class PublicGalleryCache:
+    """
+    Snapshot gallery trang chủ giữ trong RAM.
+
+    Các thao tác ghi (tạo/xóa banner, set_public, admin_set_hidden, đổi URL sang CDN)
+    gọi invalidate(): snapshot được dựng lại nền trong executor DB, request vẫn đọc bản cũ
+    cho tới khi bản mới sẵn sàng. JSON đã gắn URL được cache theo base URL + limit kèm ETag.
+    Thao tác ghi cũng đổi row version __gallery_version__ trong DB: mỗi GALLERY_VERSION_CHECK_INTERVAL
+    giây request đọc lại row này (1 row theo khóa chính), version khác bản đã dựng thì dựng lại
+    trước khi trả, để banner vừa bị ẩn/xóa ở process khác không còn hiện trên trang chủ.
+    GALLERY_CACHE_TTL là lưới an toàn cho thay đổi không đi qua version (vd. đổi tên/avatar user).
+    """
+
+    def __init__(self, size: int = GALLERY_MAX_ITEMS):
+        self.size = size
+        self._rows: Optional[List[dict]] = None
+        self._generation = 0  # Tăng mỗi lần invalidate
+        self._built_generation = -1
+        self._built_at = 0.0
+        self._built_version = None
+        self._version_checked_at = 0.0
+        self._refreshing = False
+        self._rendered: Dict[Tuple, Tuple[bytes, str]] = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "renders": 0, "rebuilds": 0, "version_changes": 0, "errors": 0}
+
+    def invalidate(self):
+        """Đánh dấu snapshot đã cũ và dựng lại nền (an toàn khi gọi từ thread DB)."""
+        with self._lock:
+            self._generation += 1
+        self._schedule_refresh()
+
+    def _schedule_refresh(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        try:
+            submit_db(self._refresh)
+        except RuntimeError:
+            # Executor đã dừng (process đang tắt)
+            with self._lock:
+                self._refreshing = False
+
+    def _refresh(self):
+        try:
+            while True:
+                generation = self._rebuild()
+                with self._lock:
+                    # Có invalidate mới trong lúc đang dựng: dựng thêm một lượt
+                    if self._generation == generation:
+                        self._refreshing = False
+                        return
+        except Exception as e:
+            print(f"[WARN] Public gallery refresh failed: {e}")
+            with self._lock:
+                self._stats["errors"] += 1
+                self._refreshing = False
+
+    def _rebuild(self) -> int:
+        from app.models.banner_db import BannerHistoryManager
+
+        with self._lock:
+            generation = self._generation
+        manager = BannerHistoryManager()
+        try:
+            # Đọc version trước: thay đổi xảy ra sau đó sẽ được phát hiện ở lần kiểm tra kế tiếp
+            version = manager.get_gallery_version()
+            rows = manager.get_public_banners(limit=self.size)
+        finally:
+            manager.close()
+
+        with self._lock:
+            if generation >= self._built_generation:
+                self._rows = rows
+                self._built_generation = generation
+                self._built_version = version
+                self._built_at = time.monotonic()
+                self._version_checked_at = self._built_at
+                self._rendered = {}
+                self._stats["rebuilds"] += 1
+        return generation
+
+    def _read_version(self) -> Optional[str]:
+        from app.models.banner_db import BannerHistoryManager
+
+        manager = BannerHistoryManager()
+        try:
+            return manager.get_gallery_version()
+        finally:
+            manager.close()
+
+    async def _get_rows(self) -> List[dict]:
+        if self._rows is None:
+            await run_db(self._rebuild)
+            return self._rows or []
+
+        now = time.monotonic()
+        if now - self._version_checked_at >= settings.GALLERY_VERSION_CHECK_INTERVAL:
+            self._version_checked_at = now
+            if await run_db(self._read_version) != self._built_version:
+                # Process khác đã đổi gallery: dựng lại ngay, không trả bản cũ
+                with self._lock:
+                    self._generation += 1
+                    self._stats["version_changes"] += 1
+                await run_db(self._rebuild)
+        elif now - self._built_at >= settings.GALLERY_CACHE_TTL:
+            # Hết TTL: trả bản hiện có, dựng lại nền
+            self._schedule_refresh()
+        return self._rows or []
+
+    async def render(self, request: Request, limit: int) -> Tuple[bytes, str]:
+        """JSON gallery (đã gắn URL theo request) và ETag của nó."""
+        rows = await self._get_rows()
+        limit = max(1, min(limit, self.size))
+        key = (
+            self._built_generation,
+            str(request.base_url),
+            request.headers.get("x-forwarded-proto"),
+            limit
+        )
+        cached = self._rendered.get(key)
+        if cached is not None:
+            self._stats["hits"] += 1
+            return cached
+
+        items = []
+        for row in rows[:limit]:
+            item = dict(row)
+            item['image_url'] = fix_banner_url(item['image_url'], request)
+            items.append(add_image_variants(item))
+        body = json.dumps(jsonable_encoder(items), ensure_ascii=False).encode("utf-8")
+        etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+        with self._lock:
+            if key[0] == self._built_generation:
+                if len(self._rendered) >= 64:
+                    self._rendered.clear()
+                self._rendered[key] = (body, etag)
+            self._stats["renders"] += 1
+        return body, etag
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "items": len(self._rows or []),
+                "generation": self._generation,
+                "built_generation": self._built_generation,
+                "age_seconds": round(time.monotonic() - self._built_at, 1) if self._rows is not None else None,
+                "rendered_variants": len(self._rendered),
+                **self._stats
+            }
+
+
+# Singleton instance
+public_gallery_cache = PublicGalleryCache()
@@ -0,0 +1,96 @@
+import hashlib
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+from app.config import settings
+
+
+def file_etag(path: str, stat_result: os.stat_result = None) -> str:
+    """
+    ETag mạnh từ tên file + size + mtime (không đọc nội dung: route async không bị chặn bởi file vài MB).
+    Banner/ảnh tham chiếu có tên UUID và không bị ghi đè; nếu có ghi đè thì mtime/size đổi -> ETag mới.
+    """
+    stat_result = stat_result or os.stat(path)
+    key = f"{os.path.basename(path)}:{stat_result.st_size}:{stat_result.st_mtime_ns}"
+    return f'"{hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]}"'
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match dùng so sánh yếu: bỏ tiền tố W/ trước khi so
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in candidates
+
+
+def _not_modified_since(if_modified_since: str, mtime: float) -> bool:
+    try:
+        return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+
+def cached_file_response(
+    request: Request,
+    path: str,
+    media_type: Optional[str] = None,
+    filename: Optional[str] = None,
+    content_disposition_type: str = "attachment",
+    immutable: bool = True
+) -> Response:
+    """
+    FileResponse kèm ETag mạnh, Last-Modified và Cache-Control dài hạn cho file không đổi
+    (tên file theo UUID). Trả 304 khi If-None-Match / If-Modified-Since khớp.
+    Range request (Accept-Ranges, 206) do FileResponse của Starlette xử lý.
+    """
+    stat_result = os.stat(path)
+    etag = file_etag(path, stat_result)
+    cache_control = (
+        f"public, max-age={settings.IMAGE_CACHE_MAX_AGE}, immutable" if immutable else "no-cache"
+    )
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "Cache-Control": cache_control,
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        not_modified = _etag_matches(if_none_match, etag)
+    else:
+        if_modified_since = request.headers.get("if-modified-since")
+        not_modified = bool(if_modified_since) and _not_modified_since(if_modified_since, stat_result.st_mtime)
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+
+    return FileResponse(
+        path,
+        media_type=media_type,
+        filename=filename,
+        headers=headers,
+        stat_result=stat_result,
+        content_disposition_type=content_disposition_type
+    )
+
+
+def cached_bytes_response(
+    request: Request,
+    body: bytes,
+    etag: str,
+    media_type: str = "application/json",
+    max_age: int = 0
+) -> Response:
+    """
+    Response cho nội dung dựng sẵn trong RAM (vd. JSON gallery) kèm ETag.
+    Trả 304 không kèm body khi If-None-Match khớp.
+    """
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={max_age}" if max_age > 0 else "no-cache",
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=media_type, headers=headers)
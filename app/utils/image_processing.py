@@ -1,8 +1,11 @@
-from PIL import Image, ImageDraw, ImageFont, ImageFilter
+from PIL import Image, ImageDraw, ImageFont, ImageFilter, features
 from io import BytesIO
 import io
 import base64
 import os
+from functools import lru_cache
+from app.config import settings
+from app.utils.font_manager import get_font, DEFAULT_FONT_PATH
 
 def get_compatible_aspect_ratio(width: int, height: int) -> str:
     """
@@ -42,6 +45,69 @@ def resize_image(input_image: Image.Image, width: int, height: int) -> Image.Ima
         print(f"Lỗi resize image: {e}")
         return input_image
 
+# Định dạng đầu ra của banner: tên cấu hình -> (định dạng Pillow, đuôi file)
+OUTPUT_FORMATS = {
+    "png": ("PNG", ".png"),
+    "jpeg": ("JPEG", ".jpg"),
+    "jpg": ("JPEG", ".jpg"),
+    "webp": ("WEBP", ".webp"),
+    "avif": ("AVIF", ".avif"),
+}
+_EXT_BY_PIL_FORMAT = {"PNG": ".png", "JPEG": ".jpg", "WEBP": ".webp", "AVIF": ".avif"}
+
+# Pillow chỉ ghi được AVIF từ 11.2 (wheel có sẵn libavif); bản cũ hơn hoặc build thiếu libavif thì dùng WEBP
+AVIF_SUPPORTED = features.check("avif")
+if settings.BANNER_OUTPUT_FORMAT.lower() == "avif" and not AVIF_SUPPORTED:
+    print(f"[WARN] BANNER_OUTPUT_FORMAT=avif nhưng Pillow {Image.__version__} không hỗ trợ AVIF (cần Pillow >= 11.2): banner sẽ được lưu dạng WEBP")
+
+def _encode_image(image: Image.Image, pil_format: str, quality: int) -> bytes:
+    buffer = BytesIO()
+    if pil_format == "JPEG":
+        image.convert("RGB").save(buffer, "JPEG", quality=quality, optimize=True, progressive=True)
+    elif pil_format == "WEBP":
+        image.save(buffer, "WEBP", quality=quality, method=4)
+    elif pil_format == "AVIF":
+        image.save(buffer, "AVIF", quality=quality)
+    else:
+        image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+def encode_banner(data: bytes, width: int, height: int, output_format: str = None, quality: int = None):
+    """
+    Resize và mã hóa ảnh model trả về hoàn toàn trong bộ nhớ. Trả về (bytes, đuôi file).
+
+    - output_format "auto": giữ nguyên bytes gốc khi model đã trả đúng kích thước, ngược lại mã hóa PNG.
+    - "webp"/"jpeg"/"avif"/"png": mã hóa theo định dạng với quality cấu hình;
+      bytes gốc vẫn được giữ nếu đã đúng kích thước và đúng định dạng.
+    """
+    output_format = (output_format or settings.BANNER_OUTPUT_FORMAT).lower()
+    quality = quality or settings.BANNER_OUTPUT_QUALITY
+
+    # Image.open chỉ đọc header (lazy) nên kiểm tra kích thước/định dạng không tốn decode
+    with Image.open(BytesIO(data)) as image:
+        source_format = image.format
+        target_format = OUTPUT_FORMATS.get(output_format, (None, None))[0]
+        if image.size == (width, height) and source_format in _EXT_BY_PIL_FORMAT:
+            if output_format == "auto" or source_format == target_format:
+                return data, _EXT_BY_PIL_FORMAT[source_format]
+
+        resized = resize_image(image, width, height)
+        pil_format = target_format or "PNG"
+        if pil_format == "AVIF" and not AVIF_SUPPORTED:
+            pil_format = "WEBP"
+        try:
+            encoded = _encode_image(resized, pil_format, quality)
+        except (KeyError, OSError, ValueError) as e:
+            # Pillow build không có encoder (vd. AVIF): dùng WEBP thay thế
+            print(f"[WARN] Không mã hóa được {pil_format} ({e}), dùng WEBP")
+            pil_format = "WEBP"
+            encoded = _encode_image(resized, pil_format, quality)
+    return encoded, _EXT_BY_PIL_FORMAT[pil_format]
+
+def write_file_bytes(file_path: str, data: bytes):
+    with open(file_path, "wb") as f:
+        f.write(data)
+
 def get_resolution(aspect_ratio: str) -> str:
     """
     Trả về độ phân giải chuẩn theo tài liệu Gemini API (Gemini 2.1 Flash).
@@ -79,13 +145,9 @@ def add_text_overlay(
         W, H = draw_img.size
         
         # Đường dẫn font (ưu tiên Arial hoặc font hệ thống)
-        font_path = "C:\\Windows\\Fonts\\arialbd.ttf" if os.name == 'nt' else "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
-        if not os.path.exists(font_path):
-            font_title = ImageFont.load_default()
-            font_sub = ImageFont.load_default()
-        else:
-            font_title = ImageFont.truetype(font_path, int(H * 0.1)) # 10% chiều cao cho title
-            font_sub = ImageFont.truetype(font_path, int(H * 0.04))  # 4% chiều cao cho subtitle
+        font_path = DEFAULT_FONT_PATH
+        font_title = get_font(font_path, int(H * 0.1)) # 10% chiều cao cho title
+        font_sub = get_font(font_path, int(H * 0.04))  # 4% chiều cao cho subtitle
         
         # 1. Vẽ tiêu đề (Ở giữa)
         if title:
@@ -109,7 +171,7 @@ def add_text_overlay(
             
         # 3. Vẽ Website (Góc dưới cùng)
         if website:
-            font_web = ImageFont.truetype(font_path, int(H * 0.03)) if os.path.exists(font_path) else font_sub
+            font_web = get_font(font_path, int(H * 0.03)) if os.path.exists(font_path) else font_sub
             bbox = draw.textbbox((0, 0), website, font=font_web)
             w, h = bbox[2] - bbox[0], bbox[3] - bbox[1]
             x, y = (W - w) / 2, H - h - 30
@@ -125,6 +187,60 @@ def add_text_overlay(
         print(f"Lỗi khi chèn text overlay: {e}")
         return image
 
+def _wrap_words(words: tuple, font, max_width: float) -> list:
+    """Chia dòng theo độ rộng; mỗi từ chỉ đo một lần, chỉ đo cả dòng (có kerning) khi sát giới hạn."""
+    space_w = font.getlength(" ")
+    word_w = {}
+    lines = []
+    current_line = []
+    current_w = 0.0
+    for word in words:
+        if word not in word_w:
+            word_w[word] = font.getlength(word)
+        w = word_w[word]
+        if not current_line:
+            current_line, current_w = [word], w
+            continue
+        estimate = current_w + space_w + w
+        if estimate > max_width * 0.98:
+            # Gần ngưỡng: đo chính xác cả dòng để tính kerning
+            estimate = font.getlength(" ".join(current_line + [word]))
+        if estimate > max_width:
+            lines.append(" ".join(current_line))
+            current_line, current_w = [word], w
+        else:
+            current_line.append(word)
+            current_w = estimate
+    lines.append(" ".join(current_line))
+    return lines
+
+@lru_cache(maxsize=512)
+def fit_text_layout(text: str, font_path: str, width: int, height: int, min_size: int = 20):
+    """
+    Tìm font size lớn nhất (tối đa 10% chiều cao) để text chia dòng trong 85% chiều rộng
+    và tổng chiều cao dòng dưới 70% canvas. Trả về (font_size, lines).
+    """
+    words = tuple(text.split())
+    max_width = width * 0.85
+
+    def layout(size):
+        lines = _wrap_words(words, get_font(font_path, size), max_width)
+        return lines, len(lines) * size * 2.2 < height * 0.7
+
+    low, high = min_size, max(min_size, int(height * 0.1))
+    best_size, best_lines = low, None
+    while low <= high:
+        mid = (low + high) // 2
+        lines, fits = layout(mid)
+        if fits:
+            best_size, best_lines = mid, lines
+            low = mid + 1
+        else:
+            high = mid - 1
+    if best_lines is None:
+        best_lines, _ = layout(best_size)
+    return best_size, tuple(best_lines)
+
 def create_text_reference_image(
     width: int, 
     height: int, 
@@ -148,42 +264,11 @@ def create_text_reference_image(
         draw = ImageDraw.Draw(image)
         
         # Sử dụng font_path truyền vào hoặc font mặc định hệ thống
-        final_font_path = font_path if font_path and os.path.exists(font_path) else (
-            "C:\\Windows\\Fonts\\arialbd.ttf" if os.name == 'nt' else "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
-        )
-        
-        # Tự động tính toán font size hợp lý (Bắt đầu từ 10% height và giảm dần nếu không vừa)
-        current_font_size = int(height * 0.1)
+        final_font_path = font_path if font_path and os.path.exists(font_path) else DEFAULT_FONT_PATH
         
-        while current_font_size > 20:
-            if os.path.exists(final_font_path):
-                current_font = ImageFont.truetype(final_font_path, current_font_size)
-            else:
-                current_font = ImageFont.load_default()
-                
-            # Chia dòng thử nghiệm
-            lines = []
-            words = text.split()
-            current_line = []
-            for word in words:
-                current_line.append(word)
-                test_line = " ".join(current_line)
-                bbox = draw.textbbox((0, 0), test_line, font=current_font)
-                if (bbox[2] - bbox[0]) > width * 0.85:
-                    current_line.pop()
-                    lines.append(" ".join(current_line))
-                    current_line = [word]
-            lines.append(" ".join(current_line))
-            
-            line_height = current_font_size * 2.2
-            total_h = len(lines) * line_height
-            
-            # Nếu tổng chiều cao chữ vượt quá 70% canvas, giảm font và tính lại
-            if total_h < height * 0.7:
-                break
-            current_font_size -= 5
-
-        # Tính toán lại Y dựa trên font_size cuối cùng
+        # Chọn font size lớn nhất vừa khung (binary search, kết quả cache theo text/font/khung)
+        current_font_size, lines = fit_text_layout(text, final_font_path, width, height)
+        current_font = get_font(final_font_path, current_font_size)
         line_height = current_font_size * 2.2
         total_h = len(lines) * line_height
         
@@ -0,0 +1,83 @@
+import os
+import uuid
+from typing import Optional
+from PIL import Image
+from app.config import settings
+
+# Các bề rộng biến thể (thumbnail/medium/large) dùng cho srcset và route /view?w=
+VARIANT_WIDTHS = sorted({int(w) for w in settings.IMAGE_VARIANT_WIDTHS.split(",") if w.strip()})
+THUMBNAIL_WIDTH = VARIANT_WIDTHS[0] if VARIANT_WIDTHS else 320
+
+
+def snap_width(width: int) -> Optional[int]:
+    """
+    Làm tròn bề rộng yêu cầu lên biến thể gần nhất, để cache trên đĩa chỉ có số biến thể cố định.
+    Trả về None nếu lớn hơn mọi biến thể (dùng ảnh gốc).
+    """
+    for variant_width in VARIANT_WIDTHS:
+        if width <= variant_width:
+            return variant_width
+    return None
+
+
+def _variant_path(source_path: str, width: int) -> str:
+    folder = os.path.join(os.path.dirname(source_path), "variants")
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    return os.path.join(folder, f"{stem}_w{width}.webp")
+
+
+def get_variant_path(source_path: str, width: int) -> str:
+    """
+    Đường dẫn biến thể WebP có bề rộng width của ảnh gốc, tạo và lưu vào cache trên đĩa nếu chưa có.
+    Trả về ảnh gốc nếu ảnh gốc không rộng hơn width.
+    """
+    variant_path = _variant_path(source_path, width)
+    if os.path.exists(variant_path) and os.path.getmtime(variant_path) >= os.path.getmtime(source_path):
+        return variant_path
+
+    with Image.open(source_path) as image:
+        if image.width <= width:
+            return source_path
+        # draft() cho phép decoder JPEG giảm độ phân giải ngay khi đọc
+        image.draft("RGB", (width, int(image.height * width / image.width)))
+        variant = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+        variant.thumbnail((width, variant.height), Image.Resampling.LANCZOS)
+
+        os.makedirs(os.path.dirname(variant_path), exist_ok=True)
+        # Ghi ra file tạm rồi đổi tên để request song song không đọc phải file ghi dở
+        tmp_path = f"{variant_path}.{uuid.uuid4().hex[:8]}.tmp"
+        variant.save(tmp_path, "WEBP", quality=settings.IMAGE_VARIANT_QUALITY, method=4)
+        os.replace(tmp_path, variant_path)
+    return variant_path
+
+
+def generate_variants(source_path: str):
+    """Tạo trước mọi biến thể của một banner vừa sinh (chạy nền)."""
+    for width in VARIANT_WIDTHS:
+        try:
+            get_variant_path(source_path, width)
+        except Exception as e:
+            print(f"[WARN] Không tạo được biến thể {width}px cho {source_path}: {e}")
+
+
+def variant_url(url: str, width: int) -> str:
+    """URL của biến thể: Cloudinary dùng transformation, ảnh local dùng route /view?w=."""
+    if not url:
+        return url
+    if "res.cloudinary.com" in url and "/upload/" in url:
+        return url.replace("/upload/", f"/upload/w_{width},c_limit,f_auto,q_auto/", 1)
+    if "/generate/view/" in url:
+        return f"{url.split('?')[0]}?w={width}"
+    return url
+
+
+def add_image_variants(item: dict, key: str = "image_url") -> dict:
+    """Thêm thumbnail_url và srcset (theo VARIANT_WIDTHS) cho một item đã có URL đầy đủ."""
+    url = item.get(key)
+    if not url or variant_url(url, THUMBNAIL_WIDTH) == url:
+        item["thumbnail_url"] = url
+        item["srcset"] = None
+        return item
+    item["thumbnail_url"] = variant_url(url, THUMBNAIL_WIDTH)
+    item["srcset"] = ", ".join(f"{variant_url(url, w)} {w}w" for w in VARIANT_WIDTHS)
+    return item
@@ -0,0 +1,55 @@
+import base64
+import json
+from typing import List, Optional, Tuple
+from fastapi import HTTPException, Response
+from app.config import settings
+
+# Header trả về cursor của trang kế tiếp (không có header = đã hết dữ liệu)
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def clamp_limit(limit: Optional[int]) -> int:
+    if not limit or limit <= 0:
+        return settings.PAGE_DEFAULT_LIMIT
+    return min(limit, settings.PAGE_MAX_LIMIT)
+
+
+def encode_cursor(row: dict) -> str:
+    """Cursor keyset từ (created_at, id) của row cuối trang."""
+    raw = json.dumps([str(row["created_at"]) if row["created_at"] is not None else None, row["id"]])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[str, int]]:
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, row_id = json.loads(raw)
+        return created_at, int(row_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_condition(p: str, prefix: str = "") -> str:
+    """
+    Điều kiện lấy các row đứng sau cursor theo thứ tự (created_at DESC, id DESC).
+    Viết dạng OR thay vì so sánh tuple để MySQL/TiDB dùng được index (created_at, id).
+    """
+    return f"({prefix}created_at < {p} OR ({prefix}created_at = {p} AND {prefix}id < {p}))"
+
+
+def keyset_params(position: Tuple[str, int]) -> tuple:
+    created_at, row_id = position
+    return (created_at, created_at, row_id)
+
+
+def paginate(rows: List[dict], limit: int, response: Optional[Response] = None) -> List[dict]:
+    """
+    rows được truy vấn với LIMIT limit + 1: cắt về limit và đặt X-Next-Cursor nếu còn trang sau.
+    """
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if response is not None and has_more and rows:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(rows[-1])
+    return rows
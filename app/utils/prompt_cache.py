@@ -0,0 +1,193 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+import unicodedata
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from cachetools import TTLCache
+from app.config import settings
+from app.utils.async_db import run_db, submit_db
+from app.utils.ai_clients import get_llm_model
+from chatbot.chatbot.utils.custom_prompt import CustomPrompt
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+# Version của system prompt theo loại kết quả: sửa prompt trong CustomPrompt là tự ra khóa mới
+PROMPT_VERSIONS = {
+    "analysis": _digest(CustomPrompt.ANALYZE_PROMPT),
+    "prompt": _digest(CustomPrompt.GENERATE_PROMPT),
+}
+
+# Chu kỳ dọn các row hết hạn trong bảng prompt_cache
+_PURGE_INTERVAL = 6 * 3600
+
+
+def _normalize(value):
+    # Gộp khoảng trắng và chuẩn hóa Unicode (NFC) để "Khai  trương" và "Khai trương" cùng một khóa.
+    # Không đổi hoa/thường: nội dung chữ trên banner phân biệt hoa thường.
+    if isinstance(value, str):
+        return unicodedata.normalize("NFC", " ".join(value.split()))
+    return value
+
+
+class PromptResultCache:
+    """
+    Cache kết quả LLM (phân tích yêu cầu, prompt chi tiết) theo fingerprint request:
+    sha256 của input đã chuẩn hóa + provider/model + version system prompt.
+
+    Hai tầng: RAM (TTL + LRU) và bảng prompt_cache trong DB (giữ qua restart).
+    Các request giống nhau chạy đồng thời chỉ gọi LLM một lần.
+    """
+
+    def __init__(self):
+        self._memory = TTLCache(maxsize=settings.PROMPT_CACHE_SIZE, ttl=settings.PROMPT_CACHE_TTL)
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._last_purge = 0.0
+        self._stats = {"memory_hits": 0, "db_hits": 0, "alternate_hits": 0, "misses": 0, "db_errors": 0}
+
+    def make_key(self, kind: str, payload: dict, provider: str = None) -> str:
+        provider, model = get_llm_model(provider)
+        fingerprint = {
+            "kind": kind,
+            "version": PROMPT_VERSIONS.get(kind, ""),
+            "provider": provider,
+            "model": model,
+            "input": {k: _normalize(v) for k, v in payload.items()},
+        }
+        return hashlib.sha256(json.dumps(fingerprint, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    async def get_or_compute(
+        self,
+        kind: str,
+        payload: dict,
+        compute: Callable[[], Awaitable[Any]],
+        encode: Callable[[Any], str] = str,
+        decode: Callable[[str], Any] = str,
+        provider: str = None,
+        alternates: Optional[Callable[[], Awaitable[List[dict]]]] = None
+    ):
+        """
+        Trả kết quả đã cache cho (kind, payload) hoặc gọi compute() rồi lưu lại.
+        Kết quả được lưu dạng chuỗi (encode/decode), mỗi lần hit trả về object mới.
+        compute() trả None thì trả None cho caller và không cache (lần sau gọi lại LLM).
+        alternates: chỉ gọi khi không có khóa chính xác, trả về các payload tương đương
+        (vd. request gần giống từ semantic cache) để thử trước khi gọi LLM.
+        """
+        if not settings.PROMPT_CACHE_ENABLED:
+            return await compute()
+
+        key = self.make_key(kind, payload, provider)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load(key, kind, compute, encode, provider, alternates))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # shield: một caller bị hủy không hủy lượt gọi LLM mà các caller khác đang chờ
+        value = await asyncio.shield(task)
+        return decode(value) if value is not None else None
+
+    async def _lookup(self, key: str, count_stats: bool = True) -> Optional[str]:
+        """Tìm theo khóa trong RAM rồi tới DB (hit từ DB được nạp lại vào RAM)."""
+        with self._lock:
+            value = self._memory.get(key)
+        if value is not None:
+            if count_stats:
+                self._stats["memory_hits"] += 1
+            return value
+
+        try:
+            value = await run_db(self._db_get, key)
+        except Exception as e:
+            self._stats["db_errors"] += 1
+            print(f"[WARN] Prompt cache DB read failed: {e}")
+            value = None
+        if value is not None:
+            if count_stats:
+                self._stats["db_hits"] += 1
+            with self._lock:
+                self._memory[key] = value
+        return value
+
+    async def _load(self, key: str, kind: str, compute, encode, provider=None, alternates=None) -> Optional[str]:
+        value = await self._lookup(key)
+        if value is not None:
+            return value
+
+        if alternates is not None:
+            try:
+                candidates = await alternates()
+            except Exception as e:
+                print(f"[WARN] Prompt cache alternates failed: {e}")
+                candidates = []
+            for payload in candidates:
+                value = await self._lookup(self.make_key(kind, payload, provider), count_stats=False)
+                if value is not None:
+                    self._stats["alternate_hits"] += 1
+                    # Lưu cả dưới khóa của request này để lần lặp lại sau là hit chính xác
+                    with self._lock:
+                        self._memory[key] = value
+                    return value
+
+        self._stats["misses"] += 1
+        result = await compute()
+        if result is None:
+            print(f"[WARN] LLM returned no result for {kind}, not caching")
+            return None
+        value = encode(result)
+        with self._lock:
+            self._memory[key] = value
+        # Ghi DB nền, không bắt task chờ
+        submit_db(self._db_set, key, kind, value)
+        return value
+
+    def _db_get(self, key: str):
+        from app.models.banner_db import PromptCacheManager
+
+        manager = PromptCacheManager()
+        try:
+            return manager.get(key)
+        finally:
+            manager.close()
+
+    def _db_set(self, key: str, kind: str, value: str):
+        from app.models.banner_db import PromptCacheManager
+
+        manager = PromptCacheManager()
+        try:
+            manager.set(key, kind, value, settings.PROMPT_CACHE_DB_TTL)
+            if time.monotonic() - self._last_purge >= _PURGE_INTERVAL:
+                self._last_purge = time.monotonic()
+                purged = manager.purge_expired()
+                if purged:
+                    print(f"[OK] Prompt cache: purged {purged} expired rows")
+        except Exception as e:
+            self._stats["db_errors"] += 1
+            print(f"[WARN] Prompt cache DB write failed: {e}")
+        finally:
+            manager.close()
+
+    def clear_memory(self):
+        with self._lock:
+            self._memory.clear()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            size = len(self._memory)
+        hits = self._stats["memory_hits"] + self._stats["db_hits"] + self._stats["alternate_hits"]
+        lookups = hits + self._stats["misses"]
+        return {
+            "enabled": settings.PROMPT_CACHE_ENABLED,
+            "memory_entries": size,
+            "inflight": len(self._inflight),
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            **self._stats
+        }
+
+
+# Singleton instance
+prompt_result_cache = PromptResultCache()
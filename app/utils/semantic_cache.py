@@ -0,0 +1,192 @@
+import asyncio
+import hashlib
+import json
+import re
+import threading
+import unicodedata
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Set
+from app.config import settings
+
+# Mốc thống kê phân bố độ tương đồng (cosine) của láng giềng gần nhất
+SIMILARITY_BUCKETS = (0.80, 0.85, 0.90, 0.93, 0.95, 0.97, 0.99)
+
+# Kết quả chỉ được dùng lại khi hai request có cùng tập từ (phân biệt hoa thường như prompt_cache,
+# bỏ dấu câu, không tính thứ tự).
+# "giảm 30%" / "giảm 50%" hay hai tên cửa hàng khác nhau có embedding gần như giống nhau
+# nhưng text trên banner khác nhau, nên embedding không quyết định việc dùng lại.
+_WORD_RE = re.compile(r"\w+")
+# Đoạn trong ngoặc kép là chữ in lên banner: so khớp nguyên văn (cả khoảng trắng, thứ tự)
+_QUOTED_RE = re.compile(r"\"([^\"]+)\"|“([^”]+)”|'([^']+)'|‘([^’]+)’")
+
+
+def _normalize(text: str) -> str:
+    return unicodedata.normalize("NFC", " ".join((text or "").split()))
+
+
+def guard_tokens(text: str) -> tuple:
+    """Nội dung của yêu cầu bỏ qua cách diễn đạt: multiset từ (giữ hoa thường) và các đoạn trích dẫn nguyên văn."""
+    text = _normalize(text)
+    quoted = [next(g for g in match if g) for match in _QUOTED_RE.findall(text)]
+    return (
+        tuple(sorted(_WORD_RE.findall(text))),
+        tuple(sorted(q.strip() for q in quoted)),
+    )
+
+
+def content_key(text: str) -> str:
+    """Hash của guard_tokens: hai request cùng nội dung có cùng key."""
+    raw = json.dumps(guard_tokens(text), ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SemanticPromptCache:
+    """
+    Bảng content_key -> user_request đầu tiên đã phân tích có nội dung đó.
+    find_similar() chỉ là một lần tra dict (không gọi API) để PromptResultCache dùng lại kết quả
+    của request cùng nội dung, khác cách viết, trước khi gọi LLM.
+    Bảng nằm trong RAM, giới hạn SEMANTIC_CACHE_MAX_ENTRIES (bỏ các entry ít dùng nhất khi đầy).
+
+    Embedding + FAISS chỉ còn dùng cho thống kê (SEMANTIC_CACHE_TRACK_SIMILARITY): chạy nền khi có
+    nội dung mới, ghi lại độ tương đồng với láng giềng gần nhất, không nằm trên đường xử lý request.
+    """
+
+    def __init__(self):
+        self.enabled = settings.SEMANTIC_CACHE_ENABLED
+        self.track_similarity = settings.SEMANTIC_CACHE_TRACK_SIMILARITY
+        self._by_key: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "hits": 0, "misses": 0, "added": 0, "near_duplicates": 0, "embedding_errors": 0}
+
+        # Thống kê độ tương đồng (chạy nền)
+        self._embedding_model = None
+        self._index = None
+        self._index_order: Deque[int] = deque()
+        self._index_keys: Dict[int, str] = {}
+        self._next_id = 0
+        self._background: Set[asyncio.Task] = set()
+        self._histogram = [0] * (len(SIMILARITY_BUCKETS) + 1)
+        self._similarity_sum = 0.0
+        self._similarity_count = 0
+
+    def find_similar(self, text: str) -> List[str]:
+        """Request đã phân tích có cùng nội dung với `text` (khác cách viết), hoặc []."""
+        text = _normalize(text)
+        if not self.enabled or not text:
+            return []
+        key = content_key(text)
+        with self._lock:
+            other = self._by_key.get(key)
+            if other is not None:
+                self._by_key.move_to_end(key)
+        matches = [other] if other is not None and other != text else []
+        self._stats["lookups"] += 1
+        self._stats["hits" if matches else "misses"] += 1
+        return matches
+
+    def remember(self, text: str):
+        """Ghi nhận một request vừa được phân tích thành công."""
+        text = _normalize(text)
+        if not self.enabled or not text:
+            return
+        key = content_key(text)
+        with self._lock:
+            if key in self._by_key:
+                return
+            while len(self._by_key) >= settings.SEMANTIC_CACHE_MAX_ENTRIES:
+                self._by_key.popitem(last=False)
+            self._by_key[key] = text
+            self._stats["added"] += 1
+        if self.track_similarity:
+            self._schedule(self._track_similarity(key, text))
+
+    def _schedule(self, coro):
+        """Chạy nền (giữ tham chiếu task tới khi xong để không bị GC, log lỗi nếu có)."""
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._on_background_done)
+
+    def _on_background_done(self, task: asyncio.Task):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"[WARN] Semantic cache similarity tracking failed: {task.exception()}")
+
+    def _get_embedding_model(self):
+        if self._embedding_model is None:
+            from chatbot.ingestion.service_manager import ServiceManager
+
+            model = None
+            if settings.KEY_API_GPT:
+                model = ServiceManager().get_embedding_model(settings.SEMANTIC_CACHE_EMBEDDING_MODEL)
+            if model is None:
+                # Không có embedding model: chỉ tắt phần thống kê, việc dùng lại kết quả không bị ảnh hưởng
+                self.track_similarity = False
+                print(f"[WARN] Semantic similarity tracking disabled: embedding model '{settings.SEMANTIC_CACHE_EMBEDDING_MODEL}' unavailable")
+                raise ValueError("Embedding model unavailable")
+            self._embedding_model = model
+        return self._embedding_model
+
+    async def _track_similarity(self, key: str, text: str):
+        import numpy as np
+
+        try:
+            raw = await self._get_embedding_model().aembed_query(text)
+        except Exception as e:
+            self._stats["embedding_errors"] += 1
+            print(f"[WARN] Semantic cache embedding failed: {e}")
+            return
+        vector = np.asarray(raw, dtype="float32").reshape(1, -1)
+        await asyncio.to_thread(self._index_and_measure, key, vector)
+
+    def _index_and_measure(self, key: str, vector):
+        import faiss
+        import numpy as np
+
+        faiss.normalize_L2(vector)
+        with self._lock:
+            if self._index is None:
+                self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+            if self._index.ntotal:
+                scores, ids = self._index.search(vector, 1)
+                similarity = float(scores[0][0])
+                bucket = sum(1 for edge in SIMILARITY_BUCKETS if similarity >= edge)
+                self._histogram[bucket] += 1
+                self._similarity_sum += similarity
+                self._similarity_count += 1
+                # Gần giống theo embedding nhưng khác nội dung: trước đây có thể đã bị dùng nhầm kết quả
+                if similarity >= settings.SEMANTIC_CACHE_THRESHOLD and self._index_keys.get(int(ids[0][0])) != key:
+                    self._stats["near_duplicates"] += 1
+
+            if len(self._index_order) >= settings.SEMANTIC_CACHE_MAX_ENTRIES:
+                # Bỏ 10% entry cũ nhất
+                evict = [self._index_order.popleft() for _ in range(max(1, len(self._index_order) // 10))]
+                self._index.remove_ids(np.asarray(evict, dtype="int64"))
+                for entry_id in evict:
+                    self._index_keys.pop(entry_id, None)
+            entry_id = self._next_id
+            self._next_id += 1
+            self._index.add_with_ids(vector, np.asarray([entry_id], dtype="int64"))
+            self._index_keys[entry_id] = key
+            self._index_order.append(entry_id)
+
+    def get_stats(self) -> dict:
+        lookups = self._stats["hits"] + self._stats["misses"]
+        labels = [f"<{SIMILARITY_BUCKETS[0]:.2f}"]
+        labels += [f"{lo:.2f}-{hi:.2f}" for lo, hi in zip(SIMILARITY_BUCKETS, SIMILARITY_BUCKETS[1:])]
+        labels += [f">={SIMILARITY_BUCKETS[-1]:.2f}"]
+        with self._lock:
+            entries = len(self._by_key)
+        return {
+            "enabled": self.enabled,
+            "entries": entries,
+            "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+            "track_similarity": self.track_similarity,
+            "threshold": settings.SEMANTIC_CACHE_THRESHOLD,
+            "mean_top_similarity": round(self._similarity_sum / self._similarity_count, 4) if self._similarity_count else None,
+            "top_similarity_histogram": dict(zip(labels, self._histogram)),
+            **self._stats
+        }
+
+
+# Singleton instance
+semantic_prompt_cache = SemanticPromptCache()
@@ -0,0 +1,41 @@
+import asyncio
+from datetime import datetime, timedelta
+from app.config import settings
+from app.utils.async_db import run_db
+
+
+def reconcile_stats() -> dict:
+    """
+    Đối soát các bảng counter với dữ liệu gốc: sửa user_stats bị lệch và tính lại daily_stats.
+    Các counter được cộng dồn trong transaction của lệnh ghi, job này chỉ bắt các lệch hiếm
+    (ghi song song, sửa DB bằng tay...).
+    """
+    from app.models.banner_db import StatsManager
+
+    stats_manager = StatsManager()
+    try:
+        return {
+            "user_stats_fixed": stats_manager.reconcile_user_stats(),
+            "daily_stats_days": stats_manager.rebuild()
+        }
+    finally:
+        stats_manager.close()
+
+
+def _seconds_until(hour: int) -> float:
+    now = datetime.now()
+    next_run = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+    if next_run <= now:
+        next_run += timedelta(days=1)
+    return (next_run - now).total_seconds()
+
+
+async def run_nightly_reconciliation():
+    """Chạy reconcile_stats mỗi ngày lúc STATS_RECONCILE_HOUR giờ (giờ server)."""
+    while True:
+        await asyncio.sleep(_seconds_until(settings.STATS_RECONCILE_HOUR))
+        try:
+            result = await run_db(reconcile_stats)
+            print(f"[OK] Nightly stats reconciliation: {result}")
+        except Exception as e:
+            print(f"[WARN] Nightly stats reconciliation failed: {e}")
@@ -1,39 +1,89 @@
 import asyncio
 import json
+import os
+import socket
+import time
 import uuid
-from typing import Dict, List, Optional
-from app.models.banner_db import TasksManager, UserManager, BannerHistoryManager, ConfigManager
+from collections import deque
+from typing import Deque, Dict, List, Optional
+from app.models.banner_db import TasksManager, UserManager, BannerHistoryManager, ConfigManager, LeaseLostError
 from app.config import settings
+from app.utils.async_db import run_db
+from app.utils.event_bus import task_event_bus
 
 class TaskManagerRAM:
     _instance = None
-    
+
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(TaskManagerRAM, cls).__new__(cls)
             cls._instance.queue = asyncio.Queue()
             cls._instance.active_tasks: Dict[str, dict] = {}
-            cls._instance.worker_task = None
+            cls._instance.worker_tasks: List[asyncio.Task] = []
+            cls._instance.num_workers = max(1, settings.TASK_WORKERS)
+            cls._instance.max_concurrency = max(1, settings.TASK_MAX_CONCURRENCY)
+            cls._instance.max_per_user = max(1, settings.TASK_MAX_PER_USER)
+            cls._instance.semaphore = None
+            # Số task đang chạy của từng user và các task bị hoãn do user đã chạm giới hạn
+            cls._instance.running_by_user: Dict[int, int] = {}
+            cls._instance.deferred: Dict[int, Deque[str]] = {}
+            # Bộ đếm để theo dõi và định cỡ pool worker
+            cls._instance.busy_workers = 0
+            cls._instance.processed_count = 0
+            cls._instance.failed_count = 0
+            cls._instance.busy_seconds = 0.0
+            cls._instance.wait_seconds = 0.0
+            cls._instance.started_at = None
+            # Backend hàng đợi: "ram" (asyncio.Queue trong process) hoặc "db" (bảng tasks, có lease)
+            cls._instance.backend = settings.TASK_QUEUE_BACKEND.lower()
+            cls._instance.handler = None
+            cls._instance.instance_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+            cls._instance.wakeup = asyncio.Event()
         return cls._instance
 
+    def publish(self, task_id: str, event_type: str, **data):
+        """Đẩy sự kiện tiến trình của task tới các client đang stream (SSE)."""
+        task_event_bus.publish(task_id, {"type": event_type, "task_id": task_id, **data})
+
+    def get_lease_owner(self, task_id: str) -> Optional[str]:
+        """worker_id đang giữ lease của task (backend "db"); None với backend "ram"."""
+        task_info = self.active_tasks.get(task_id)
+        return task_info.get("lease_owner") if task_info else None
+
+    def set_handler(self, process_func):
+        """Đăng ký hàm xử lý cho các task được claim từ DB (backend "db")."""
+        self.handler = process_func
+
     async def add_task(self, task_id: str, user_id: int, request_data: dict, process_func):
+        if self.backend == "db":
+            # Row trong bảng tasks chính là hàng đợi; chỉ cần đánh thức worker đang chờ
+            self.handler = self.handler or process_func
+            self.wakeup.set()
+            return task_id
+
         task_info = {
             "id": task_id,
             "user_id": user_id,
             "request_data": request_data,
             "process_func": process_func,
-            "status": "pending"
+            "status": "pending",
+            "enqueued_at": time.monotonic()
         }
         self.active_tasks[task_id] = task_info
         await self.queue.put(task_id)
         return task_id
 
     async def start_worker(self):
-        if self.worker_task is None:
-            self.worker_task = asyncio.create_task(self._worker_loop())
-            print("[START] RAM Task Worker started.")
+        if not self.worker_tasks:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.started_at = time.monotonic()
+            worker_loop = self._db_worker_loop if self.backend == "db" else self._worker_loop
+            for index in range(self.num_workers):
+                self.worker_tasks.append(asyncio.create_task(worker_loop(index)))
+            print(f"[START] {self.backend.upper()} Task Worker pool started ({self.num_workers} workers, "
+                  f"max {self.max_concurrency} concurrent, {self.max_per_user}/user).")
 
-    async def _worker_loop(self):
+    async def _worker_loop(self, worker_index: int):
         while True:
             task_id = await self.queue.get()
             try:
@@ -43,37 +93,196 @@ class TaskManagerRAM:
                     # Mark as failed in DB so frontend stops polling
                     print(f"[WARN] Task {task_id} not found in RAM, marking as failed in DB")
                     try:
-                        from app.models.banner_db import TasksManager
-                        tm = TasksManager()
-                        tm.update_task(task_id, "failed", error_message="Task lost after server restart. Please try again.")
-                        tm.close()
+                        await run_db(self._tasks_call, "update_task", task_id, "failed", None, "Task lost after server restart. Please try again.")
                     except Exception as db_err:
                         print(f"Could not update orphaned task in DB: {db_err}")
+                    self.publish(task_id, "status", status="failed", error="Task lost after server restart. Please try again.")
                     continue
-                
-                task_info["status"] = "processing"
-                # Call the processing function
-                await task_info["process_func"](task_id, task_info["user_id"], task_info["request_data"])
-                
-            except Exception as e:
-                import traceback
-                print(f"[ERROR] Error in RAM worker for task {task_id}: {e}")
-                traceback.print_exc()
-                # CRITICAL: Update DB to 'failed' so frontend stops polling!
+
+                user_id = task_info["user_id"]
+                if self.running_by_user.get(user_id, 0) >= self.max_per_user:
+                    # User đã chạm giới hạn: hoãn task lại, worker chuyển sang task của người khác
+                    self.deferred.setdefault(user_id, deque()).append(task_id)
+                    continue
+
+                self.running_by_user[user_id] = self.running_by_user.get(user_id, 0) + 1
                 try:
-                    from app.models.banner_db import TasksManager
-                    tm = TasksManager()
-                    tm.update_task(task_id, "failed", error_message=f"Worker error: {str(e)}")
-                    tm.close()
-                except Exception as db_err:
-                    print(f"Could not update failed task in DB: {db_err}")
+                    async with self.semaphore:
+                        await self._run_task(task_id, task_info)
+                finally:
+                    self._release_user_slot(user_id)
             finally:
-                if task_id in self.active_tasks:
-                    del self.active_tasks[task_id]
                 self.queue.task_done()
 
+    async def _db_worker_loop(self, worker_index: int):
+        worker_id = f"{self.instance_id}:{worker_index}"
+        while True:
+            try:
+                async with self.semaphore:
+                    # Loại các user đã chạm giới hạn trong process này (giới hạn liên process do câu claim xử lý)
+                    busy_users = [uid for uid, count in self.running_by_user.items() if count >= self.max_per_user]
+                    task = await run_db(self._claim_next_task, worker_id, busy_users)
+                    if task:
+                        await self._run_claimed_task(task, worker_id)
+                        continue
+            except Exception as e:
+                print(f"[ERROR] DB worker {worker_id} error: {e}")
+
+            # Hàng đợi trống: chờ task mới (add_task đánh thức) hoặc hết chu kỳ poll
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=settings.TASK_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    def _claim_next_task(self, worker_id: str, busy_users: list):
+        tm = TasksManager()
+        try:
+            return tm.claim_next_task(
+                worker_id,
+                settings.TASK_LEASE_SECONDS,
+                max_per_user=self.max_per_user,
+                exclude_user_ids=busy_users,
+                max_attempts=settings.TASK_MAX_ATTEMPTS
+            )
+        finally:
+            tm.close()
+
+    async def _run_claimed_task(self, task: dict, worker_id: str):
+        task_id = task["id"]
+        user_id = task["user_id"]
+        try:
+            request_data = json.loads(task["request_data"]) if task.get("request_data") else {}
+        except Exception:
+            request_data = {}
+
+        if self.handler is None:
+            print(f"[WARN] No task handler registered, releasing task {task_id}")
+            await run_db(self._tasks_call, "release_lease", task_id, worker_id)
+            return
+
+        task_info = {
+            "id": task_id,
+            "user_id": user_id,
+            "request_data": request_data,
+            "process_func": self.handler,
+            "status": "pending",
+            "attempt": task.get("attempts") or 1,
+            "lease_owner": worker_id
+        }
+        self.active_tasks[task_id] = task_info
+        self.running_by_user[user_id] = self.running_by_user.get(user_id, 0) + 1
+        job = asyncio.create_task(self._run_task(task_id, task_info))
+        heartbeat = asyncio.create_task(self._heartbeat(task_id, worker_id, job))
+        try:
+            await job
+        except asyncio.CancelledError:
+            if not job.cancelled() or not task_info.get("lease_lost"):
+                raise
+            print(f"[WARN] Task {task_id} cancelled on {worker_id}: lease lost")
+        finally:
+            heartbeat.cancel()
+            self._release_user_slot(user_id)
+            try:
+                await run_db(self._tasks_call, "release_lease", task_id, worker_id)
+            except Exception as e:
+                print(f"[WARN] Could not release lease of task {task_id}: {e}")
+
+    async def _heartbeat(self, task_id: str, worker_id: str, job: asyncio.Task):
+        while True:
+            await asyncio.sleep(settings.TASK_HEARTBEAT_SECONDS)
+            try:
+                renewed = await run_db(self._tasks_call, "renew_lease", task_id, worker_id, settings.TASK_LEASE_SECONDS)
+            except Exception as e:
+                print(f"[WARN] Heartbeat failed for task {task_id}: {e}")
+                continue
+            if not renewed:
+                task = await run_db(self._tasks_call, "get_task", task_id)
+                if task and task.get("status") != "processing" and task.get("lease_owner") == worker_id:
+                    # Task vừa xong (completed/failed), chỉ còn chờ release_lease
+                    return
+                # Lease đã hết hạn và (có thể) bị worker khác claim: dừng job để không sinh ảnh/trừ token lần nữa
+                print(f"[WARN] Lease of task {task_id} is no longer held by {worker_id}, cancelling job")
+                self.active_tasks.get(task_id, {})["lease_lost"] = True
+                job.cancel()
+                return
+
+    def _tasks_call(self, method: str, *args):
+        tm = TasksManager()
+        try:
+            return getattr(tm, method)(*args)
+        finally:
+            tm.close()
+
+    async def _run_task(self, task_id: str, task_info: dict):
+        task_info["status"] = "processing"
+        self.wait_seconds += time.monotonic() - task_info.get("enqueued_at", time.monotonic())
+        self.busy_workers += 1
+        started = time.monotonic()
+        try:
+            # Call the processing function
+            await task_info["process_func"](task_id, task_info["user_id"], task_info["request_data"])
+        except LeaseLostError as e:
+            # Worker khác đã tiếp quản task: không ghi trạng thái đè lên
+            print(f"[WARN] {e}")
+        except Exception as e:
+            import traceback
+            self.failed_count += 1
+            print(f"[ERROR] Error in RAM worker for task {task_id}: {e}")
+            traceback.print_exc()
+            # CRITICAL: Update DB to 'failed' so frontend stops polling!
+            try:
+                await run_db(self._tasks_call, "update_task", task_id, "failed", None, f"Worker error: {str(e)}", task_info.get("lease_owner"))
+            except Exception as db_err:
+                print(f"Could not update failed task in DB: {db_err}")
+            self.publish(task_id, "status", status="failed", error=f"Worker error: {str(e)}")
+        finally:
+            self.busy_workers -= 1
+            self.busy_seconds += time.monotonic() - started
+            self.processed_count += 1
+            if task_id in self.active_tasks:
+                del self.active_tasks[task_id]
+
+    def _release_user_slot(self, user_id: int):
+        """Giải phóng slot của user và đưa task bị hoãn kế tiếp (nếu có) trở lại hàng đợi."""
+        remaining = self.running_by_user.get(user_id, 1) - 1
+        if remaining > 0:
+            self.running_by_user[user_id] = remaining
+        else:
+            self.running_by_user.pop(user_id, None)
+
+        pending = self.deferred.get(user_id)
+        if pending:
+            self.queue.put_nowait(pending.popleft())
+            if not pending:
+                del self.deferred[user_id]
+
     async def get_active_tasks(self):
         return self.active_tasks
 
+    def get_stats(self) -> dict:
+        """Số liệu hàng đợi và mức sử dụng worker để định cỡ pool."""
+        deferred_count = sum(len(q) for q in self.deferred.values())
+        uptime = time.monotonic() - self.started_at if self.started_at else 0.0
+        capacity = uptime * self.num_workers
+        started_count = self.processed_count + self.busy_workers
+        return {
+            "backend": self.backend,
+            "instance_id": self.instance_id,
+            "workers": self.num_workers,
+            "max_concurrency": self.max_concurrency,
+            "max_per_user": self.max_per_user,
+            "queue_depth": self.queue.qsize() + deferred_count,
+            "deferred": deferred_count,
+            "busy_workers": self.busy_workers,
+            "running_users": len(self.running_by_user),
+            "processed": self.processed_count,
+            "failed": self.failed_count,
+            "utilization": round(self.busy_seconds / capacity, 4) if capacity else 0.0,
+            "avg_queue_wait_seconds": round(self.wait_seconds / started_count, 3) if started_count else 0.0,
+            "uptime_seconds": round(uptime, 1),
+            "stream_subscribers": task_event_bus.subscriber_count()
+        }
+
 # Singleton instance
 ram_task_manager = TaskManagerRAM()
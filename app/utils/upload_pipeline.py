@@ -0,0 +1,140 @@
+import asyncio
+import os
+import random
+import time
+from typing import List, Optional
+from app.config import settings
+from app.models.banner_db import BannerHistoryManager, ConfigManager
+from app.utils.async_db import AsyncManager
+from app.utils.cloudinary_utils import upload_to_cloudinary, is_cloudinary_configured
+
+
+class UploadPipeline:
+    """
+    Upload ảnh banner lên Cloudinary ở chế độ nền.
+
+    Task sinh ảnh lưu banner với URL local (/generate/view/...) và trả về ngay;
+    pipeline upload với số worker giới hạn, thử lại theo exponential backoff,
+    rồi đổi banner_history.image_url sang URL CDN khi upload xong.
+    Hàng đợi chỉ giữ đường dẫn file (ảnh được đọc lúc upload) nên không giữ bytes ảnh trong RAM.
+    """
+    RESUME_LEASE = "__upload_resume_lease__"
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(UploadPipeline, cls).__new__(cls)
+            cls._instance.queue = asyncio.Queue()
+            cls._instance.worker_tasks: List[asyncio.Task] = []
+            cls._instance.num_workers = max(1, settings.UPLOAD_WORKERS)
+            cls._instance.pending_ids = set()
+            cls._instance.uploaded_count = 0
+            cls._instance.failed_count = 0
+            cls._instance.retry_count = 0
+            cls._instance.upload_seconds = 0.0
+        return cls._instance
+
+    @property
+    def enabled(self) -> bool:
+        return is_cloudinary_configured()
+
+    async def start(self):
+        if self.worker_tasks or not self.enabled:
+            if not self.enabled:
+                print("[WARN] Cloudinary not configured, banners stay on local URLs")
+            return
+        for index in range(self.num_workers):
+            self.worker_tasks.append(asyncio.create_task(self._worker_loop(index)))
+        print(f"[START] Upload pipeline started ({self.num_workers} workers).")
+
+    def enqueue(self, file_path: str, history_id: int, local_url: str, folder: str = "banners") -> bool:
+        """Đưa một ảnh đã lưu local vào hàng đợi upload. Trả về False nếu không cần upload."""
+        if not self.enabled or not history_id or history_id in self.pending_ids:
+            return False
+        self.pending_ids.add(history_id)
+        self.queue.put_nowait({
+            "file_path": file_path,
+            "history_id": history_id,
+            "local_url": local_url,
+            "folder": folder
+        })
+        return True
+
+    async def resume_pending(self, banners_dir: str, owner: str) -> int:
+        """
+        Đưa lại vào hàng đợi các banner còn URL local từ lần chạy trước (file local vẫn còn).
+        Mọi worker uvicorn đều gọi lúc startup: chỉ process giành được lease trong DB mới quét,
+        để cùng một banner không bị upload nhiều lần.
+        """
+        if not self.enabled:
+            return 0
+        acquired = await AsyncManager(ConfigManager).try_acquire_lease(self.RESUME_LEASE, owner, settings.UPLOAD_RESUME_LEASE_SECONDS)
+        if not acquired:
+            print("[OK] Upload pipeline: pending uploads are resumed by another process")
+            return 0
+        rows = await AsyncManager(BannerHistoryManager).get_pending_uploads()
+        count = 0
+        for row in rows:
+            file_path = os.path.join(banners_dir, row["image_url"].split("/")[-1])
+            if os.path.exists(file_path) and self.enqueue(file_path, row["id"], row["image_url"]):
+                count += 1
+        if count:
+            print(f"[OK] Upload pipeline: resumed {count} pending uploads")
+        return count
+
+    async def _worker_loop(self, worker_index: int):
+        while True:
+            job = await self.queue.get()
+            try:
+                await self._process(job)
+            except Exception as e:
+                self.failed_count += 1
+                print(f"[ERROR] Upload worker {worker_index} error: {e}")
+            finally:
+                self.pending_ids.discard(job["history_id"])
+                self.queue.task_done()
+
+    async def _process(self, job: dict):
+        cloud_url = await self._upload_with_retry(job["file_path"], job["folder"])
+        if not cloud_url:
+            self.failed_count += 1
+            print(f"[WARN] Upload failed after {settings.UPLOAD_MAX_ATTEMPTS} attempts, "
+                  f"banner {job['history_id']} keeps local URL")
+            return
+
+        updated = await AsyncManager(BannerHistoryManager).update_image_url(job["history_id"], job["local_url"], cloud_url)
+        if updated:
+            self.uploaded_count += 1
+        else:
+            # Banner đã bị xóa hoặc URL đã được đổi bởi nơi khác
+            print(f"[WARN] Banner {job['history_id']} not updated with CDN URL (deleted or already swapped)")
+
+    async def _upload_with_retry(self, file_path: str, folder: str) -> Optional[str]:
+        for attempt in range(1, settings.UPLOAD_MAX_ATTEMPTS + 1):
+            if not os.path.exists(file_path):
+                return None
+            started = time.monotonic()
+            cloud_url = await asyncio.to_thread(upload_to_cloudinary, file_path, folder=folder)
+            self.upload_seconds += time.monotonic() - started
+            if cloud_url:
+                return cloud_url
+            if attempt < settings.UPLOAD_MAX_ATTEMPTS:
+                self.retry_count += 1
+                delay = settings.UPLOAD_BACKOFF_BASE * (2 ** (attempt - 1))
+                await asyncio.sleep(min(delay, settings.UPLOAD_BACKOFF_MAX) * random.uniform(0.8, 1.2))
+        return None
+
+    def get_stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "workers": len(self.worker_tasks),
+            "queue_depth": self.queue.qsize(),
+            "in_flight": len(self.pending_ids) - self.queue.qsize(),
+            "uploaded": self.uploaded_count,
+            "failed": self.failed_count,
+            "retries": self.retry_count,
+            "avg_upload_seconds": round(self.upload_seconds / max(1, self.uploaded_count + self.failed_count), 3)
+        }
+
+# Singleton instance
+upload_pipeline = UploadPipeline()
@@ -0,0 +1,45 @@
+import threading
+from typing import Optional
+from cachetools import TTLCache
+from app.config import settings
+
+# Cache user theo id cho get_current_user: các request polling (/generate/tasks/...)
+# không còn phải SELECT bảng users ở mỗi lần gọi.
+# TTLCache không thread-safe, mà các manager chạy trong executor DB nên cần lock.
+_cache = TTLCache(maxsize=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL)
+_lock = threading.Lock()
+
+
+def get_cached_user(user_id) -> Optional[dict]:
+    with _lock:
+        user = _cache.get(str(user_id))
+    # Trả bản sao để caller sửa dict (vd. is_admin) không làm bẩn cache
+    return dict(user) if user is not None else None
+
+
+def set_cached_user(user: dict):
+    if settings.USER_CACHE_TTL <= 0:
+        return
+    with _lock:
+        _cache[str(user["id"])] = dict(user)
+
+
+def invalidate_user(user_id):
+    with _lock:
+        _cache.pop(str(user_id), None)
+
+
+def invalidate_user_email(email: str):
+    """Xóa user khỏi cache theo email (set_admin/remove_admin cập nhật theo email)."""
+    if not email:
+        return
+    email = email.lower()
+    with _lock:
+        stale = [key for key, user in _cache.items() if (user.get("email") or "").lower() == email]
+        for key in stale:
+            _cache.pop(key, None)
+
+
+def clear_user_cache():
+    with _lock:
+        _cache.clear()
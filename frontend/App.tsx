@@ -90,9 +90,10 @@ const AppContent: React.FC = () => {
     }
   }, []);
 
-  // Global Task Polling
+  // Global Task Tracking (SSE, quay về polling nếu stream không dùng được)
   useEffect(() => {
     let intervalId: any;
+    let closeStream: (() => void) | null = null;
     
     // Listen for storage changes in other tabs
     const handleStorageChange = () => {
@@ -103,28 +104,38 @@ const AppContent: React.FC = () => {
     };
     window.addEventListener('storage', handleStorageChange);
 
-    if (activeTaskId) {
+    const handleTask = (task: any) => {
+      if (task.status === 'completed') {
+        localStorage.removeItem('current_banner_task_id');
+        setActiveTaskId(null);
+        toast.success("Tạo banner thành công! Kiểm tra trong lịch sử.", { duration: 5000 });
+        fetchUser(); // Refresh tokens
+      } else if (task.status === 'failed') {
+        localStorage.removeItem('current_banner_task_id');
+        setActiveTaskId(null);
+        toast.error(task.error || "Tạo banner thất bại");
+      }
+    };
+
+    const startPolling = () => {
       intervalId = setInterval(async () => {
         try {
-          const task = await apiService.getTaskStatus(activeTaskId);
-          
-          if (task.status === 'completed') {
-            localStorage.removeItem('current_banner_task_id');
-            setActiveTaskId(null);
-            toast.success("Tạo banner thành công! Kiểm tra trong lịch sử.", { duration: 5000 });
-            fetchUser(); // Refresh tokens
-          } else if (task.status === 'failed') {
-            localStorage.removeItem('current_banner_task_id');
-            setActiveTaskId(null);
-            toast.error(task.error || "Tạo banner thất bại");
-          }
+          handleTask(await apiService.getTaskStatus(activeTaskId!));
         } catch (err) {
           console.error("Global polling error", err);
         }
       }, 3000);
+    };
+
+    if (activeTaskId) {
+      closeStream = apiService.subscribeTaskEvents(activeTaskId, {
+        onStatus: handleTask,
+        onError: startPolling
+      });
     }
 
     return () => {
+      if (closeStream) closeStream();
       if (intervalId) clearInterval(intervalId);
       window.removeEventListener('storage', handleStorageChange);
     };
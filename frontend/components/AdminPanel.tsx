@@ -63,6 +63,7 @@ interface AdminBanner {
   aspect_ratio: string;
   resolution: string;
   image_url: string;
+  thumbnail_url?: string;
   token_cost: number;
   created_at: string;
   prompt_used?: string;
@@ -176,6 +177,8 @@ const AdminPanel: React.FC<AdminPanelProps> = ({ currentUser, onNavigate }) => {
   const [users, setUsers] = useState<AdminUser[]>([]);
   const [payments, setPayments] = useState<AdminPayment[]>([]);
   const [banners, setBanners] = useState<AdminBanner[]>([]);
+  // Cursor trang kế tiếp của các danh sách admin (null = đã tải hết)
+  const [nextCursors, setNextCursors] = useState<{ users: string | null; payments: string | null; banners: string | null }>({ users: null, payments: null, banners: null });
   const [packages, setPackages] = useState<Package[]>([]);
   const [bannerCost, setBannerCost] = useState<number>(1);
   const [referenceImageCost, setReferenceImageCost] = useState<number>(0.5);
@@ -412,6 +415,25 @@ const AdminPanel: React.FC<AdminPanelProps> = ({ currentUser, onNavigate }) => {
     }
   }, [activeTab]);
 
+  // Tìm kiếm chạy trên server để tìm được cả các trang chưa tải (chờ người dùng gõ xong)
+  const isFirstSearch = React.useRef(true);
+  useEffect(() => {
+    if (isFirstSearch.current) {
+      isFirstSearch.current = false;
+      return;
+    }
+    const timer = setTimeout(() => {
+      if (activeTab === 'users') {
+        fetchUsers();
+      } else if (activeTab === 'payments') {
+        fetchPayments();
+      } else if (activeTab === 'banners') {
+        fetchBanners();
+      }
+    }, 300);
+    return () => clearTimeout(timer);
+  }, [searchTerm]);
+
   const fetchSettings = async () => {
     try {
       const data = await apiService.getConfig();
@@ -492,60 +514,93 @@ const AdminPanel: React.FC<AdminPanelProps> = ({ currentUser, onNavigate }) => {
 
   // ... existing code ...
 
-  const fetchUsers = async () => {
+  // Query cho các danh sách admin: cursor trang kế tiếp + từ khóa tìm kiếm (lọc trên server)
+  const listQuery = (cursor?: string | null) => {
+    const params = new URLSearchParams();
+    if (cursor) params.set('cursor', cursor);
+    if (searchTerm.trim()) params.set('q', searchTerm.trim());
+    const query = params.toString();
+    return query ? `?${query}` : '';
+  };
+
+  const fetchUsers = async (cursor?: string | null) => {
     setIsLoading(true);
     try {
-      const response = await fetch(`${__API_URL__}/admin/users`, {
+      const response = await fetch(`${__API_URL__}/admin/users${listQuery(cursor)}`, {
         headers: {
           'Authorization': `Bearer ${localStorage.getItem(__TOKEN_KEY__)}`
         }
       });
       const data = await response.json();
-      setUsers(Array.isArray(data) ? data : []);
+      const items = Array.isArray(data) ? data : [];
+      setUsers(prev => cursor ? [...prev, ...items] : items);
+      setNextCursors(prev => ({ ...prev, users: response.headers.get('X-Next-Cursor') }));
     } catch (error) {
       console.error('Error fetching users:', error);
-      setUsers([]);
+      if (!cursor) setUsers([]);
     } finally {
       setIsLoading(false);
     }
   };
 
-  const fetchPayments = async () => {
+  const fetchPayments = async (cursor?: string | null) => {
     setIsLoading(true);
     try {
-      const response = await fetch(`${__API_URL__}/admin/payments`, {
+      const response = await fetch(`${__API_URL__}/admin/payments${listQuery(cursor)}`, {
         headers: {
           'Authorization': `Bearer ${localStorage.getItem(__TOKEN_KEY__)}`
         }
       });
       const data = await response.json();
-      setPayments(Array.isArray(data) ? data : []);
+      const items = Array.isArray(data) ? data : [];
+      setPayments(prev => cursor ? [...prev, ...items] : items);
+      setNextCursors(prev => ({ ...prev, payments: response.headers.get('X-Next-Cursor') }));
     } catch (error) {
       console.error('Error fetching payments:', error);
-      setPayments([]);
+      if (!cursor) setPayments([]);
     } finally {
       setIsLoading(false);
     }
   };
 
-  const fetchBanners = async () => {
+  const fetchBanners = async (cursor?: string | null) => {
     setIsLoading(true);
     try {
-      const response = await fetch(`${__API_URL__}/admin/banners`, {
+      const response = await fetch(`${__API_URL__}/admin/banners${listQuery(cursor)}`, {
         headers: {
           'Authorization': `Bearer ${localStorage.getItem(__TOKEN_KEY__)}`
         }
       });
       const data = await response.json();
-      setBanners(Array.isArray(data) ? data : []);
+      const items = Array.isArray(data) ? data : [];
+      setBanners(prev => cursor ? [...prev, ...items] : items);
+      setNextCursors(prev => ({ ...prev, banners: response.headers.get('X-Next-Cursor') }));
     } catch (error) {
       console.error('Error fetching banners:', error);
-      setBanners([]);
+      if (!cursor) setBanners([]);
     } finally {
       setIsLoading(false);
     }
   };
 
+  // Danh sách banner không kèm prompt_used: mở chi tiết thì tải bản đầy đủ
+  const openBannerDetail = async (banner: AdminBanner) => {
+    setSelectedBannerDetail(banner);
+    if (banner.prompt_used) return;
+    try {
+      const response = await fetch(`${__API_URL__}/admin/banners/${banner.id}`, {
+        headers: {
+          'Authorization': `Bearer ${localStorage.getItem(__TOKEN_KEY__)}`
+        }
+      });
+      if (!response.ok) return;
+      const detail = await response.json();
+      setSelectedBannerDetail(prev => (prev && prev.id === detail.id ? { ...prev, ...detail } : prev));
+    } catch (error) {
+      console.error('Error fetching banner detail:', error);
+    }
+  };
+
   const fetchStats = async () => {
     setIsLoading(true);
     try {
@@ -724,21 +779,8 @@ const AdminPanel: React.FC<AdminPanelProps> = ({ currentUser, onNavigate }) => {
     return new Date(dateString).toLocaleString('vi-VN');
   };
 
-  const filteredUsers = users.filter(user => 
-    (user.email || '').toLowerCase().includes(searchTerm.toLowerCase()) ||
-    (user.full_name || '').toLowerCase().includes(searchTerm.toLowerCase())
-  );
-
-  const filteredPayments = payments.filter(payment =>
-    (payment.package_name || 'Gói đã xóa').toLowerCase().includes(searchTerm.toLowerCase())
-  );
-
-  const filteredBanners = banners.filter(banner =>
-    (banner.request_description || '').toLowerCase().includes(searchTerm.toLowerCase())
-  );
-
-  const totalBannerPages = Math.ceil(filteredBanners.length / bannersPerPage);
-  const paginatedBanners = filteredBanners.slice(
+  const totalBannerPages = Math.ceil(banners.length / bannersPerPage);
+  const paginatedBanners = banners.slice(
     (currentBannerPage - 1) * bannersPerPage,
     currentBannerPage * bannersPerPage
   );
@@ -975,7 +1017,7 @@ const AdminPanel: React.FC<AdminPanelProps> = ({ currentUser, onNavigate }) => {
                             </tr>
                           </thead>
                           <tbody>
-                            {filteredUsers.map((user) => (
+                            {users.map((user) => (
                               <tr key={user.id} className="border-b border-slate-100 hover:bg-slate-50 transition-colors">
                                 <td className="py-4 px-4 text-slate-400 text-xs font-mono cursor-pointer hover:text-indigo-600" onClick={() => setSelectedUserDetail(user)}>#{user.id}</td>
                                 <td className="py-4 px-4 cursor-pointer" onClick={() => setSelectedUserDetail(user)}>
@@ -1017,7 +1059,7 @@ const AdminPanel: React.FC<AdminPanelProps> = ({ currentUser, onNavigate }) => {
 
                       {/* Mobile Card List */}
                       <div className="md:hidden space-y-3">
-                        {filteredUsers.map((user) => (
+                        {users.map((user) => (
                           <div key={user.id} className="bg-white p-4 rounded-xl border border-slate-200 space-y-3">
                             <div className="flex justify-between items-start">
                               <div>
@@ -1044,9 +1086,21 @@ const AdminPanel: React.FC<AdminPanelProps> = ({ currentUser, onNavigate }) => {
                         ))}
                       </div>
 
-                      {filteredUsers.length === 0 && (
+                      {users.length === 0 && (
                         <div className="text-center py-12 text-slate-500">Không tìm thấy người dùng</div>
                       )}
+
+                      {nextCursors.users && (
+                        <div className="flex justify-center">
+                          <button
+                            onClick={() => fetchUsers(nextCursors.users)}
+                            disabled={isLoading}
+                            className="px-6 py-2 rounded-lg text-sm font-medium bg-white border border-slate-200 text-slate-700 hover:bg-slate-50 transition-colors disabled:opacity-60"
+                          >
+                            {isLoading ? 'Đang tải...' : 'Tải thêm'}
+                          </button>
+                        </div>
+                      )}
                     </div>
                   )}
 
@@ -1067,7 +1121,7 @@ const AdminPanel: React.FC<AdminPanelProps> = ({ currentUser, onNavigate }) => {
                             </tr>
                           </thead>
                           <tbody>
-                            {filteredPayments.map((payment) => (
+                            {payments.map((payment) => (
                               <tr key={payment.id} className="border-b border-slate-100 hover:bg-slate-50 transition-colors">
                                 <td className="py-4 px-4 text-slate-400 text-xs font-mono cursor-pointer hover:text-indigo-600" onClick={() => setSelectedPaymentDetail(payment)}>#{payment.id}</td>
                                 <td className="py-4 px-4 text-slate-600 text-xs font-medium cursor-pointer hover:text-indigo-600" onClick={() => setSelectedPaymentDetail(payment)}>#{payment.user_id}</td>
@@ -1088,7 +1142,7 @@ const AdminPanel: React.FC<AdminPanelProps> = ({ currentUser, onNavigate }) => {
 
                       {/* Mobile Payment List */}
                       <div className="md:hidden space-y-3">
-                        {filteredPayments.map((payment) => (
+                        {payments.map((payment) => (
                           <div key={payment.id} className="bg-white p-4 rounded-xl border border-slate-200 space-y-3">
                             <div className="flex justify-between items-start">
                               <p className="font-bold text-slate-800">{payment.package_name}</p>
@@ -1108,9 +1162,21 @@ const AdminPanel: React.FC<AdminPanelProps> = ({ currentUser, onNavigate }) => {
                         ))}
                       </div>
 
-                      {filteredPayments.length === 0 && (
+                      {payments.length === 0 && (
                         <div className="text-center py-12 text-slate-500">Không tìm thấy thanh toán</div>
                       )}
+
+                      {nextCursors.payments && (
+                        <div className="flex justify-center">
+                          <button
+                            onClick={() => fetchPayments(nextCursors.payments)}
+                            disabled={isLoading}
+                            className="px-6 py-2 rounded-lg text-sm font-medium bg-white border border-slate-200 text-slate-700 hover:bg-slate-50 transition-colors disabled:opacity-60"
+                          >
+                            {isLoading ? 'Đang tải...' : 'Tải thêm'}
+                          </button>
+                        </div>
+                      )}
                     </div>
                   )}
 
@@ -1134,17 +1200,17 @@ const AdminPanel: React.FC<AdminPanelProps> = ({ currentUser, onNavigate }) => {
                           <tbody>
                             {paginatedBanners.map((banner) => (
                               <tr key={banner.id} className={`border-b border-slate-100 transition-colors ${banner.is_hidden ? 'opacity-60 bg-slate-50' : 'hover:bg-slate-50'}`}>
-                                <td className="py-4 px-4 text-xs font-mono text-slate-400 cursor-pointer hover:text-indigo-600" onClick={() => setSelectedBannerDetail(banner)}>#{banner.id}</td>
-                                <td className="py-2 px-4 cursor-pointer" onClick={() => setSelectedBannerDetail(banner)}>
+                                <td className="py-4 px-4 text-xs font-mono text-slate-400 cursor-pointer hover:text-indigo-600" onClick={() => openBannerDetail(banner)}>#{banner.id}</td>
+                                <td className="py-2 px-4 cursor-pointer" onClick={() => openBannerDetail(banner)}>
                                   <div className="h-10 w-16 md:h-12 md:w-20 rounded shadow-sm border border-slate-200 overflow-hidden relative group mx-auto">
-                                    <img src={banner.image_url} alt="Preview" className="h-full w-full object-cover transition-transform group-hover:scale-110" loading="lazy" />
+                                    <img src={banner.thumbnail_url || banner.image_url} alt="Preview" className="h-full w-full object-cover transition-transform group-hover:scale-110" loading="lazy" />
                                     <div className="absolute inset-0 bg-black/0 group-hover:bg-black/10 transition-colors flex items-center justify-center">
                                       <Maximize2 className="h-3 w-3 text-white opacity-0 group-hover:opacity-100 transition-opacity" />
                                     </div>
                                   </div>
                                 </td>
-                                <td className="py-4 px-4 text-xs font-bold text-slate-700 cursor-pointer hover:text-indigo-600" onClick={() => setSelectedBannerDetail(banner)}>#{banner.user_id}</td>
-                                <td className="py-4 px-4 text-sm text-slate-700 max-w-xs truncate cursor-pointer hover:text-indigo-600" title={banner.request_description} onClick={() => setSelectedBannerDetail(banner)}>{banner.request_description}</td>
+                                <td className="py-4 px-4 text-xs font-bold text-slate-700 cursor-pointer hover:text-indigo-600" onClick={() => openBannerDetail(banner)}>#{banner.user_id}</td>
+                                <td className="py-4 px-4 text-sm text-slate-700 max-w-xs truncate cursor-pointer hover:text-indigo-600" title={banner.request_description} onClick={() => openBannerDetail(banner)}>{banner.request_description}</td>
                                 <td className="py-4 px-4 text-xs text-slate-500">{banner.aspect_ratio} • {banner.resolution}</td>
                                 <td className="py-4 px-4"><span className="px-2 py-0.5 bg-orange-50 text-orange-700 rounded-full text-xs font-bold">{banner.token_cost} tok</span></td>
                                 <td className="py-4 px-4 text-xs text-slate-400">{formatDate(banner.created_at)}</td>
@@ -1176,7 +1242,7 @@ const AdminPanel: React.FC<AdminPanelProps> = ({ currentUser, onNavigate }) => {
                          {paginatedBanners.map((banner) => (
                            <div key={banner.id} className="bg-white p-4 rounded-xl border border-slate-200 space-y-3 shadow-sm hover:shadow-md transition-shadow">
                              <div className="flex gap-3">
-                               <div className="h-16 w-24 rounded border border-slate-200 overflow-hidden flex-shrink-0 cursor-pointer relative group" onClick={() => setSelectedBannerDetail(banner)}>
+                               <div className="h-16 w-24 rounded border border-slate-200 overflow-hidden flex-shrink-0 cursor-pointer relative group" onClick={() => openBannerDetail(banner)}>
                                  <img src={banner.image_url} alt="Banner" className="h-full w-full object-cover" loading="lazy" />
                                  <div className="absolute inset-0 bg-black/5 flex items-center justify-center group-active:bg-black/20 transition-colors">
                                    <Maximize2 className="h-4 w-4 text-white opacity-0 group-active:opacity-100" />
@@ -1220,7 +1286,7 @@ const AdminPanel: React.FC<AdminPanelProps> = ({ currentUser, onNavigate }) => {
                           <div className="hidden sm:flex sm:flex-1 sm:items-center sm:justify-between">
                             <div>
                               <p className="text-sm text-slate-700">
-                                Hiển thị <span className="font-medium">{(currentBannerPage - 1) * bannersPerPage + 1}</span> đến <span className="font-medium">{Math.min(currentBannerPage * bannersPerPage, filteredBanners.length)}</span> trong tổng số <span className="font-medium">{filteredBanners.length}</span> banner
+                                Hiển thị <span className="font-medium">{(currentBannerPage - 1) * bannersPerPage + 1}</span> đến <span className="font-medium">{Math.min(currentBannerPage * bannersPerPage, banners.length)}</span> trong tổng số <span className="font-medium">{banners.length}</span> banner
                               </p>
                             </div>
                             <div>
@@ -1283,9 +1349,21 @@ const AdminPanel: React.FC<AdminPanelProps> = ({ currentUser, onNavigate }) => {
                         </div>
                       )}
 
-                      {filteredBanners.length === 0 && (
+                      {banners.length === 0 && (
                         <div className="text-center py-12 text-slate-500">Không tìm thấy banner</div>
                       )}
+
+                      {nextCursors.banners && (
+                        <div className="flex justify-center">
+                          <button
+                            onClick={() => fetchBanners(nextCursors.banners)}
+                            disabled={isLoading}
+                            className="px-6 py-2 rounded-lg text-sm font-medium bg-white border border-slate-200 text-slate-700 hover:bg-slate-50 transition-colors disabled:opacity-60"
+                          >
+                            {isLoading ? 'Đang tải...' : 'Tải thêm'}
+                          </button>
+                        </div>
+                      )}
                     </div>
                   )}
 
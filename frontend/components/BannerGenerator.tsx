@@ -141,13 +141,33 @@ const BannerGenerator: React.FC<BannerGeneratorProps> = ({ user, refreshUser })
     };
   }, []);
 
-  // Polling effect
+  // Theo dõi tiến trình task: stream SSE, quay về polling nếu stream không dùng được
   useEffect(() => {
     let intervalId: any;
+    let closeStream: (() => void) | null = null;
     let pollCount = 0;
     const MAX_POLLS = 150; // 150 × 2s = 5 phút timeout
 
-    if (currentTaskId) {
+    const handleTask = (task: any) => {
+      if (task.status === 'completed') {
+        setResults(task.result || []);
+        setIsLoading(false);
+        setCurrentTaskId(null);
+        localStorage.removeItem('current_banner_task_id');
+        refreshUser();
+      } else if (task.status === 'failed') {
+        setError(task.error || "Tạo banner thất bại");
+        setIsLoading(false);
+        setCurrentTaskId(null);
+        localStorage.removeItem('current_banner_task_id');
+      } else if (task.status === 'processing') {
+        if (task.result && task.result.length > 0) {
+          setResults(task.result);
+        }
+      }
+    };
+
+    const startPolling = () => {
       intervalId = setInterval(async () => {
         pollCount++;
 
@@ -162,31 +182,24 @@ const BannerGenerator: React.FC<BannerGeneratorProps> = ({ user, refreshUser })
         }
 
         try {
-          const task = await apiService.getTaskStatus(currentTaskId);
-          
-          if (task.status === 'completed') {
-            setResults(task.result || []);
-            setIsLoading(false);
-            setCurrentTaskId(null);
-            localStorage.removeItem('current_banner_task_id');
-            refreshUser();
-          } else if (task.status === 'failed') {
-            setError(task.error || "Tạo banner thất bại");
-            setIsLoading(false);
-            setCurrentTaskId(null);
-            localStorage.removeItem('current_banner_task_id');
-          } else if (task.status === 'processing') {
-            if (task.result && task.result.length > 0) {
-              setResults(task.result);
-            }
-          }
+          handleTask(await apiService.getTaskStatus(currentTaskId!));
         } catch (err) {
           console.error("Polling error", err);
         }
       }, 2000);
+    };
+
+    if (currentTaskId) {
+      closeStream = apiService.subscribeTaskEvents(currentTaskId, {
+        onStatus: handleTask,
+        // Hiện từng ảnh ngay khi được sinh xong
+        onImage: (url) => setResults((prev: string[]) => (prev.includes(url) ? prev : [...prev, url])),
+        onError: startPolling
+      });
     }
 
     return () => {
+      if (closeStream) closeStream();
       if (intervalId) clearInterval(intervalId);
     };
   }, [currentTaskId, refreshUser]);
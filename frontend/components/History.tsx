@@ -38,6 +38,9 @@ const History: React.FC<HistoryProps> = ({ user, onNavigate }) => {
   
   // Modal state
   const [selectedBanner, setSelectedBanner] = useState<BannerHistoryItem | null>(null);
+  const [historyCursor, setHistoryCursor] = useState<string | null>(null);
+  const [isLoadingMore, setIsLoadingMore] = useState(false);
+  const [paymentCursor, setPaymentCursor] = useState<string | null>(null);
 
   // Confirmation modal state
   const [confirmConfig, setConfirmConfig] = useState<{
@@ -60,11 +63,13 @@ const History: React.FC<HistoryProps> = ({ user, onNavigate }) => {
     setIsLoading(true);
     try {
       if (activeTab === 'banners') {
-        const data = await apiService.getHistory();
-        setBannerHistory(Array.isArray(data) ? data : []);
+        const { items, nextCursor } = await apiService.getHistory();
+        setBannerHistory(Array.isArray(items) ? items : []);
+        setHistoryCursor(nextCursor);
       } else {
-        const data = await apiService.getPaymentHistory();
-        setPaymentHistory(Array.isArray(data) ? data : []);
+        const { items, nextCursor } = await apiService.getPaymentHistory();
+        setPaymentHistory(Array.isArray(items) ? items : []);
+        setPaymentCursor(nextCursor);
       }
     } catch (error) {
       console.error('Error fetching history:', error);
@@ -73,6 +78,46 @@ const History: React.FC<HistoryProps> = ({ user, onNavigate }) => {
     }
   };
 
+  const loadMoreBanners = async () => {
+    if (!historyCursor) return;
+    setIsLoadingMore(true);
+    try {
+      const { items, nextCursor } = await apiService.getHistory(historyCursor);
+      setBannerHistory(prev => [...prev, ...(Array.isArray(items) ? items : [])]);
+      setHistoryCursor(nextCursor);
+    } catch (error) {
+      console.error('Error fetching history:', error);
+    } finally {
+      setIsLoadingMore(false);
+    }
+  };
+
+  const loadMorePayments = async () => {
+    if (!paymentCursor) return;
+    setIsLoadingMore(true);
+    try {
+      const { items, nextCursor } = await apiService.getPaymentHistory(paymentCursor);
+      setPaymentHistory(prev => [...prev, ...(Array.isArray(items) ? items : [])]);
+      setPaymentCursor(nextCursor);
+    } catch (error) {
+      console.error('Error fetching history:', error);
+    } finally {
+      setIsLoadingMore(false);
+    }
+  };
+
+  // Danh sách không kèm prompt_used: mở chi tiết thì tải thêm bản đầy đủ
+  const openBannerDetail = async (item: BannerHistoryItem) => {
+    setSelectedBanner(item);
+    if (item.prompt_used) return;
+    try {
+      const detail = await apiService.getHistoryItem(item.id);
+      setSelectedBanner(prev => (prev && prev.id === detail.id ? { ...prev, ...detail } : prev));
+    } catch (error) {
+      console.error('Error fetching banner detail:', error);
+    }
+  };
+
   const handleDeleteBanner = (id: number, e: React.MouseEvent) => {
     e.stopPropagation();
     setConfirmConfig({
@@ -253,11 +298,13 @@ const History: React.FC<HistoryProps> = ({ user, onNavigate }) => {
                     <div 
                       key={item.id} 
                       className="bg-white rounded-xl overflow-hidden border border-slate-200 shadow-sm hover:shadow-md transition-all cursor-pointer group"
-                      onClick={() => setSelectedBanner(item)}
+                      onClick={() => openBannerDetail(item)}
                     >
                       <div className="aspect-video bg-slate-100 relative overflow-hidden">
                         <img 
                           src={item.image_url} 
+                          srcSet={item.srcset || undefined}
+                          sizes="(min-width: 1024px) 33vw, (min-width: 640px) 50vw, 100vw"
                           alt="Banner" 
                           className="w-full h-full object-cover transition-transform group-hover:scale-105"
                           loading="lazy"
@@ -339,6 +386,18 @@ const History: React.FC<HistoryProps> = ({ user, onNavigate }) => {
                   ))}
                 </div>
               )}
+
+              {historyCursor && (
+                <div className="flex justify-center">
+                  <button
+                    onClick={loadMoreBanners}
+                    disabled={isLoadingMore}
+                    className="px-6 py-2 rounded-lg text-sm font-medium bg-white border border-slate-200 text-slate-700 hover:bg-slate-50 transition-colors disabled:opacity-60"
+                  >
+                    {isLoadingMore ? 'Đang tải...' : 'Tải thêm'}
+                  </button>
+                </div>
+              )}
             </div>
           )}
 
@@ -436,6 +495,18 @@ const History: React.FC<HistoryProps> = ({ user, onNavigate }) => {
                       </div>
                     ))}
                   </div>
+
+                  {paymentCursor && (
+                    <div className="flex justify-center p-4 border-t border-slate-100">
+                      <button
+                        onClick={loadMorePayments}
+                        disabled={isLoadingMore}
+                        className="px-6 py-2 rounded-lg text-sm font-medium bg-white border border-slate-200 text-slate-700 hover:bg-slate-50 transition-colors disabled:opacity-60"
+                      >
+                        {isLoadingMore ? 'Đang tải...' : 'Tải thêm'}
+                      </button>
+                    </div>
+                  )}
                 </>
               )}
             </div>
@@ -558,7 +558,8 @@ const GalleryCard: React.FC<{ banner: PublicBannerItem; index: number }> = ({ ba
     }}>
       {!loaded && <div style={{ width: '100%', height: '240px', background: '#f5f3ff', animation: 'pulse 1.5s infinite' }} />}
       <img
-        src={banner.image_url} alt={banner.request_description || 'Banner'}
+        src={banner.image_url} srcSet={banner.srcset || undefined} sizes="(min-width: 1024px) 25vw, (min-width: 640px) 50vw, 100vw"
+        alt={banner.request_description || 'Banner'}
         style={{ width: '100%', maxHeight: '420px', objectFit: 'cover', display: loaded ? 'block' : 'none' }}
         onLoad={() => setLoaded(true)} onError={() => setError(true)}
       />
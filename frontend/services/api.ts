@@ -123,12 +123,14 @@ export const apiService = {
     return response.json();
   },
 
-  async getPaymentHistory(): Promise<PaymentHistoryItem[]> {
-    const response = await fetch(`${__API_URL__}/payment/history`, {
+  // Lịch sử thanh toán theo trang (cursor keyset); nextCursor = null khi đã hết dữ liệu
+  async getPaymentHistory(cursor?: string | null): Promise<{ items: PaymentHistoryItem[]; nextCursor: string | null }> {
+    const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+    const response = await fetch(`${__API_URL__}/payment/history${query}`, {
       headers: getAuthHeaders()
     });
     if (!response.ok) throw new Error('Failed to fetch payment history');
-    return response.json();
+    return { items: await response.json(), nextCursor: response.headers.get('X-Next-Cursor') };
   },
 
   async generateBanners(params: { width: number; height: number; number: number; user_request: string } | FormData): Promise<any> {
@@ -171,11 +173,75 @@ export const apiService = {
     return response.json();
   },
 
-  async getHistory(): Promise<any[]> {
-    const response = await fetch(`${__API_URL__}/generate/history`, {
+  // Nhận tiến trình task qua Server-Sent Events thay cho polling; trả về hàm đóng stream.
+  // onError chỉ được gọi khi stream không thể dùng được (vd. 401/404), để caller quay về polling.
+  subscribeTaskEvents(
+    taskId: string,
+    handlers: { onStatus: (task: any) => void; onImage?: (url: string, index: number) => void; onError?: () => void }
+  ): () => void {
+    let source: EventSource | null = null;
+    let closed = false;
+
+    // EventSource không gửi được header Authorization: xin token ngắn hạn chỉ mở được stream của task này,
+    // không đặt JWT đăng nhập lên URL (sẽ nằm trong log truy cập/proxy và lịch sử trình duyệt)
+    fetch(`${__API_URL__}/generate/tasks/${taskId}/stream-token`, {
+      method: 'POST',
+      headers: getAuthHeaders()
+    })
+      .then((response) => {
+        if (!response.ok) throw new Error('Failed to get stream token');
+        return response.json();
+      })
+      .then(({ token }) => {
+        if (closed) return;
+        const stream = new EventSource(`${__API_URL__}/generate/tasks/${taskId}/events?token=${encodeURIComponent(token)}`);
+        source = stream;
+
+        stream.addEventListener('status', (e) => {
+          const task = JSON.parse((e as MessageEvent).data);
+          handlers.onStatus(task);
+          if (task.status === 'completed' || task.status === 'failed') {
+            stream.close();
+          }
+        });
+        stream.addEventListener('image', (e) => {
+          const data = JSON.parse((e as MessageEvent).data);
+          handlers.onImage?.(data.url, data.index);
+        });
+        stream.onerror = () => {
+          // Lỗi mạng tạm thời: EventSource tự kết nối lại; CLOSED nghĩa là server từ chối stream
+          // (vd. token đã hết hạn khi kết nối lại) -> caller chuyển sang polling
+          if (stream.readyState === EventSource.CLOSED) {
+            handlers.onError?.();
+          }
+        };
+      })
+      .catch(() => {
+        if (!closed) handlers.onError?.();
+      });
+
+    return () => {
+      closed = true;
+      source?.close();
+    };
+  },
+
+  // Lịch sử banner theo trang (cursor keyset); nextCursor = null khi đã hết dữ liệu
+  async getHistory(cursor?: string | null): Promise<{ items: any[]; nextCursor: string | null }> {
+    const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+    const response = await fetch(`${__API_URL__}/generate/history${query}`, {
       headers: getAuthHeaders()
     });
-    if (!response.ok) return [];
+    if (!response.ok) return { items: [], nextCursor: null };
+    return { items: await response.json(), nextCursor: response.headers.get('X-Next-Cursor') };
+  },
+
+  // Chi tiết một banner (gồm prompt_used, không có trong danh sách)
+  async getHistoryItem(id: number): Promise<any> {
+    const response = await fetch(`${__API_URL__}/generate/history/${id}`, {
+      headers: getAuthHeaders()
+    });
+    if (!response.ok) throw new Error('Failed to fetch banner detail');
     return response.json();
   },
 
@@ -78,8 +78,10 @@ export interface BannerHistoryItem {
   request_description: string;
   aspect_ratio: string;
   resolution: string;
-  prompt_used: string;
+  prompt_used?: string; // Chỉ có trong API chi tiết
   image_url: string;
+  thumbnail_url?: string;
+  srcset?: string | null;
   token_cost: number;
   created_at: string;
   reference_images?: string;
@@ -91,6 +93,8 @@ export interface BannerHistoryItem {
 export interface PublicBannerItem {
   id: number;
   image_url: string;
+  thumbnail_url?: string;
+  srcset?: string | null;
   request_description: string;
   aspect_ratio: string;
   created_at: string;
@@ -0,0 +1,30 @@
+import unittest
+
+from app.utils.semantic_cache import SemanticPromptCache
+
+
+class SemanticPromptCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = SemanticPromptCache()
+        self.cache.enabled = True
+        self.cache.track_similarity = False
+        self.cache.remember("Banner SUMMER SALE giảm 30%, tông đỏ")
+
+    def test_reworded_request_reuses_result(self):
+        self.assertEqual(
+            self.cache.find_similar("tông đỏ,   Banner SUMMER SALE giảm 30%"),
+            ["Banner SUMMER SALE giảm 30%, tông đỏ"],
+        )
+
+    def test_case_only_difference_is_a_miss(self):
+        self.assertEqual(self.cache.find_similar("Banner summer sale giảm 30%, tông đỏ"), [])
+
+    def test_different_number_is_a_miss(self):
+        self.assertEqual(self.cache.find_similar("Banner SUMMER SALE giảm 50%, tông đỏ"), [])
+
+    def test_same_request_is_not_an_alternate(self):
+        self.assertEqual(self.cache.find_similar("Banner SUMMER SALE giảm 30%, tông đỏ"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()